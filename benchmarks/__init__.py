@@ -0,0 +1,9 @@
+''' Benchmarks for Minion.
+
+    python -m benchmarks.generate [options] <directory>
+        Build a synthetic notes tree.
+    python -m benchmarks.run [options] [<benchmark> ...]
+        Time Minion commands against a generated tree.
+
+Run them from the top folder of the Minion source.
+'''
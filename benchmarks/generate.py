@@ -0,0 +1,267 @@
+''' Build a synthetic notes tree for the benchmarks.
+
+The same options and seed always give the same folders, file names and
+contents, so timings can be compared between commits. Dates in the notes
+are around DATES_AROUND; modification times are spread over the days
+before the tree was made, so `minion recent` has something to find.
+
+Run it as `python -m benchmarks.generate`, from the top Minion folder.
+
+Usage:
+    generate [options] <directory>
+
+Options:
+    --files=<count>         Number of notes, 1000 to 1000000 [default: 1000]
+    --fanout=<count>        Folders in the notes folder, and in each of
+                            those [default: 8]
+    --archive-months=<n>    Monthly archive folders [default: 12]
+    --tag-density=<share>   Share of notes with a tags line [default: 0.5]
+    --date-density=<share>  Share of notes with dates in them [default: 0.3]
+    --body-size=<bytes>     Typical (median) note size [default: 1500]
+    --huge=<count>          Saved mail threads (mbox) [default: 2]
+    --huge-size=<bytes>     Size of each mail thread [default: 5000000]
+    --seed=<number>         Random seed [default: 0]
+'''
+
+################################################################################
+# IMPORTS
+################################################################################
+
+import math
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+################################################################################
+# GLOBAL CONSTANTS
+################################################################################
+
+DEFAULTS = {
+    'files': 1000,
+    'fanout': 8,
+    'archive_months': 12,
+    'tag_density': 0.5,
+    'date_density': 0.3,
+    'body_size': 1500,
+    'huge': 2,
+    'huge_size': 5000000,
+    'seed': 0,
+}
+
+FOLDERS = ['inbox', 'today', 'next', 'soon', 'someday', 'waiting', 'journal',
+           'wiki', 'blog', 'projects', 'reference', 'people', 'recipes',
+           'travel', 'money', 'house']
+
+TAGS = ['ninja', 'goal', 'email', 'waiting', 'home', 'work', 'idea', 'read',
+        'call', 'buy', 'review', 'someday']
+
+# Words that benchmarks look for, and the share of notes they are in.
+SEARCH_WORDS = [('gordon', 0.05), ('plan', 0.2), ('meeting', 0.1)]
+
+# Share of the notes that are archived, when there are archive folders.
+ARCHIVED_SHARE = 0.3
+
+# Notes were last changed up to this many days before the tree was made.
+MAX_AGE_DAYS = 730
+
+# Dates written in notes are up to MAX_AGE_DAYS before this one.
+DATES_AROUND = date(2024, 6, 1)
+
+SYLLABLES = ['ka', 'lo', 'mi', 'ne', 'ru', 'sa', 'ti', 'vo', 'an', 'el',
+             'or', 'us', 'ber', 'dan', 'fel', 'gro', 'hin', 'jas', 'kel',
+             'mor', 'pet', 'quin', 'rab', 'sol', 'tan', 'wex']
+
+################################################################################
+# FUNCTIONS
+################################################################################
+
+
+def make_words(rng, count):
+    ''' Return count made up words, always the same for the same rng. '''
+    words = set()
+    while len(words) < count:
+        words.add(''.join(rng.choice(SYLLABLES)
+                          for _ in range(rng.randint(1, 4))))
+    return sorted(words)
+
+
+def get_folders(rng, fanout, archive_months, today):
+    ''' Return (folders, weights, archives): the folders to put notes in,
+        how likely each is to get a note, and the archive folders.
+    '''
+    folders = []
+    for name in (FOLDERS * (fanout / len(FOLDERS) + 1))[:fanout]:
+        if name in folders:
+            name = '%s%d' % (name, len(folders))
+        folders.append(name)
+        for child in range(fanout):
+            folders.append(os.path.join(name, '%s-%d' % (name, child)))
+    # A few folders get most of the notes, as in real life.
+    weights = [1.0 / (rank + 1) for rank in range(len(folders))]
+    rng.shuffle(weights)
+
+    archives = []
+    month = date(today.year, today.month, 1)
+    for _ in range(archive_months):
+        month = (month - timedelta(days=1)).replace(day=1)
+        archives.append('archive.%s' % month.strftime('%y.%m'))
+    return folders, weights, archives
+
+
+def pick(rng, items, weights, total):
+    ''' Return one of the items, each as likely as its weight. '''
+    point = rng.random() * total
+    for item, weight in zip(items, weights):
+        point -= weight
+        if point < 0:
+            return item
+    return items[-1]
+
+
+def random_date(rng, today):
+    return today - timedelta(days=rng.randint(-60, MAX_AGE_DAYS))
+
+
+def format_date(rng, day):
+    ''' The date in one of the forms Minion recognizes. '''
+    form = rng.randint(0, 2)
+    if form == 0:
+        return day.isoformat()
+    if form == 1:
+        return '%d/%d/%d' % (day.month, day.day, day.year)
+    return '%d/%d/%02d' % (day.month, day.day, day.year % 100)
+
+
+def make_note(rng, words, number, settings, today):
+    ''' Return (filename, content) for a note. '''
+    title = [rng.choice(words) for _ in range(rng.randint(1, 4))]
+    for word, share in SEARCH_WORDS:
+        if rng.random() < share:
+            title.insert(rng.randint(0, len(title)), word)
+    dated = rng.random() < settings['date_density']
+    if dated and rng.random() < 0.3:
+        title.append(random_date(rng, today).isoformat())
+    # The number keeps names apart, and lets a benchmark open a given note.
+    title.append('n%07d' % number)
+    filename = '-'.join(title) + rng.choice(['.txt'] * 4 + ['.md'])
+
+    lines = [' '.join(title), '=' * 30]
+    if dated:
+        lines.append(':date: %s' % random_date(rng, today).isoformat())
+    tag_line = None
+    if rng.random() < settings['tag_density']:
+        tag_line = ':tags: ' + ' '.join(
+            rng.sample(TAGS, rng.randint(1, 3)))
+        # Mostly at the top, as the templates have it.
+        if rng.random() < 0.8:
+            lines.append(tag_line)
+            tag_line = None
+    lines.append('')
+
+    size = int(min(rng.lognormvariate(math.log(settings['body_size']), 1.0),
+                   settings['body_size'] * 50))
+    length = sum(len(line) + 1 for line in lines)
+    while length < size:
+        line = [rng.choice(words) for _ in range(rng.randint(3, 14))]
+        for word, share in SEARCH_WORDS:
+            if rng.random() < share / 10:
+                line.append(word)
+        if dated and rng.random() < 0.1:
+            line.append(format_date(rng, random_date(rng, today)))
+        line = ' '.join(line)
+        lines.append(line)
+        length += len(line) + 1
+    if tag_line is not None:
+        lines.append(tag_line)
+    return filename, '\n'.join(lines) + '\n'
+
+
+def make_mail_thread(rng, words, number, size, today):
+    ''' Return (filename, content) for a mail thread saved from mutt. '''
+    messages = []
+    length = 0
+    day = random_date(rng, today)
+    while length < size:
+        day += timedelta(days=rng.randint(0, 2))
+        sender = rng.choice(words)
+        body = '\n'.join(
+            ' '.join(rng.choice(words) for _ in range(rng.randint(5, 14)))
+            for _ in range(rng.randint(5, 60)))
+        message = ('From %s@example.com %s\nFrom: %s <%s@example.com>\n'
+                   'Subject: Re: gordon plan\nDate: %s\n\n%s\n\n' % (
+                       sender, day.strftime('%a %b %d 10:00:00 %Y'),
+                       sender.title(), sender, day.isoformat(), body))
+        messages.append(message)
+        length += len(message)
+    messages.append(':tags: email\n')
+    return 'mail-thread-%d.txt' % number, ''.join(messages)
+
+
+def generate_tree(directory, **settings):
+    ''' Fill the directory with a notes tree; see the module docstring for
+        the settings. Returns the settings used, and 'open_term': a term
+        that only one note's name has.
+    '''
+    for key in settings:
+        if key not in DEFAULTS:
+            raise TypeError('Unknown setting: %s' % key)
+    settings = dict(DEFAULTS, **settings)
+    rng = random.Random(settings['seed'])
+    made = time.time()
+    today = DATES_AROUND
+
+    words = make_words(rng, 2000)
+    folders, weights, archives = get_folders(
+        rng, settings['fanout'], settings['archive_months'], today)
+    total = sum(weights)
+    for folder in folders + archives:
+        os.makedirs(os.path.join(directory, folder))
+
+    def write(folder, filename, content):
+        path = os.path.join(directory, folder, filename)
+        f = open(path, 'w')
+        f.write(content)
+        f.close()
+        modified = made - rng.random() * MAX_AGE_DAYS * 24 * 3600
+        os.utime(path, (modified, modified))
+
+    for number in range(settings['files']):
+        if archives and rng.random() < ARCHIVED_SHARE:
+            folder = rng.choice(archives)
+        else:
+            folder = pick(rng, folders, weights, total)
+        filename, content = make_note(rng, words, number, settings, today)
+        write(folder, filename, content)
+
+    if settings['huge']:
+        os.makedirs(os.path.join(directory, 'mail'))
+    for number in range(settings['huge']):
+        filename, content = make_mail_thread(rng, words, number,
+                                             settings['huge_size'], today)
+        write('mail', filename, content)
+
+    settings['open_term'] = 'n%07d' % (settings['files'] / 2)
+    return settings
+
+
+def get_options(args):
+    ''' generate_tree settings from the docopt arguments. '''
+    settings = {}
+    for key, default in DEFAULTS.items():
+        value = args['--' + key.replace('_', '-')]
+        settings[key] = type(default)(value)
+    return settings
+
+
+def main(argv):
+    from docopt import docopt
+    args = docopt(__doc__, argv)
+    if os.path.exists(args['<directory>']):
+        sys.exit('%s is already there.' % args['<directory>'])
+    generate_tree(args['<directory>'], **get_options(args))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,226 @@
+''' Time the brain's busiest functions on their own.
+
+Each benchmark calls one function on a fixed input: a small note, a 1 MB
+saved mail thread, a list of 100000 note paths or a generated notes tree
+(see benchmarks.generate). It is called until --min-time has passed, three
+times over, and the best gives the time per call in nanoseconds.
+
+Python 2 cannot count allocations without a debug build, so `memory_kb`
+is how much more memory the process uses after a call, while its result
+is still held, than before it (on Linux; null elsewhere). Memory a call
+frees again before it returns does not show.
+
+Results are written as JSON. With --compare, functions that got slower
+by more than --threshold percent are listed, and the exit status is 1:
+
+    python -m benchmarks.micro --output=baseline.json
+    (change something)
+    python -m benchmarks.micro --compare=baseline.json
+
+Usage:
+    micro [options] [<benchmark> ...]
+
+Options:
+    --output=<file>         Where to write the JSON results, - for standard
+                            output [default: -]
+    --compare=<file>        JSON results to compare with
+    --threshold=<percent>   Slow down that counts as a regression
+                            [default: 10]
+    --min-time=<seconds>    How long to call each function for, at least
+                            [default: 0.2]
+    --tree=<folder>         Where to make the notes tree
+                            [default: /tmp/minion-micro-benchmarks]
+'''
+
+################################################################################
+# IMPORTS
+################################################################################
+
+import gc
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+from timeit import default_timer as timer
+
+from benchmarks.generate import (generate_tree, make_mail_thread, make_note,
+                                 make_words, DATES_AROUND)
+from benchmarks.run import get_commit, load_results, report, MINION_FILE
+from memory_of_minion import get_memory
+
+################################################################################
+# GLOBAL CONSTANTS
+################################################################################
+
+# Notes in the tree get_files and limit_notes look at.
+TREE_FILES = 1000
+
+LIST_SIZE = 100000
+
+MAIL_SIZE = 1024 * 1024
+
+# How many times the timing is repeated; the best one counts.
+REPEAT = 3
+
+################################################################################
+# FUNCTIONS
+################################################################################
+
+
+def get_inputs(folder):
+    ''' Make the inputs, and a home folder whose ~/.minion points at the
+        tree. Always the same, but for the modification times in the tree.
+    '''
+    if os.path.exists(folder):
+        shutil.rmtree(folder)
+    notes_home = os.path.join(folder, 'notes')
+    generate_tree(notes_home, files=TREE_FILES, huge=0)
+    home = os.path.join(folder, 'home')
+    os.makedirs(home)
+    f = open(os.path.join(home, '.minion'), 'w')
+    f.write(MINION_FILE % notes_home)
+    f.close()
+
+    rng = random.Random(0)
+    words = make_words(rng, 2000)
+    settings = {'date_density': 1.0, 'tag_density': 1.0, 'body_size': 1500}
+    _, small_note = make_note(rng, words, 0, settings, DATES_AROUND)
+    _, mail = make_mail_thread(rng, words, 0, MAIL_SIZE, DATES_AROUND)
+    paths = ['%s/%s/%s-n%07d.txt' % (
+        notes_home, rng.choice(['inbox', 'soon', 'someday/later']),
+        '-'.join(rng.choice(words) for _ in range(rng.randint(1, 4))),
+        number) for number in range(LIST_SIZE)]
+    return home, notes_home, {
+        'small note': small_note,
+        'mail thread': mail,
+        'paths': paths,
+        'counts': [(len(path), path) for path in paths],
+    }
+
+
+def get_benchmarks(brain, notes_home, inputs):
+    ''' Return [(name, function to time)]. '''
+    small_note = inputs['small note']
+    mail = inputs['mail thread']
+    paths = inputs['paths']
+    counts = inputs['counts']
+    notes = brain.get_files(notes_home)
+    tags = ['ninja', 'goal', 'email', 'Gordon', 'plan', 'work']
+    return [
+        ('get_unique_dates[small note]',
+         lambda: brain.get_unique_dates(small_note)),
+        ('get_unique_dates[mail thread]',
+         lambda: brain.get_unique_dates(mail)),
+        ('limit_notes[1000 notes, tags]',
+         lambda: brain.limit_notes('ninja', notes)),
+        ('limit_notes[1000 notes, full text]',
+         lambda: brain.limit_notes('gordon', notes, full=True)),
+        ('content_has_tag[small note]',
+         lambda: brain.content_has_tag(small_note, 'ninja')),
+        ('content_has_tag[mail thread]',
+         lambda: brain.content_has_tag(mail, 'ninja')),
+        ('add_tags[small note]', lambda: brain.add_tags(tags, small_note)),
+        ('add_tags[mail thread]', lambda: brain.add_tags(tags, mail)),
+        ('create_tag_line[6 tags]', lambda: brain.create_tag_line(tags)),
+        ('clean_output[10 paths]', lambda: brain.clean_output(paths[:10])),
+        ('clean_output[100000 paths]', lambda: brain.clean_output(paths)),
+        ('format_2_cols[10 rows]', lambda: brain.format_2_cols(counts[:10])),
+        ('format_2_cols[100000 rows]',
+         lambda: brain.format_2_cols(counts)),
+        ('string_to_file_name',
+         lambda: brain.string_to_file_name('Cave security plan/Gordon')),
+        ('get_files[1000 notes]', lambda: brain.get_files(notes_home)),
+    ]
+
+
+def time_function(function, min_time):
+    ''' Return the best time for a call, in nanoseconds. '''
+    # Find how many calls take min_time, as timeit does.
+    loops = 1
+    while True:
+        started = timer()
+        for _ in xrange(loops):
+            function()
+        took = timer() - started
+        if took >= min_time:
+            break
+        loops *= 10 if took < min_time / 10 else 2
+    best = took
+    for _ in range(REPEAT - 1):
+        started = timer()
+        for _ in xrange(loops):
+            function()
+        best = min(best, timer() - started)
+    return best * 1e9 / loops
+
+
+def measure_memory(function):
+    ''' Return how much more memory, in KiB, is in use after a call than
+        before it, with its result held; None if that cannot be told.
+    '''
+    gc.collect()
+    before = get_memory()
+    result = function()
+    after = get_memory()
+    del result
+    if before is None or after is None:
+        return None
+    return after - before
+
+
+def run_benchmarks(benchmarks, names, min_time):
+    results = {}
+    for name, function in benchmarks:
+        if names and name.split('[')[0] not in names and name not in names:
+            continue
+        # A first call to load settings and fill caches.
+        function()
+        results[name] = {
+            'ns_per_op': time_function(function, min_time),
+            'memory_kb': measure_memory(function),
+        }
+        print >> sys.stderr, '%-36s %14.0f ns %8s KiB' % (
+            name, results[name]['ns_per_op'], results[name]['memory_kb'])
+    return results
+
+
+def main(argv):
+    from docopt import docopt
+    args = docopt(__doc__, argv)
+
+    home, notes_home, inputs = get_inputs(os.path.abspath(args['--tree']))
+    # Settings are read when the brain is first used.
+    os.environ['HOME'] = home
+    import brain_of_minion as brain
+    benchmarks = get_benchmarks(brain, notes_home, inputs)
+    unknown = [name for name in args['<benchmark>'] if not any(
+        x == name or x.split('[')[0] == name for x, _ in benchmarks)]
+    if unknown:
+        sys.exit('No such benchmark: %s' % ', '.join(unknown))
+
+    results = {
+        'commit': get_commit(),
+        'python': platform.python_version(),
+        'results': run_benchmarks(benchmarks, args['<benchmark>'],
+                                  float(args['--min-time'])),
+    }
+    shutil.rmtree(os.path.abspath(args['--tree']))
+
+    output = json.dumps(results, indent=4, sort_keys=True)
+    if args['--output'] == '-':
+        print output
+    else:
+        f = open(args['--output'], 'w')
+        f.write(output + '\n')
+        f.close()
+
+    if args['--compare']:
+        report(load_results(args['--compare']), results,
+               float(args['--threshold']), key='ns_per_op',
+               value_format='%12.0fns', name_width=36)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
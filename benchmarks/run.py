@@ -0,0 +1,271 @@
+''' Time Minion commands against a generated notes tree.
+
+Each benchmark runs the minion script, as a user would, with a home folder
+of its own whose ~/.minion points at the tree (see benchmarks.generate).
+The tree is kept in --tree and made again only when its options change.
+
+Results are written as JSON, to compare with those of another commit:
+
+    python -m benchmarks.run --output=before.json
+    (change something)
+    python -m benchmarks.run --output=after.json --compare=before.json
+
+A benchmark regressed if its median time grew by more than --threshold
+percent; the exit status is then 1.
+
+Usage:
+    run compare [--threshold=<percent>] <before> <after>
+    run [options] [<benchmark> ...]
+
+Options:
+    --tree=<folder>         Where to keep the generated tree
+                            [default: /tmp/minion-benchmarks]
+    --repeat=<count>        Times to run each benchmark [default: 5]
+    --output=<file>         Where to write the JSON results, - for standard
+                            output [default: -]
+    --compare=<file>        JSON results to compare with
+    --threshold=<percent>   Slow down that counts as a regression
+                            [default: 10]
+    --files=<count>         Number of notes [default: 1000]
+    --fanout=<count>        Folders in the notes folder, and in each of
+                            those [default: 8]
+    --archive-months=<n>    Monthly archive folders [default: 12]
+    --tag-density=<share>   Share of notes with a tags line [default: 0.5]
+    --date-density=<share>  Share of notes with dates in them [default: 0.3]
+    --body-size=<bytes>     Typical (median) note size [default: 1500]
+    --huge=<count>          Saved mail threads (mbox) [default: 2]
+    --huge-size=<bytes>     Size of each mail thread [default: 5000000]
+    --seed=<number>         Random seed [default: 0]
+'''
+
+################################################################################
+# IMPORTS
+################################################################################
+
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+from timeit import default_timer as timer
+
+from benchmarks.generate import generate_tree, get_options
+
+################################################################################
+# GLOBAL CONSTANTS
+################################################################################
+
+MINION = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'minion')
+
+# name: (minion arguments, what to type at its prompts)
+# {open_term} is a term only one note's name has.
+BENCHMARKS = [
+    ('list', (['list', 'gordon'], '')),
+    ('find', (['find', 'ninja', 'goal', 'gordon'], '')),
+    # Refine the matches at the prompt, as `minion open` asks for.
+    ('open', (['open', 'plan'], 'meeting\n!\n')),
+    ('open one', (['open', '{open_term}'], '')),
+    ('dates', (['dates', '--year=2024', '--month=3'], '')),
+    ('recent', (['recent', '--days=30'], '')),
+    ('summary', (['summary'], '')),
+    ('strays', (['strays'], 'q\n')),
+    ('collect', (['collect', 'gordon'], '')),
+]
+
+MINION_FILE = '''[notes]
+home = %s
+
+[compose]
+editor = true
+'''
+
+################################################################################
+# FUNCTIONS
+################################################################################
+
+
+def get_tree(folder, settings):
+    ''' Return (notes home, tree settings), making the tree if the one in
+        the folder was made with other settings.
+    '''
+    notes_home = os.path.join(folder, 'notes')
+    settings_file = os.path.join(folder, 'tree.json')
+    if os.path.exists(settings_file):
+        f = open(settings_file)
+        made = json.load(f)
+        f.close()
+        if dict((key, made[key]) for key in settings) == settings:
+            return notes_home, made
+        shutil.rmtree(folder)
+
+    print >> sys.stderr, 'Making a tree of %d notes in %s ...' % (
+        settings['files'], notes_home)
+    os.makedirs(folder)
+    made = generate_tree(notes_home, **settings)
+    f = open(settings_file, 'w')
+    json.dump(made, f, indent=4, sort_keys=True)
+    f.close()
+    return notes_home, made
+
+
+def make_home(folder, notes_home):
+    ''' Return a home folder whose ~/.minion points at the notes. '''
+    home = os.path.join(folder, 'home')
+    if os.path.exists(home):
+        shutil.rmtree(home)
+    os.makedirs(home)
+    f = open(os.path.join(home, '.minion'), 'w')
+    f.write(MINION_FILE % notes_home)
+    f.close()
+    return home
+
+
+def remove_collections(notes_home):
+    ''' collect writes a note; remove them so every run does the same. '''
+    for folder, _, files in os.walk(notes_home):
+        for filename in files:
+            if filename.startswith('Collected'):
+                os.remove(os.path.join(folder, filename))
+
+
+def run_minion(arguments, typed, home):
+    ''' Run the minion script; return (seconds, exit code, output). '''
+    environment = dict(os.environ, HOME=home)
+    started = timer()
+    process = subprocess.Popen(
+        [sys.executable, MINION] + arguments, env=environment,
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT)
+    output, _ = process.communicate(typed)
+    return timer() - started, process.returncode, output
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) / 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def run_benchmarks(names, home, notes_home, tree, repeat):
+    ''' Return {name: {'arguments', 'times', 'median', 'best'}}. '''
+    results = {}
+    for name, (arguments, typed) in BENCHMARKS:
+        if names and name not in names:
+            continue
+        arguments = [x.format(**tree) for x in arguments]
+        times = []
+        # Once more than asked, so the first run warms the disk cache.
+        for run in range(repeat + 1):
+            seconds, code, output = run_minion(arguments, typed, home)
+            if arguments[0] == 'collect':
+                remove_collections(notes_home)
+            if code:
+                sys.exit('minion %s failed:\n%s' % (' '.join(arguments),
+                                                     output))
+            if run:
+                times.append(seconds)
+        results[name] = {
+            'arguments': arguments,
+            'times': times,
+            'median': median(times),
+            'best': min(times),
+        }
+        print >> sys.stderr, '%-10s %8.3fs' % (name, median(times))
+    return results
+
+
+def get_commit():
+    ''' The commit of the Minion source, if it is in git. '''
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(MINION), stderr=open(os.devnull, 'w')).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare_results(before, after, threshold, key='median'):
+    ''' Return (name, before, after, change in percent, regressed) for each
+        benchmark in both sets of results, comparing their key values.
+    '''
+    rows = []
+    for name in sorted(set(before['results']) & set(after['results'])):
+        old = before['results'][name][key]
+        new = after['results'][name][key]
+        change = (new - old) * 100.0 / old if old else 0.0
+        rows.append((name, old, new, change, change > threshold))
+    return rows
+
+
+def format_report(rows, threshold, value_format='%9.4fs', name_width=12):
+    line_format = '%%-%ds %s %s %%+7.1f%%%%' % (name_width, value_format,
+                                              value_format)
+    lines = ['%-*s %10s %10s %8s' % (name_width, 'benchmark', 'before',
+                                     'after', 'change')]
+    for name, old, new, change, regressed in rows:
+        line = line_format % (name, old, new, change)
+        if regressed:
+            line += '  REGRESSION'
+        lines.append(line)
+    regressions = len([row for row in rows if row[-1]])
+    lines.append('%d of %d benchmarks slowed down by more than %s%%.' % (
+        regressions, len(rows), threshold))
+    return '\n'.join(lines)
+
+
+def load_results(filename):
+    f = open(filename)
+    results = json.load(f)
+    f.close()
+    return results
+
+
+def report(before, after, threshold, key='median', **formatting):
+    ''' Print the comparison; exit with 1 if anything regressed. '''
+    rows = compare_results(before, after, threshold, key)
+    print >> sys.stderr, format_report(rows, threshold, **formatting)
+    if any(row[-1] for row in rows):
+        sys.exit(1)
+
+
+def main(argv):
+    from docopt import docopt
+    args = docopt(__doc__, argv)
+    threshold = float(args['--threshold'])
+    if args['compare']:
+        report(load_results(args['<before>']),
+               load_results(args['<after>']), threshold)
+        return
+
+    unknown = set(args['<benchmark>']) - set(x for x, _ in BENCHMARKS)
+    if unknown:
+        sys.exit('No such benchmark: %s' % ', '.join(sorted(unknown)))
+
+    folder = os.path.abspath(args['--tree'])
+    notes_home, tree = get_tree(folder, get_options(args))
+    home = make_home(folder, notes_home)
+    results = {
+        'commit': get_commit(),
+        'python': platform.python_version(),
+        'tree': tree,
+        'results': run_benchmarks(args['<benchmark>'], home, notes_home,
+                                  tree, int(args['--repeat'])),
+    }
+    output = json.dumps(results, indent=4, sort_keys=True)
+    if args['--output'] == '-':
+        print output
+    else:
+        f = open(args['--output'], 'w')
+        f.write(output + '\n')
+        f.close()
+
+    if args['--compare']:
+        report(load_results(args['--compare']), results, threshold)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -2,16 +2,34 @@
 # IMPORTS
 ################################################################################
 
+import cPickle
 import subprocess
 import shutil
+import errno
 import os
 from datetime import date, timedelta, datetime, time
 import re
 from ConfigParser import SafeConfigParser
-from collections import defaultdict
+from collections import defaultdict, deque, namedtuple
+import heapq
+from itertools import islice
 import logging
-import platform
+import stat
 import sys
+from time import mktime
+from timeit import default_timer as timer
+
+try:
+    from os import scandir
+except ImportError:  # pragma: no cover
+    # Python 2 needs the scandir backport; without it we use ListdirEntry.
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+import stats_of_minion as stats
+from trace_of_minion import span
 
 LOGGER = logging.getLogger(__name__)
 
@@ -21,54 +39,140 @@ LOGGER = logging.getLogger(__name__)
 
 CONFIG_FILE = '~/.minion'
 
-# Linux preferred apps to view files:
-NON_TEXT_VIEWERS = {
-    'default': 'cat %s | less',
-    '.pdf': 'evince',
-    '.jpg': 'eog',
-    '.jpeg': 'eog',
-    '.png': 'eog',
-    '.doc': 'libreoffice',
-    '.docx': 'libreoffice',
-    '.xls': 'libreoffice',
-    '.xlsx': 'libreoffice',
-}
-
-# Mac OSX 10.9 preferred apps to view files:
-if 'Darwin' in platform.platform():
-    NON_TEXT_VIEWERS = {
-        'default': '/usr/bin/open',
-        '.doc': '/usr/bin/open',
-        '.docx': '/usr/bin/open',
-        '.gdoc': '/usr/bin/open',
-        '.gdraw': '/usr/bin/open',
-        '.gsheet': '/usr/bin/open',
-        '.gslides': '/usr/bin/open',
-        '.jpg': '/usr/bin/open',
-        '.jpeg': '/usr/bin/open',
-        '.pdf': '/usr/bin/open',
-        '.xls': '/usr/bin/open',
-        '.xlsx': '/usr/bin/open',
-    }
+# Notes at least this large (in bytes) are searched through a memory map
+# rather than read into memory.
+MAP_NOTES_FROM = 64 * 1024
+
+################################################################################
+# FUNCTIONS
+################################################################################
+
+class LazyGlobal(object):
+    ''' A module global that is worked out the first time it is used, and
+        then kept, so importing the brain stays quick and free of side
+        effects. Stands in for the value: attributes, items and `in` are
+        passed on to it.
+    '''
+
+    # Time spent loading globals while another one was loading.
+    nested_time = 0.0
+
+    def __init__(self, name, load):
+        self.name = name
+        self.load = load
+        self.load_time = None
+        self._value = None
+        self._loaded = False
+
+    def value(self):
+        if not self._loaded:
+            outer_time = LazyGlobal.nested_time
+            LazyGlobal.nested_time = 0.0
+            started = timer()
+            try:
+                with span('load ' + self.name):
+                    self._value = self.load()
+            finally:
+                took = timer() - started
+                # Only count the time spent on this global itself.
+                self.load_time = took - LazyGlobal.nested_time
+                LazyGlobal.nested_time = outer_time + took
+            self._loaded = True
+        return self._value
+
+    def is_loaded(self):
+        return self._loaded
+
+    def reset(self):
+        ''' Forget the value; it is worked out again when next used. '''
+        self._value = None
+        self._loaded = False
+        self.load_time = None
+
+    def __getattr__(self, name):
+        return getattr(self.value(), name)
+
+    def __contains__(self, item):
+        return item in self.value()
+
+    def __getitem__(self, key):
+        return self.value()[key]
+
+    def __iter__(self):
+        return iter(self.value())
+
+    def __len__(self):
+        return len(self.value())
+
+    def __repr__(self):
+        if not self._loaded:
+            return '<%s, not loaded yet>' % self.name
+        return repr(self._value)
+
+
+def get_platform_name():
+    # Importing platform and asking it takes a while, so only do it when
+    # needed.
+    import platform
+    return platform.platform()
+
+
+PLATFORM_NAME = LazyGlobal('platform name', get_platform_name)
+
 
-# Cygwin preferred apps to view files:
-if 'CYGWIN' in platform.platform():
-    NON_TEXT_VIEWERS = {
+def get_non_text_viewers():
+    ''' Return the programs to view non-text files with, by extension. '''
+    platform_name = PLATFORM_NAME.value()
+
+    # Linux preferred apps to view files:
+    viewers = {
         'default': 'cat %s | less',
-        '.pdf': 'cmd /q /c start "Launched by Minion"',
-        '.jpg': 'cmd /q /c start "Launched by Minion"',
-        '.jpeg': 'cmd /q /c start "Launched by Minion"',
-        '.png': 'cmd /q /c start "Launched by Minion"',
-        '.doc': 'cmd /q /c start "Launched by Minion"',
-        '.docx': 'cmd /q /c start "Launched by Minion"',
-        '.xls': 'cmd /q /c start "Launched by Minion"',
-        '.xlsx': 'cmd /q /c start "Launched by Minion"',
+        '.pdf': 'evince',
+        '.jpg': 'eog',
+        '.jpeg': 'eog',
+        '.png': 'eog',
+        '.doc': 'libreoffice',
+        '.docx': 'libreoffice',
+        '.xls': 'libreoffice',
+        '.xlsx': 'libreoffice',
     }
 
+    # Mac OSX 10.9 preferred apps to view files:
+    if 'Darwin' in platform_name:
+        viewers = {
+            'default': '/usr/bin/open',
+            '.doc': '/usr/bin/open',
+            '.docx': '/usr/bin/open',
+            '.gdoc': '/usr/bin/open',
+            '.gdraw': '/usr/bin/open',
+            '.gsheet': '/usr/bin/open',
+            '.gslides': '/usr/bin/open',
+            '.jpg': '/usr/bin/open',
+            '.jpeg': '/usr/bin/open',
+            '.pdf': '/usr/bin/open',
+            '.xls': '/usr/bin/open',
+            '.xlsx': '/usr/bin/open',
+        }
+
+    # Cygwin preferred apps to view files:
+    if 'CYGWIN' in platform_name:
+        viewers = {
+            'default': 'cat %s | less',
+            '.pdf': 'cmd /q /c start "Launched by Minion"',
+            '.jpg': 'cmd /q /c start "Launched by Minion"',
+            '.jpeg': 'cmd /q /c start "Launched by Minion"',
+            '.png': 'cmd /q /c start "Launched by Minion"',
+            '.doc': 'cmd /q /c start "Launched by Minion"',
+            '.docx': 'cmd /q /c start "Launched by Minion"',
+            '.xls': 'cmd /q /c start "Launched by Minion"',
+            '.xlsx': 'cmd /q /c start "Launched by Minion"',
+        }
+
+    return viewers
+
+
+NON_TEXT_VIEWERS = LazyGlobal('file viewers', get_non_text_viewers)
 
-################################################################################
-# FUNCTIONS
-################################################################################
 
 def _settings_parser(default_notes_dir='~/minion/notes'):
     ''' Create the parser for the settings file. '''
@@ -97,6 +201,20 @@ def _settings_parser(default_notes_dir='~/minion/notes'):
     settings.set('date', 'format', '%%Y-%%m-%%d')
     # Sort actions
     settings.add_section('sort_actions')
+    # Performance settings
+    settings.add_section('performance')
+    settings.set('performance', 'use_index', 'false')
+    settings.set('performance', 'index_file', '~/.minion.d/index.sqlite')
+    settings.set('performance', 'index_max_age', '2')
+    settings.set('performance', 'names_file', '~/.minion.d/names.pickle')
+    # index_of_minion.SUBSTRING, without importing the index (and SQLite).
+    settings.set('performance', 'full_text_mode', 'substring')
+    settings.set('performance', 'walk_workers', '1')
+    settings.set('performance', 'read_workers', '1')
+    settings.set('performance', 'watch_interval', '1')
+    settings.set('performance', 'startup_budget_ms', '100')
+    settings.set('performance', 'header_bytes', '0')
+    settings.set('performance', 'max_memory_mb', '0')
 
     return settings
 
@@ -108,11 +226,13 @@ def get_settings():
 
     # Load if available, write defaults if not.
     if os.path.exists(minion_file):
+        stats.count('files opened')
         settings.read([minion_file])
     else:  # pragma: no cover
         f = open(minion_file, 'w')
         settings.write(f)
         f.close()
+        stats.count('files written')
 
     # Pre-process some settings
 
@@ -127,7 +247,34 @@ def get_settings():
     return settings
 
 
-GLOBAL_SETTINGS = get_settings()
+def get_settings_mtime():
+    ''' Modification time of the settings file, or None if there is none. '''
+    stats.count('files stat-ed')
+    try:
+        return os.path.getmtime(os.path.expanduser(CONFIG_FILE))
+    except OSError:
+        return None
+
+
+def load_settings():
+    ''' Read the settings, noting when the settings file was changed. '''
+    global SETTINGS_MTIME
+    SETTINGS_MTIME = get_settings_mtime()
+    return get_settings()
+
+
+GLOBAL_SETTINGS = LazyGlobal('settings', load_settings)
+SETTINGS_MTIME = None
+
+
+def refresh_settings():
+    ''' Re-read the settings if the settings file changed since they were
+        read, and recalculate the template data (today's date and such).
+        For long running processes, such as the Minion server.
+    '''
+    if GLOBAL_SETTINGS.is_loaded() and get_settings_mtime() != SETTINGS_MTIME:
+        GLOBAL_SETTINGS.reset()
+    GLOBAL_DATA.reset()
 
 
 def get_setting(section, key):
@@ -158,19 +305,91 @@ def get_global_data():
     return data
 
 
-GLOBAL_DATA = get_global_data()
+GLOBAL_DATA = LazyGlobal('template data', get_global_data)
+
+
+# The settings the busiest code needs, worked out once; see
+# get_resolved_settings().
+ResolvedSettings = namedtuple('ResolvedSettings', [
+    'notes_home',           # Expanded, but not necessarily there yet.
+    'filename_sep',
+    'extension',
+    'tagline',
+    'tags_case_sensitive',  # True or False
+    'included_exts',        # Tuples of file name endings
+    'excluded_exts',
+    'header_bytes',         # 0 to always read whole files
+    'max_memory_mb',        # 0 for no limit
+])
+
+RESOLVED_SETTINGS = None
+RESOLVED_SETTINGS_KEY = None
+
+
+def resolve_settings():
+    ''' Return a ResolvedSettings worked out from the current settings. '''
+    return ResolvedSettings(
+        notes_home=os.path.expanduser(get_setting('notes', 'home')),
+        filename_sep=get_setting('compose', 'filename_sep'),
+        extension=get_setting('compose', 'extension'),
+        tagline=get_setting('compose', 'tagline'),
+        tags_case_sensitive=(
+            get_setting('compose', 'tags_case_sensitive') == 'true'),
+        included_exts=tuple(get_setting(
+            'notes', 'notes_included_extensions').replace(' ', '').split(',')),
+        excluded_exts=tuple(get_setting(
+            'notes', 'notes_excluded_extensions').replace(' ', '').split(',')),
+        header_bytes=max(0, int(get_setting('performance', 'header_bytes'))),
+        max_memory_mb=max(0, int(get_setting('performance', 'max_memory_mb'))),
+    )
+
+
+def get_resolved_settings():
+    ''' Return the settings that are looked at for every file or result,
+        without going through the settings parser each time.
+
+        Worked out again only when the settings are re-read (see
+        refresh_settings), or get_setting is replaced (as the tests do).
+        Loops should get it once and pass it on.
+    '''
+    global RESOLVED_SETTINGS, RESOLVED_SETTINGS_KEY
+    key = (get_setting, GLOBAL_SETTINGS.value())
+    if key != RESOLVED_SETTINGS_KEY:
+        RESOLVED_SETTINGS = resolve_settings()
+        RESOLVED_SETTINGS_KEY = key
+    return RESOLVED_SETTINGS
+
+
+def get_load_times():
+    ''' Return (name, seconds) for each lazy global loaded so far. '''
+    return [(lazy.name, lazy.load_time)
+            for lazy in (GLOBAL_SETTINGS, GLOBAL_DATA, PLATFORM_NAME,
+                         NON_TEXT_VIEWERS)
+            if lazy.is_loaded()]
 
 
 def list_stray_files(count=2):
     ''' Find all files whose folder only has one or two files. '''
     notes_home = get_notes_home()
-    folders = os.listdir(notes_home)
     results = []
+
+    index = get_note_index()
+    if index is not None:
+        for full_folder in index.get_folders():
+            if 'archive' not in os.path.basename(full_folder):
+                files = index.get_children(full_folder)
+                if len(files) <= count:
+                    results.extend(files)
+        return results
+
+    folders = os.listdir(notes_home)
+    stats.count('folders listed')
     for folder in folders:
         if 'archive' not in folder:
             full_folder = os.path.join(notes_home, folder)
             if os.path.isdir(full_folder):
                 files = os.listdir(full_folder)
+                stats.count('folders listed')
                 if len(files) <= count:
                     for filename in files:
                         results.append(os.path.join(full_folder, filename))
@@ -198,44 +417,63 @@ def sort_files_interactive(match_files):
         open_files(to_open)
 
 
+# Dates Minion recognizes, in one pattern so content is only scanned once:
+#   m.d.Y  m.d.y  m/d/Y  m/d/y  and  Y-m-d
+# As with strptime, two digit years 69-99 are 1969-1999, the rest 20xx.
+# The trailing non-digit makes sure we have the whole number.
+DATE_RE = re.compile(
+    r'(\d{1,2})([./])(\d{1,2})\2(\d{4}|\d{2})\D'
+    r'|(\d{4})-(\d{2})-(\d{2})\D')
+
+# Earliest and latest dates we believe are real dates.
+FIRST_DATE = date(2010, 1, 1)
+LAST_DATE = date(2049, 12, 31)
+
+# Date strings seen before, and the date they stand for (or None).
+DATE_CACHE = {}
+DATE_CACHE_SIZE = 10000
+
+
+def parse_date_match(match):
+    ''' Return the date for a DATE_RE match, or None if it is not valid. '''
+    text = match.group(0)
+    if text[:-1] in DATE_CACHE:
+        stats.count_cache('dates', True)
+        return DATE_CACHE[text[:-1]]
+    stats.count_cache('dates', False)
+
+    month, _, day, year, iso_year, iso_month, iso_day = match.groups()
+    if iso_year is not None:
+        year, month, day = iso_year, iso_month, iso_day
+    elif len(year) == 2:
+        year = int(year)
+        year += 2000 if year < 69 else 1900
+    try:
+        new_date = date(int(year), int(month), int(day))
+    except ValueError:
+        new_date = None
+    # Double check we are picking up a valid dates
+    if new_date is not None and not (FIRST_DATE < new_date < LAST_DATE):
+        new_date = None
+
+    if len(DATE_CACHE) >= DATE_CACHE_SIZE:
+        DATE_CACHE.clear()
+    DATE_CACHE[text[:-1]] = new_date
+    return new_date
+
+
 def get_unique_dates(content):
     '''Return all the unique dates in the content'''
-
-    recognizers = {
-        '\d{1,2}\.\d{1,2}\.\d{4}\D': '%m.%d.%Y',
-        '\d{1,2}\.\d{1,2}\.\d{2}\D': '%m.%d.%y',
-        '\d{1,2}/\d{1,2}/\d{4}\D': '%m/%d/%Y',
-        '\d{1,2}/\d{1,2}/\d{2}\D': '%m/%d/%y',
-        '\d{4}-\d{2}-\d{2}\D': '%Y-%m-%d'}
-
-    # Find dates in the content
-    dates = []
-    for key in recognizers:
-        r = re.compile(key)
-        matches = r.findall(content)
-        if matches:
-            date_format = recognizers[key]
-            for match in matches:
-                try:
-                    # We have to remove the last character from 'match'.
-                    # It is the first non-digit character at the end.
-                    new_date = datetime.strptime(match[:-1], date_format).date()
-                    # Double check we are picking up a valid dates
-                    if (new_date > date(2010, 1, 1)) and\
-                       (new_date < date(2049, 12, 31)):
-                        dates.append(new_date)
-                except ValueError:
-                    pass
-                except TypeError:
-                    print "Ignored " + match
+    dates = set()
+    for match in DATE_RE.finditer(content):
+        new_date = parse_date_match(match)
+        if new_date is not None:
+            dates.add(new_date)
 
     if len(dates) == 0:
         return None
-    # find all unique dates and sort them
-    dates = list(set(dates))
-    dates.sort()
-
-    return dates
+    # sort the unique dates
+    return sorted(dates)
 
 
 def get_first_date(content):
@@ -245,6 +483,74 @@ def get_first_date(content):
     return datetime.combine(get_unique_dates(content)[0], time())
 
 
+# How much of a file is looked at to tell whether it is text.
+SNIFF_SIZE = 1024
+
+# Text files may start with a byte order mark (UTF-8, UTF-16, UTF-32)...
+TEXT_MARKS = ('\xef\xbb\xbf', '\xff\xfe', '\xfe\xff', '\x00\x00\xfe\xff')
+
+# ...binary files with one of these (zip and office files, PDF, images,
+# audio, compressed files, SQLite databases, programs).
+BINARY_MARKS = ('PK\x03\x04', '%PDF', '\x89PNG', '\xff\xd8\xff', 'GIF8',
+                'ID3', 'OggS', 'fLaC', 'RIFF', '\x1f\x8b', 'BZh', '7z\xbc\xaf',
+                'Rar!', '\xfd7zXZ', 'SQLite format 3\x00', '\x7fELF',
+                '\xd0\xcf\x11\xe0', '\xca\xfe\xba\xbe', '\xcf\xfa\xed\xfe')
+
+# {path: ((modification time, size), True if the file is binary)}
+BINARY_FILES = {}
+BINARY_FILES_SIZE = 100000
+
+
+def is_binary_block(block):
+    ''' Return true if the start of a file looks like anything but text. '''
+    if block.startswith(TEXT_MARKS):
+        return False
+    if block.startswith(BINARY_MARKS):
+        return True
+    return '\x00' in block
+
+
+def is_binary_file(filename, f=None):
+    ''' Return true if the file is not text, judging by its first block.
+
+        The verdict is kept until the file's modification time or size
+        changes. f, the file already open for reading, saves opening it
+        again; it is left at the start.
+    '''
+    stats.count('files stat-ed')
+    try:
+        if f is None:
+            file_stat = os.stat(filename)
+        else:
+            file_stat = os.fstat(f.fileno())
+    except OSError:
+        return False
+    key = (file_stat.st_mtime, file_stat.st_size)
+    known = BINARY_FILES.get(filename)
+    if known is not None and known[0] == key:
+        stats.count_cache('binary files', True)
+        return known[1]
+    stats.count_cache('binary files', False)
+
+    try:
+        if f is None:
+            sniffed = open(filename, 'rb')
+            stats.count('files opened')
+            block = sniffed.read(SNIFF_SIZE)
+            sniffed.close()
+        else:
+            block = f.read(SNIFF_SIZE)
+            f.seek(0)
+    except IOError:
+        return False
+    stats.count('bytes read', len(block))
+    binary = is_binary_block(block)
+    if len(BINARY_FILES) >= BINARY_FILES_SIZE:
+        BINARY_FILES.clear()
+    BINARY_FILES[filename] = (key, binary)
+    return binary
+
+
 def get_file_content(filename, include_filename=True):
     ''' Yep. '''
     content = ""
@@ -253,9 +559,13 @@ def get_file_content(filename, include_filename=True):
     _, extension = os.path.splitext(filename)
     extension.lower()
     if extension not in NON_TEXT_VIEWERS:
-        f = open(filename, 'r')
-        content = f.read()
-        f.close()
+        with span('read', file=filename):
+            f = open(filename, 'r')
+            stats.count('files opened')
+            if not is_binary_file(filename, f):
+                content = f.read()
+                stats.count('bytes read', len(content))
+            f.close()
 
     # Always treat the filename as if part of the content.
     if include_filename:
@@ -264,36 +574,132 @@ def get_file_content(filename, include_filename=True):
     return content
 
 
-def limit_to_year(year, file_list):
-    '''Return only files from the list whose first date is within
-    the specified year.
+def get_file_head(filename, include_filename=True):
+    ''' Return (content, whole): like get_file_content, but with
+        [performance] header_bytes set, only the complete lines within that
+        many bytes at the start of the file. whole is true if that is all
+        of the file.
+    '''
+    size = get_resolved_settings().header_bytes
+    if not size:
+        return get_file_content(filename, include_filename), True
 
-    Sorts the list by date, while at it.
+    content = ""
+    _, extension = os.path.splitext(filename)
+    if extension not in NON_TEXT_VIEWERS:
+        with span('read head', file=filename):
+            f = open(filename, 'r')
+            stats.count('files opened')
+            if not is_binary_file(filename, f):
+                # One more byte tells whether there is more to the file.
+                content = f.read(size + 1)
+                stats.count('bytes read', len(content))
+            f.close()
+    content, whole = cut_head(content, size)
+
+    if include_filename:
+        content = filename + ' ' + content
+    return content, whole
+
+
+def cut_head(content, size):
+    ''' Return (head, whole): the complete lines within the first size
+        bytes of the content, as get_file_head reads them, and whether that
+        is all of the content. With no size, the head is all of it.
     '''
+    if not size or len(content) <= size:
+        return content, True
+    return content[:content.rfind('\n', 0, size) + 1], False
+
+
+def find_first_date(head, whole, get_content):
+    ''' Return a note's first date: the earliest date in its head, or if
+        there is none there and there is more to the note, the earliest in
+        all of it, as returned by get_content(). None if it has no dates.
+
+        Both the note index and get_first_dates go by this, so they agree.
+    '''
+    found_dates = get_unique_dates(head)
+    if not found_dates and not whole:
+        found_dates = get_unique_dates(get_content())
+    if found_dates:
+        return found_dates[0]
+    return None
+
+
+def get_dated_files(file_list, start=None, end=None):
+    '''Return {date: [files]} for the dates written in the files' names
+    or contents, keeping the order of file_list within each date.
+
+    With start and/or end (datetime.date) only dates from start to end
+    (inclusive) are returned. Uses the note index when there is one.
+    '''
+    index = get_note_index()
+    if index is not None:
+        indexed_dates = index.get_dates(start, end)
     results = defaultdict(list)
     for filename in file_list:
-        content = get_file_content(filename)
-        first_date = get_first_date(content)
-        if hasattr(first_date, 'year'):
-            if str(first_date.year) == str(year):
-                results[first_date].append(filename)
+        if index is not None:
+            found_dates = indexed_dates.get(filename, [])
+        else:
+            found_dates = get_unique_dates(get_file_content(filename)) or []
+        for found_date in found_dates:
+            if start is not None and found_date < start:
+                continue
+            if end is not None and found_date > end:
+                continue
+            results[found_date].append(filename)
+    return dict(results)
+
+
+def get_first_dates(file_list):
+    '''Return {filename: earliest date} for the files in the list that
+    have a date in their name or contents.
+    '''
+    index = get_note_index()
+    if index is not None:
+        first_dates = index.get_first_dates()
+        return dict((filename, first_dates[filename])
+                    for filename in file_list if filename in first_dates)
+    results = {}
+    for filename in file_list:
+        # Templates put the date near the top, so look there first.
+        content, whole = get_file_head(filename)
+        first_date = find_first_date(
+            content, whole, lambda: get_file_content(filename))
+        if first_date is not None:
+            results[filename] = first_date
+    return results
 
-    # TODO: Sort the collection
-    sorted_results = []
-    for _, files in results.items():
-        for filename in files:
-            sorted_results.append(filename)
 
-    return sorted_results
+def sort_by_first_date(file_list):
+    '''Return the files ordered by the earliest date in each file.
+    Files without dates are sorted as if dated today.
+    '''
+    first_dates = get_first_dates(file_list)
+    today = date.today()
+    return sorted(file_list,
+                  key=lambda filename: first_dates.get(filename, today))
+
+
+def limit_to_year(year, file_list):
+    '''Return only files from the list whose first date is within
+    the specified year.
+
+    Sorts the list by date, while at it.
+    '''
+    first_dates = get_first_dates(file_list)
+    results = [filename for filename in file_list
+               if filename in first_dates and
+               str(first_dates[filename].year) == str(year)]
+    return sorted(results, key=lambda filename: first_dates[filename])
 
 
 def get_total_file_count(include_archives=False):
     '''Return the count of the total number of files available to Minion.
        This is useful for context when a search unexpectedly returns no results.
     '''
-    total_files = find_files(archives=include_archives)
-    total = len(total_files)
-    return total
+    return count_files(archives=include_archives)
 
 
 def get_favorites_summary():
@@ -312,12 +718,25 @@ def get_favorites_summary():
 def get_folder_summary(archives=False):
     summary = []
     notes_home = get_notes_home()
+
+    index = get_note_index()
+    if index is not None:
+        for full_folder in index.get_folders():
+            folder = os.path.basename(full_folder)
+            if 'archive' not in folder:
+                files = index.get_children(full_folder)
+                summary.append((len(files), folder))
+        summary.sort(reverse=True)
+        return summary
+
     folders = os.listdir(notes_home)
+    stats.count('folders listed')
     for folder in folders:
         if 'archive' not in folder:
             full_folder = os.path.join(notes_home, folder)
             if os.path.isdir(full_folder):
                 files = os.listdir(full_folder)
+                stats.count('folders listed')
                 summary.append((len(files), folder))
 
     summary.sort(reverse=True)
@@ -331,21 +750,28 @@ def select_file(match_files, max_files=10):
     choice_path = ''
     if len(match_files) == 0:
         return (choice_path, '')
+    max_files = int(max_files)
+
+    index = get_note_index()
+    if index is not None:
+        _, note_tags = get_indexed_files(index, get_notes_home(), True)
+    else:
+        note_tags = None
 
     while len(match_files) > 1:
         if len(match_files) > max_files:
             print "%d matches." % len(match_files)
-        else:
-            display_output('Notes (most recent first):', match_files,
-                           max_display=20)
-            choice = raw_input(
-                "Selection? ('!' selects the first file, 'q' quits): ")
+        display_output('Notes (most recent first):', match_files,
+                       max_display=max_files)
+        choice = raw_input(
+            "Selection? ('!' selects the first file, 'q' quits): ")
         if choice == '!':
             break
         if choice == 'q':
             print "Exiting ...\n"
             sys.exit()
-        less_match_files = limit_notes(choice, match_files, True)
+        less_match_files = limit_notes(choice, match_files, True,
+                                       note_tags=note_tags, text_index=index)
         if len(less_match_files) == 0:
             print "No %s %s matches." % (choice_path, choice)
         else:
@@ -360,6 +786,8 @@ def remind(text):
     f = open(filename, 'a')
     f.write(text)
     f.close()
+    stats.count_write(text)
+    note_changed(filename)
     return filename
 
 
@@ -401,13 +829,14 @@ def sort_by_tag(file_list):
 
 
 def format_output_list(output, by_tag, max_display, separator, raw_files):
-    if not raw_files:
-        output = clean_output(output)
+    remain = 0
     if max_display:
         remain = len(output) - max_display
         output = output[:max_display]
-        if remain > 0:
-            output.append("{} more results...".format(remain))
+    if not raw_files:
+        output = clean_output(output)
+    if remain > 0:
+        output.append("{} more results...".format(remain))
 
     if by_tag:
         all_tags = sort_by_tag(output)
@@ -446,6 +875,11 @@ def format_output_dict(output, separator, raw_files):
 
 def display_output(title, output, by_tag=False,
                    raw_files=False, max_display=None):
+    with span('display_output', title=title):
+        _display_output(title, output, by_tag, raw_files, max_display)
+
+
+def _display_output(title, output, by_tag, raw_files, max_display):
     # If empty list or empty string, etc:
     if not output:
         print "No %s items.\n" % title
@@ -474,71 +908,519 @@ def display_output(title, output, by_tag=False,
 
 
 def clean_output(output):
+    settings = get_resolved_settings()
     if type(output) is list:
         clean_list = []
         for item in output:
-            clean_list.append(clean_string(item))
+            clean_list.append(clean_string(item, settings))
         return clean_list
     else:
-        return clean_string(output)
+        return clean_string(output, settings)
 
 
-def clean_string(output):
-    notes_folder = get_notes_home()
-    no_folder = output.replace(notes_folder, '')
-    name_sep = get_setting('compose', 'filename_sep')
-    no_separators = no_folder.replace(name_sep, ' ')
+def clean_string(output, settings=None):
+    if settings is None:
+        settings = get_resolved_settings()
+    no_folder = output.replace(settings.notes_home, '')
+    no_separators = no_folder.replace(settings.filename_sep, ' ')
     no_slashes = no_separators.replace('/', ' : ')
-    no_extensions = no_slashes.replace(get_setting('compose', 'extension'), '')
+    no_extensions = no_slashes.replace(settings.extension, '')
     return no_extensions
 
 
-def content_has_tag(content, tag):
+def normalize_tag(tag, settings=None):
+    ''' Return the tag as tag searches compare it: in lower case, unless
+        tags are case sensitive.
+    '''
+    if settings is None:
+        settings = get_resolved_settings()
+    if not settings.tags_case_sensitive:
+        return tag.lower()
+    return tag
+
+
+def normalize_tags(tags, settings=None):
+    ''' Return the set of tags as tag searches compare them. '''
+    if settings is None:
+        settings = get_resolved_settings()
+    if settings.tags_case_sensitive:
+        return frozenset(tag for tag in tags if tag)
+    return frozenset(tag.lower() for tag in tags if tag)
+
+
+def tag_set_has_tag(tag_set, tag):
+    ''' Return true if the normalized tag is in the set, or part of one of
+        the tags in it.
+    '''
+    if tag in tag_set:
+        return True
+    for known_tag in tag_set:
+        if tag in known_tag:
+            return True
+    return False
+
+
+def content_has_tag(content, tag, settings=None):
     ''' Return true if the file content's tags line has the given tag. '''
-    content = content.split('\n')
-    TAG_INDICATOR = get_setting('compose', 'tagline')
-    if get_setting('compose', 'tags_case_sensitive') != 'true':
-        tag = tag.lower()
-    for line in content:
-        if TAG_INDICATOR in line:
-            if tag in line:
+    if settings is None:
+        settings = get_resolved_settings()
+    tag_set = normalize_tags(get_content_tags(content, settings), settings)
+    return tag_set_has_tag(tag_set, normalize_tag(tag, settings))
+
+
+def has_tag(filename, tag, note_tags=None):
+    ''' Return true if the file's tags line has the given tag.
+
+        note_tags optionally maps filenames to their normalized tag sets
+        (e.g. from the note index), so the file need not be read.
+    '''
+    if note_tags is not None and filename in note_tags:
+        tag_set = note_tags[filename]
+    else:
+        tag_set = normalize_tags(get_tags(filename))
+    return tag_set_has_tag(tag_set, normalize_tag(tag))
+
+
+class NoteText(object):
+    ''' The parts of a note that searches look at.
+
+        The file is opened at most once, however many terms are checked.
+        Large notes (whole mail threads, saved web pages) are memory mapped
+        and searched a part at a time, so they are never copied or lower
+        cased as a whole; call close() when done with them. Notes larger
+        than [performance] max_memory_mb are read a line at a time instead,
+        so they do not count towards the memory in use.
+    '''
+
+    def __init__(self, filename, tags=None):
+        self.filename = filename
+        self.low_name = filename.lower()
+        self._tags = tags
+        self._text = None
+        self._lower_text = None
+        self._full_text = None
+
+    def text(self):
+        ''' The file content as a string, or for large notes as a read only
+            memory map. None if the file cannot be mapped, or should be
+            read a line at a time; '' if it cannot be read.
+        '''
+        if self._text is None:
+            with span('read', file=self.filename):
+                self._text = self._read()
+        return self._text
+
+    def _read(self):
+        # Only notes read through here need it; keep it out of start up.
+        import mmap
+        try:
+            f = open(self.filename, 'rb')
+        except IOError:
+            return ''
+        stats.count('files opened')
+        try:
+            if is_binary_file(self.filename, f):
+                # Only the filename of a binary file is searched.
+                return ''
+            stats.count('files stat-ed')
+            size = os.fstat(f.fileno()).st_size
+            if size < MAP_NOTES_FROM:
+                text = f.read()
+                stats.count('bytes read', len(text))
+                return text
+            if is_over_memory_limit(size):
+                return None
+            text = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            stats.count('bytes mapped', size)
+            return text
+        except (IOError, OSError, ValueError, mmap.error):
+            # Some file systems and special files cannot be mapped.
+            return None
+        finally:
+            f.close()
+
+    def close(self):
+        if self._text is not None and not isinstance(self._text, str):
+            self._text.close()
+        self._text = None
+
+    def lines(self):
+        ''' The lines of the file, read one at a time. '''
+        size = 0
+        try:
+            with open(self.filename, 'rb') as f:
+                stats.count('files opened')
+                for line in f:
+                    size += len(line)
+                    yield line
+        except IOError:
+            return
+        finally:
+            stats.count('bytes read', size)
+
+    def tags(self):
+        ''' The normalized tags of the note, as has_tag sees them. '''
+        if self._tags is None:
+            _, extension = os.path.splitext(self.filename)
+            if self._text is None and get_resolved_settings().header_bytes:
+                # Templates put the tags line near the top; look there first.
+                try:
+                    content, whole = get_file_head(self.filename)
+                    tags = get_content_tags(content)
+                except IOError:
+                    tags, whole = [], False
+                if tags or whole:
+                    self._tags = normalize_tags(tags)
+                    return self._tags
+            content = self.filename + ' '
+            if extension not in NON_TEXT_VIEWERS:
+                content += self.tag_lines()
+            self._tags = normalize_tags(get_content_tags(content))
+        return self._tags
+
+    def tag_lines(self):
+        ''' Enough of the content for get_content_tags: the first line,
+            and the first line with the tags indicator after it. A mapped
+            note that is a single line, or with no indicator set, has no
+            tags line, and gives ''.
+        '''
+        text = self.text()
+        if isinstance(text, str):
+            return text
+        indicator = get_resolved_settings().tagline
+        if text is None:
+            found = []
+            for line in self.lines():
+                if not found or indicator in line.rstrip('\n').split(' '):
+                    found.append(line)
+                if len(found) == 2:
+                    break
+            return ''.join(found)
+        first_end = text.find('\n')
+        if first_end < 0 or not indicator:
+            return ''
+        # Look for the indicator as a word of its own, as parse_tags does.
+        at = text.find(indicator, first_end + 1)
+        while at >= 0:
+            end = at + len(indicator)
+            if text[at - 1] in ' \n' and (end == len(text) or
+                                          text[end] in ' \n'):
+                start = text.rfind('\n', 0, at) + 1
+                end = text.find('\n', end)
+                if end < 0:
+                    end = len(text)
+                return text[:first_end + 1] + text[start:end]
+            at = text.find(indicator, at + 1)
+        return text[:first_end + 1]
+
+    def lower_parts(self, overlap):
+        ''' The lower case content, in parts that overlap by the given
+            number of bytes, so that is all that is ever held in memory.
+        '''
+        text = self.text()
+        if text is None:
+            for line in self.lines():
+                yield line.lower()
+        elif isinstance(text, str):
+            if self._lower_text is None:
+                self._lower_text = text.lower()
+            yield self._lower_text
+        else:
+            for start in xrange(0, len(text), MAP_NOTES_FROM):
+                yield text[start:start + MAP_NOTES_FROM + overlap].lower()
+
+    def has_text(self, term):
+        ''' Return true if the lower case term is in the note's full text.
+        '''
+        if re.search(r'\s', term):
+            # full_text() puts a space after each line break, which terms
+            # with spaces in them may match across.
+            for part in self.full_text_parts(len(term) - 1):
+                if term in part:
+                    return True
+            return False
+        # Without spaces, a term can only match within a line, where the
+        # full text is the file content. Unmapped files are read by line.
+        if not term:
+            return True
+        for part in self.lower_parts(len(term) - 1):
+            if term in part:
                 return True
-    return False
+        return False
+
+    def full_text(self):
+        ''' The lower case content of a note read whole, as full text
+            search sees it.
+
+            Like ' '.join(f.readlines()): a space after each line break.
+        '''
+        if self._full_text is None:
+            self._full_text = get_spaced_text(self.text().lower(), True)
+        return self._full_text
+
+    def full_text_parts(self, overlap):
+        ''' full_text(), in parts that overlap by at least the given number
+            of bytes. Large notes are never held whole: mapped notes are
+            spaced and lower cased a part at a time, and the others are
+            read a line at a time.
+        '''
+        text = self.text()
+        if isinstance(text, str):
+            yield self.full_text()
+            return
+        if text is not None:
+            size = len(text)
+            for start in xrange(0, size, MAP_NOTES_FROM):
+                end = start + MAP_NOTES_FROM + overlap
+                # Spacing a part only makes it longer, so overlapping the
+                # content by as much overlaps the parts by at least that.
+                yield get_spaced_text(text[start:end].lower(), end >= size)
+            return
+        tail = ''
+        lines = []
+        size = 0
+        for number, line in enumerate(self.lines()):
+            if number:
+                line = ' ' + line
+            lines.append(line.lower())
+            size += len(line)
+            if size >= MAP_NOTES_FROM:
+                part = tail + ''.join(lines)
+                yield part
+                tail = part[len(part) - overlap:] if overlap else ''
+                lines = []
+                size = 0
+        yield tail + ''.join(lines)
+
+
+def get_spaced_text(text, last=False):
+    ''' Put a space after each line break of the text, as full text search
+        sees it. The line break that ends the last part of a note has no
+        space after it.
+    '''
+    if last and text.endswith('\n'):
+        return text[:-1].replace('\n', '\n ') + '\n'
+    return text.replace('\n', '\n ')
+
+
+def match_notes(terms, notes, full=False, find_any=False, note_tags=None,
+                text_index=None):
+    ''' Return the notes that match all of the terms (or with find_any,
+        any of them), keeping their order.
+
+        A term matches a note with the term in its filename or tags line, or
+        with full=True, anywhere in the file. With find_any, only filenames
+        and tags lines count.
+
+        All terms are checked in a single pass: filenames first, then each
+        remaining note is read at most once for its tags and content.
+        note_tags ({filename: normalized tag set}) and text_index let the
+        note index answer instead.
+    '''
+    with span('match notes', terms=terms, notes=len(notes)):
+        matches = get_note_matcher(terms, full, find_any, note_tags,
+                                   text_index)
+        found = parallel_map(matches, notes, get_workers('read'))
+        return [note for note, note_matches in zip(notes, found)
+                if note_matches]
+
+
+def get_note_matcher(terms, full=False, find_any=False, note_tags=None,
+                     text_index=None, matched_terms=False):
+    ''' Return the match_notes test for a single note, as a function of the
+        filename that returns true if the note matches.
+
+        With find_any and matched_terms, the function returns the terms the
+        note matched instead (see get_matched_terms), from the same read.
+    '''
+    low_terms = [term.lower() for term in terms]
+    # (filename term, tag term) pairs
+    keys = [(term.lower(), normalize_tag(term)) for term in terms]
+    if find_any:
+        name_matcher, tag_matcher = get_keyword_matchers(terms)
+
+    # Ask the index once per term, rather than once per note and term.
+    full_matches = {}
+    if full and text_index is not None and not find_any:
+        mode = get_setting('performance', 'full_text_mode')
+        for term in set(low_terms):
+            full_matches[term] = text_index.search_text(term, mode)
+
+    def matches(note):
+        known_tags = None
+        if note_tags is not None:
+            known_tags = note_tags.get(note)
+        text = NoteText(note, known_tags)
+        try:
+            if find_any and matched_terms:
+                return note_matched_terms(text, terms, name_matcher,
+                                          tag_matcher)
+            if find_any:
+                return note_has_any_term(text, name_matcher, tag_matcher)
+            return note_has_all_terms(text, keys, full, full_matches)
+        finally:
+            text.close()
+
+    return matches
+
+
+def note_has_all_terms(text, keys, full, full_matches):
+    ''' The match_notes test for a single note, without find_any. '''
+    pending = []
+    for low_term, tag in keys:
+        if low_term in text.low_name:
+            # Swap files only match by their content.
+            if 'swp' in text.filename:
+                return False
+        else:
+            pending.append((low_term, tag))
+
+    for low_term, tag in pending:
+        if tag_set_has_tag(text.tags(), tag):
+            if 'swp' in text.filename:
+                return False
+        elif not full:
+            return False
+        elif not note_has_text(text, low_term, full_matches.get(low_term)):
+            return False
+    return True
+
+
+def note_has_any_term(text, name_matcher, tag_matcher):
+    ''' The match_notes test for a single note, with find_any. '''
+    if name_matcher.search(text.low_name, first=True):
+        return True
+    return bool(tag_matcher.search(join_tags(text.tags()), first=True))
 
 
-def has_tag(filename, tag):
-    ''' Return true if the file's tags line has the given tag. '''
-    content = get_file_content(filename)
-    return content_has_tag(content, tag)
+def join_tags(tag_set):
+    ''' The tags as one string, in which a tag term is found wherever
+        tag_set_has_tag would find it. Tags never hold line breaks.
+    '''
+    return '\n'.join(tag_set)
 
 
-def limit_notes(choice, notes, full=False):
+class KeywordMatcher(object):
+    ''' Finds which of a set of keywords are in a text, in a single pass
+        over the text however many keywords there are (Aho-Corasick).
+    '''
+
+    def __init__(self, keywords):
+        self.keywords = frozenset(keywords)
+        # A trie of the keywords: goto[state] maps the next character to
+        # the next state, and found[state] holds the keywords ending there.
+        self.goto = [{}]
+        self.found = [set()]
+        for keyword in self.keywords:
+            state = 0
+            for char in keyword:
+                if char not in self.goto[state]:
+                    self.goto[state][char] = len(self.goto)
+                    self.goto.append({})
+                    self.found.append(set())
+                state = self.goto[state][char]
+            self.found[state].add(keyword)
+
+        # fail[state] is the state for the longest suffix of its text that
+        # is also in the trie; shorter states are worked out first.
+        self.fail = [0] * len(self.goto)
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].iteritems():
+                queue.append(next_state)
+                fail = self.fail[state]
+                while fail and char not in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[next_state] = self.goto[fail].get(char, 0)
+                self.found[next_state] |= self.found[self.fail[next_state]]
+
+    def search(self, text, first=False):
+        ''' Return the set of keywords in the text. With first=True, stop at
+            the first one found.
+        '''
+        goto, fail, found = self.goto, self.fail, self.found
+        matched = set(found[0])
+        if matched and first:
+            return matched
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if found[state]:
+                matched |= found[state]
+                if first or len(matched) == len(self.keywords):
+                    break
+        return matched
+
+
+def get_keyword_matchers(terms):
+    ''' Return matchers for the terms in filenames and in tags. '''
+    return (KeywordMatcher(term.lower() for term in terms),
+            KeywordMatcher(normalize_tag(term) for term in terms))
+
+
+def get_matched_terms(terms, filename, note_tags=None):
+    ''' Return the terms that are in the note's filename or tags line,
+        as `minion find` matches them.
+    '''
+    name_matcher, tag_matcher = get_keyword_matchers(terms)
+    known_tags = None
+    if note_tags is not None:
+        known_tags = note_tags.get(filename)
+    text = NoteText(filename, known_tags)
+    try:
+        return note_matched_terms(text, terms, name_matcher, tag_matcher)
+    finally:
+        text.close()
+
+
+def note_matched_terms(text, terms, name_matcher, tag_matcher):
+    ''' The terms that are in the NoteText's filename or tags line. '''
+    in_name = name_matcher.search(text.low_name)
+    in_tags = set()
+    if len(in_name) < len(name_matcher.keywords):
+        in_tags = tag_matcher.search(join_tags(text.tags()))
+    matched = []
+    for term in terms:
+        if term.lower() in in_name or normalize_tag(term) in in_tags:
+            if term not in matched:
+                matched.append(term)
+    return matched
+
+
+def annotate_matched(line, terms):
+    ''' Add the terms a result matched to its line of output. '''
+    if not terms:
+        return line
+    return '%s  (matched: %s)' % (line, ', '.join(terms))
+
+
+def note_has_text(text, term, found=None):
+    ''' Return true if the lower case term is in the note's full text.
+
+        found is what the note index said about the term, if anything.
+    '''
+    if found is not None:
+        paths, exact = found
+        if text.filename not in paths:
+            return False
+        if exact:
+            return True
+    return text.has_text(term)
+
+
+def limit_notes(choice, notes, full=False, note_tags=None, text_index=None):
     ''' Only return notes who have the text in choice in at least one of:
             The :tags: line in the file.
             or
             The filename.
+        With full=True, also those with the text anywhere in the file.
     '''
-    new_array = []
-    for note in notes:
-        choice = choice.lower()
-        low_note = note.lower()
-        if (choice in low_note) or has_tag(note, choice):
-            if 'swp' not in note:
-                new_array.append(note)
-        else:
-            if full:
-                content = ''
-                try:
-                    f = open(note, 'r')
-                    content = f.readlines()
-                    f.close()
-                except:
-                    pass
-                content = ' '.join(content)
-                content = content.lower()
-                if choice in content:
-                    new_array.append(note)
-    return new_array
+    with span('limit_notes', term=choice):
+        return match_notes([choice], notes, full=full, note_tags=note_tags,
+                           text_index=text_index)
 
 
 def remove_notes(file_list, terms):
@@ -584,12 +1466,40 @@ def get_editor(filename, view=False):
     return editor
 
 
+def is_over_memory_limit(size):
+    ''' Return true if a file of size bytes is larger than [performance]
+        max_memory_mb, so it should not be held in memory all at once.
+    '''
+    limit_mb = get_resolved_settings().max_memory_mb
+    return limit_mb > 0 and size > limit_mb * 1024 * 1024
+
+
+def copy_file(filename, out):
+    ''' Write the contents of the file to the file object out. Files larger
+        than [performance] max_memory_mb are written a part at a time.
+    '''
+    f = open(filename, 'r')
+    stats.count('files opened')
+    size = 0
+    try:
+        stats.count('files stat-ed')
+        if is_over_memory_limit(os.fstat(f.fileno()).st_size):
+            for part in iter(lambda: f.read(MAP_NOTES_FROM), ''):
+                out.write(part)
+                size += len(part)
+        else:
+            content = f.read()
+            out.write(content)
+            size = len(content)
+    finally:
+        f.close()
+        stats.count('bytes read', size)
+
+
 def file_to_stdout(filename):
     ''' Print the contents of the file to standard output. '''
-    f = open(filename, 'r')
-    content = f.read()
-    f.close()
-    print content
+    copy_file(filename, sys.stdout)
+    print
     # One extra line break is wise, in case the file does not end with one.
     print '\n'
 
@@ -614,6 +1524,25 @@ def get_windows_path(cygwin_path):
     return w_path
 
 
+# Set by the Minion server, to run programs on its client's terminal.
+PROGRAM_RUNNER = None
+
+
+def set_program_runner(runner):
+    ''' Have run_program use runner(program), or the default if None. '''
+    global PROGRAM_RUNNER
+    PROGRAM_RUNNER = runner
+
+
+def run_program(program):
+    ''' Run the shell command on the user's terminal. Returns its exit code.
+    '''
+    with span('run program', program=program):
+        if PROGRAM_RUNNER is not None:
+            return PROGRAM_RUNNER(program)
+        return subprocess.call(program, shell=True)
+
+
 def open_file(program, file_list, line=0):
     ''' Use the selected program to open the selected files.
 
@@ -624,7 +1553,7 @@ def open_file(program, file_list, line=0):
     if program.startswith('cmd '):
         # Convert file paths if running on CygWIN to support launching windows
         # viewers/programs
-        if 'CYGWIN' in platform.platform():
+        if 'CYGWIN' in PLATFORM_NAME.value():
             # convert CygWin paths to Windows paths
             file_list = [get_windows_path(fi) for fi in file_list]
 
@@ -644,7 +1573,7 @@ def open_file(program, file_list, line=0):
     program = program % ' '.join(file_list)
 
     # call the external program
-    subprocess.call(program, shell=True)
+    run_program(program)
 
 
 def open_in_editor(filename, line=0):
@@ -657,6 +1586,7 @@ def open_files(filenames, max=10):
     ''' Open all the files in the list.
         But stop at the given max, or 10 if not specified.
     '''
+    max = int(max)
     if len(filenames) > max:
         filenames = filenames[:max]
 
@@ -680,8 +1610,7 @@ def preview_file(filename):
 
 
 def get_notes_home():
-    notes_home = get_setting('notes', 'home')
-    notes_home = os.path.expanduser(notes_home)
+    notes_home = get_resolved_settings().notes_home
     if not os.path.exists(notes_home):
         os.mkdir(notes_home)
     return notes_home
@@ -708,8 +1637,16 @@ def get_inbox_files():
     return match_files
 
 
+# {folder name: full path} for the folders get_folder has made sure of,
+# while a batch of sort commands runs; see apply_batch().
+FOLDER_CACHE = None
+
+
 def get_folder(folder):
     '''Return a full path, relative to the notes home.  '''
+    if FOLDER_CACHE is not None and folder in FOLDER_CACHE:
+        return FOLDER_CACHE[folder]
+    name = folder
     # Convert 'archive' to 'archive.2012.08'
     if folder == 'archive':
         date_format = get_setting('notes', 'archive_folders_date_format')
@@ -721,6 +1658,9 @@ def get_folder(folder):
 
     if not os.path.exists(directory):
         os.mkdir(directory)
+        note_changed(directory)
+    if FOLDER_CACHE is not None:
+        FOLDER_CACHE[name] = directory
     return directory
 
 
@@ -753,13 +1693,24 @@ def expand_short_command(command):
 
 def get_tags(filename):
     ''' Return tags from file's tag line. '''
-    content = get_file_content(filename)
-    return get_content_tags(content)
+    index = get_note_index()
+    if index is not None:
+        tags = index.get_tags(filename)
+        if tags is not None:
+            return tags
+    # Templates put the tags line near the top, so look there first.
+    content, whole = get_file_head(filename)
+    tags = get_content_tags(content)
+    if tags or whole:
+        return tags
+    return get_content_tags(get_file_content(filename))
 
 
-def get_content_tags(content):
+def get_content_tags(content, settings=None):
     ''' Return all tags from file content. '''
-    TAG_INDICATOR = get_setting('compose', 'tagline')
+    if settings is None:
+        settings = get_resolved_settings()
+    TAG_INDICATOR = settings.tagline
     content = content.split('\n')
     tags = []
     for line in content:
@@ -771,7 +1722,7 @@ def get_content_tags(content):
 
 def parse_tags(line, TAG_INDICATOR=None):
     if not TAG_INDICATOR:
-        TAG_INDICATOR = get_setting('compose', 'tagline')
+        TAG_INDICATOR = get_resolved_settings().tagline
     tags = line.split(' ')
     if TAG_INDICATOR in tags:
         tags.pop(tags.index(TAG_INDICATOR))
@@ -786,15 +1737,16 @@ def create_tag_line(tags, TAG_INDICATOR=None):
         Note that all tags are stored in lower case,
         to simplify sorting and retrieval.
     '''
+    settings = get_resolved_settings()
     if not TAG_INDICATOR:
-        TAG_INDICATOR = get_setting('compose', 'tagline')
+        TAG_INDICATOR = settings.tagline
 
     # Unique-ify
     tags = list(set(tags))
     # Remove any line breaks
     tags = [x.replace('\n', ' ') for x in tags]
     # Make sure all the tags are lower case if case sensitive switch off
-    if get_setting('compose', 'tags_case_sensitive') != 'true':
+    if not settings.tags_case_sensitive:
         tags = [x.lower() for x in tags]
     tags = sorted(tags)
 
@@ -807,10 +1759,11 @@ def create_tag_line(tags, TAG_INDICATOR=None):
 
 
 def remove_tags_from_content(tags, content):
-    TAG_INDICATOR = get_setting('compose', 'tagline')
+    settings = get_resolved_settings()
+    TAG_INDICATOR = settings.tagline
 
     # Make sure all the tags are lower case if case sensitive switch off
-    if get_setting('compose', 'tags_case_sensitive') != 'true':
+    if not settings.tags_case_sensitive:
         tags = [x.lower() for x in tags]
 
     all_tags = []
@@ -844,13 +1797,16 @@ def remove_tags_from_file(tags, filename):
     f = open(filename, 'w')
     f.write(updated_content)
     f.close()
+    stats.count_write(updated_content)
+    note_changed(filename)
     return filename
 
 
 def add_tags(tags, content):
     ''' Return the file content with the tags added. '''
 
-    TAG_INDICATOR = get_setting('compose', 'tagline')
+    settings = get_resolved_settings()
+    TAG_INDICATOR = settings.tagline
 
     if ' ' in TAG_INDICATOR:
         print "WARNING: Spaces in the [compose] tagline= setting \
@@ -860,7 +1816,7 @@ def add_tags(tags, content):
     updated_content = []
     found_tags = False
     # Make sure all the tags are lower case if case sensitive switch off
-    if get_setting('compose', 'tags_case_sensitive') != 'true':
+    if not settings.tags_case_sensitive:
         tags = [x.lower() for x in tags]
     for line in content.split('\n'):
         if (TAG_INDICATOR in line):
@@ -898,6 +1854,8 @@ def add_tags_to_file(tags, filename):
     f = open(filename, 'w')
     f.write(updated_content)
     f.close()
+    stats.count_write(updated_content)
+    note_changed(filename)
 
     return filename
 
@@ -908,6 +1866,7 @@ def archive(filename):
     folder = get_folder('archive')
     filename = move_to_folder(filename, folder)
     print "Moved to %s" % folder
+    return filename
 
 
 def rename_note(filename, new_name):
@@ -956,14 +1915,33 @@ def delete_note(filename):
         % filename)
     if action == "YES":
         os.remove(filename)
+        note_changed(filename)
         print "Note %s was deleted!" % filename
     else:
         print "Note %s was NOT deleted." % filename
 
 
-def apply_command_to_file(filename, command):
-    ''' The core of the interactive file sorting system. '''
+# Sort actions that need someone at the keyboard.
+INTERACTIVE_ACTIONS = ['!help', '!edit', '!view', '!delete', '!quit']
+
+
+def apply_command_to_file(filename, command, interactive=True):
+    ''' The core of the interactive file sorting system.
+
+        With interactive=False nothing is asked, and the file is not offered
+        for another action afterwards. Actions that need someone at the
+        keyboard (and !rename without a new name) raise ValueError.
+        Returns the file's name after the command.
+    '''
     command = expand_short_command(command)
+    if not interactive:
+        for action in INTERACTIVE_ACTIONS:
+            if action in command:
+                raise ValueError('%s needs someone at the keyboard.' % action)
+        if '!rename' in command and\
+                not command.replace('!rename', '').strip():
+            raise ValueError('!rename needs a new name.')
+
     if '!help' in command:
         print get_sort_menu() + '\n'
         doInboxInteractive(filename)
@@ -973,17 +1951,19 @@ def apply_command_to_file(filename, command):
         doInboxInteractive(filename)
 
     if '!archive' in command:
-        archive(filename)
+        filename = archive(filename)
 
     if '!rename' in command:
-        new_filename = rename_note(filename, command.replace('!rename', ''))
-        doInboxInteractive(new_filename)
+        new_filename = rename_note(filename,
+                                   command.replace('!rename', '').strip())
+        if interactive:
+            doInboxInteractive(new_filename)
         return new_filename
 
     if '!delete' in command:
         delete_note(filename)
 
-    if check_add_remove_tags(filename, command):
+    if check_add_remove_tags(filename, command) and interactive:
         doInboxInteractive(filename)
 
     # If there's a calendar tag...move to the calendar folder.
@@ -1005,6 +1985,52 @@ def apply_command_to_file(filename, command):
     return filename
 
 
+def apply_batch(lines, out, messages=None):
+    ''' Apply sort commands to files, from "<filename> TAB <command>" lines,
+        without asking anything (see apply_command_to_file).
+
+        A line is written to out for each command, as it is done:
+            ok TAB <filename> TAB <the file's name now>
+            error TAB <filename> TAB <what went wrong>
+        What the commands print goes to messages (standard error, if not
+        given), so another program can read out.
+
+        Destination folders are looked up, and made, once for the batch.
+        Returns the number of commands that failed.
+    '''
+    global FOLDER_CACHE
+    if messages is None:
+        messages = sys.stderr
+    saved_stdout = sys.stdout
+    FOLDER_CACHE = {}
+    errors = 0
+    try:
+        for line in lines:
+            line = line.rstrip('\r\n')
+            if not line.strip():
+                continue
+            filename, tab, command = line.partition('\t')
+            sys.stdout = messages
+            try:
+                if not tab:
+                    raise ValueError('Expected <filename> TAB <command>.')
+                if not os.path.isfile(filename):
+                    raise ValueError('No such file.')
+                result = ['ok', filename, apply_command_to_file(
+                    filename, command, interactive=False)]
+            except (ValueError, IOError, OSError) as e:
+                errors += 1
+                result = ['error', filename, ' '.join(str(e).split())]
+            finally:
+                sys.stdout = saved_stdout
+            out.write('\t'.join(result) + '\n')
+            out.flush()
+    finally:
+        sys.stdout = saved_stdout
+        FOLDER_CACHE = None
+    return errors
+
+
 def doInboxInteractive(item):
     to_open = []
     display_output('Selected', item, by_tag=False)
@@ -1031,37 +2057,223 @@ def hasCalendarTag(text):
     return False
 
 
+def get_note_extensions():
+    ''' Return the (included, excluded) file extension lists. '''
+    settings = get_resolved_settings()
+    return settings.included_exts, settings.excluded_exts
+
+
+def is_note_file(item, included_exts, excluded_exts):
+    ''' Return true if the file name passes the extension settings. '''
+    for excluded_ext in excluded_exts:
+        if item.endswith(excluded_ext):
+            return False
+    for included_ext in included_exts:
+        if (('*' in included_ext) or item.endswith(included_ext)):
+            return True
+    return False
+
+
+class ListdirEntry(object):
+    ''' A stand-in for the entries scandir returns, built on os.listdir. '''
+
+    def __init__(self, directory, name):
+        self.name = name
+        self.path = os.path.join(directory, name)
+        self._stat = None
+
+    def stat(self):
+        if self._stat is None:
+            self._stat = os.stat(self.path)
+        return self._stat
+
+    def is_dir(self):
+        try:
+            return stat.S_ISDIR(self.stat().st_mode)
+        except OSError:
+            return False
+
+
+def list_entries(directory):
+    ''' Return the scandir style entries of the directory. '''
+    stats.count('folders listed')
+    if scandir is not None:
+        return list(scandir(directory))
+    return [ListdirEntry(directory, name) for name in os.listdir(directory)]
+
+
+# The stat results of the files seen by the last get_files call.
+FILE_STATS = {}
+
+
+def get_workers(kind):
+    ''' Return the number of threads to use for 'walk' or 'read' work. '''
+    return max(1, int(get_setting('performance', kind + '_workers')))
+
+
+def parallel_map(function, items, workers, pool=None):
+    ''' map() on a pool of threads, keeping the order of the items.
+
+        Useful when each call waits on a slow (e.g. synced) filesystem.
+        pool (see get_thread_pool) is used, and left open, if given.
+    '''
+    if pool is not None:
+        return pool.map(function, items)
+    if workers <= 1 or len(items) <= 1:
+        return map(function, items)
+    pool = get_thread_pool(min(workers, len(items)))
+    try:
+        return pool.map(function, items)
+    finally:
+        close_thread_pool(pool)
+
+
+def parallel_imap(function, items, workers, pool=None):
+    ''' Yield function(item) for each of the items, in their order, with
+        the calls made on the pool if there is one.
+
+        Only as many items are taken as there are workers to call function
+        on them, so little more is read than needed when the caller stops
+        early, and items may be worked out as they are taken.
+    '''
+    items = iter(items)
+    if pool is None:
+        for item in items:
+            yield function(item)
+        return
+    pending = deque(pool.apply_async(function, (item, ))
+                    for item in islice(items, workers))
+    while pending:
+        result = pending.popleft().get()
+        for item in islice(items, 1):
+            pending.append(pool.apply_async(function, (item, )))
+        yield result
+
+
+def get_thread_pool(workers):
+    ''' Return a pool of threads for parallel_map and parallel_imap, or
+        None for a single worker. Starting and stopping one takes a while,
+        so use one for all of a query, and pass it to close_thread_pool
+        when done.
+    '''
+    if workers <= 1:
+        return None
+    from multiprocessing.pool import ThreadPool
+    return ThreadPool(workers)
+
+
+def close_thread_pool(pool):
+    ''' Wait for the pool's threads to finish, and stop them. '''
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+
+def read_folder(directory):
+    ''' Return (name, stat) pairs for the items in the directory. '''
+    items = []
+    with span('read folder', folder=directory):
+        entries = list_entries(directory)
+        for entry in entries:
+            try:
+                items.append((entry.name, entry.stat()))
+            except OSError:
+                # Broken link, or removed while we looked.
+                pass
+    stats.count('files stat-ed', len(entries))
+    return items
+
+
+def read_folders(directory, archives, workers):
+    ''' Read every folder below the directory, a level at a time, using
+        a pool of threads.
+
+        Returns {(device, inode): [(name, stat), ...]} for scan_tree.
+    '''
+    root_stat = os.stat(directory)
+    stats.count('files stat-ed')
+    pending = [(directory, (root_stat.st_dev, root_stat.st_ino))]
+    seen = set(key for _, key in pending)
+    listings = {}
+    while pending:
+        results = parallel_map(read_folder, [x[0] for x in pending], workers)
+        next_pending = []
+        for (folder, key), items in zip(pending, results):
+            listings[key] = items
+            for name, item_stat in items:
+                if not stat.S_ISDIR(item_stat.st_mode):
+                    continue
+                if not archives and 'archive' in name.lower():
+                    continue
+                item_key = (item_stat.st_dev, item_stat.st_ino)
+                if item_key not in seen:
+                    seen.add(item_key)
+                    next_pending.append(
+                        (os.path.join(folder, name), item_key))
+        pending = next_pending
+    return listings
+
+
+def scan_tree(directory, archives=True, workers=1):
+    ''' Return (files, folders) below the directory, as (path, stat) pairs.
+
+        Every file and folder is stat-ed exactly once. Folders with 'archive'
+        in their name are skipped, unless archives is True. Folders already
+        visited (through a symbolic link) are not entered again.
+
+        With more than one worker, folders are read in parallel. The result
+        is the same, in the same order.
+    '''
+    root_stat = os.stat(directory)
+    stats.count('files stat-ed')
+    root_key = (root_stat.st_dev, root_stat.st_ino)
+    listings = None
+    if workers > 1:
+        listings = read_folders(directory, archives, workers)
+    return _scan_folder(directory, root_key, archives, set([root_key]),
+                        listings)
+
+
+def _scan_folder(directory, key, archives, visited, listings):
+    if listings is None:
+        items = read_folder(directory)
+    else:
+        items = listings[key]
+
+    files = []
+    folders = []
+    for name, item_stat in items:
+        if stat.S_ISDIR(item_stat.st_mode):
+            if not archives and 'archive' in name.lower():
+                continue
+            item_key = (item_stat.st_dev, item_stat.st_ino)
+            if item_key in visited:
+                continue
+            visited.add(item_key)
+            dirName = os.path.join(directory, name)
+            folders.append((dirName, item_stat))
+            sub_files, sub_folders = _scan_folder(dirName, item_key, archives,
+                                                  visited, listings)
+            files.extend(sub_files)
+            folders.extend(sub_folders)
+        else:
+            files.append(("%s/%s" % (directory, name), item_stat))
+    return files, folders
+
+
 def get_files(directory, archives=False):
     ''' Called by find_files to get a list of files, before sorting. '''
-    included_exts_string =\
-        GLOBAL_SETTINGS.get('notes', 'notes_included_extensions').\
-        replace(' ', '')
-    excluded_exts_string =\
-        GLOBAL_SETTINGS.get('notes', 'notes_excluded_extensions').\
-        replace(' ', '')
-    included_exts = included_exts_string.split(',')
-    excluded_exts = excluded_exts_string.split(',')
-
-    dir_list = os.listdir(directory)
+    included_exts, excluded_exts = get_note_extensions()
+
+    with span('get_files', directory=directory):
+        found, _ = scan_tree(directory, archives, get_workers('walk'))
+    FILE_STATS.clear()
     files = []
-    for item in dir_list:
-        dirName = os.path.join(directory, item)
-        if os.path.isdir(dirName):
-            files.extend(get_files(dirName, archives=archives))
-        else:
-            file_excluded = False
-            for excluded_ext in excluded_exts:
-                if item.endswith(excluded_ext):
-                    file_excluded = True
-                    break
-            if not file_excluded:
-                file_included = False
-                for included_ext in included_exts:
-                    if (('*' in included_ext) or item.endswith(included_ext)):
-                        file_included = True
-                        break
-            if not file_excluded and file_included:
-                files.append("%s/%s" % (directory, item))
+    for filename, file_stat in found:
+        if is_note_file(os.path.basename(filename),
+                        included_exts, excluded_exts):
+            files.append(filename)
+            FILE_STATS[filename] = file_stat
 
     if not archives:
         files = remove_archives(files)
@@ -1069,6 +2281,169 @@ def get_files(directory, archives=False):
     return files
 
 
+def get_mtime(filename):
+    ''' Return the modification time, from the last get_files if we can. '''
+    file_stat = FILE_STATS.get(filename)
+    stats.count_cache('file stats', file_stat is not None)
+    if file_stat is None:
+        stats.count('files stat-ed')
+        return os.path.getmtime(filename)
+    return file_stat.st_mtime
+
+
+def get_file_stats(directory):
+    ''' Return (files, folders) below the directory, as (path, stat) pairs.
+
+        Unlike get_files, nothing is left out: archives and excluded
+        extensions are included. Used to refresh the note index.
+    '''
+    return scan_tree(directory, True, get_workers('walk'))
+
+
+def extract_note_metadata(filename):
+    ''' Return the metadata the note index keeps for the file. '''
+    try:
+        f = open(filename, 'r')
+        stats.count('files opened')
+        body = ''
+        if not is_binary_file(filename, f):
+            body = f.read()
+            stats.count('bytes read', len(body))
+        f.close()
+    except IOError:
+        body = ''
+    # The same as get_file_content, without reading the file twice.
+    _, extension = os.path.splitext(filename)
+    text = body
+    if extension in NON_TEXT_VIEWERS:
+        text = ''
+    content = filename + ' ' + text
+    tags = get_content_tags(content)
+    # The first date as get_first_dates would find it, from the same head.
+    head, whole = cut_head(text, get_resolved_settings().header_bytes)
+    return {
+        'tags': tags,
+        'tag_set': normalize_tags(tags),
+        'dates': get_unique_dates(content) or [],
+        'first_date': find_first_date(filename + ' ' + head, whole,
+                                      lambda: content),
+        'body': body,
+    }
+
+
+_NOTE_INDEX = None
+
+
+def get_note_index(directory=None, refresh=True):
+    ''' Return the up to date note index, or None if it should not be used.
+
+        The index is used when [performance] use_index is 'true' and the
+        directory (if any) is inside the notes home. It is refreshed when it
+        is older than [performance] index_max_age seconds, unless refresh
+        is False; see is_index_stale().
+    '''
+    global _NOTE_INDEX
+    if get_setting('performance', 'use_index') != 'true':
+        return None
+
+    notes_home = get_notes_home()
+    if directory is not None:
+        home = os.path.abspath(notes_home)
+        directory = os.path.abspath(directory)
+        if directory != home and not directory.startswith(home + os.sep):
+            return None
+
+    index_file = os.path.expanduser(get_setting('performance', 'index_file'))
+    signature = '%s %s %s' % (get_setting('compose', 'tagline'),
+                              get_setting('compose', 'tags_case_sensitive'),
+                              get_resolved_settings().header_bytes)
+    # Start over if the settings changed, or the index file was removed.
+    if _NOTE_INDEX is None or not os.path.exists(index_file) or\
+            (_NOTE_INDEX.index_file, _NOTE_INDEX.notes_home,
+             _NOTE_INDEX.signature) != (index_file, notes_home, signature):
+        if _NOTE_INDEX is not None:
+            _NOTE_INDEX.close()
+        # SQLite takes a while to load, and is only needed with the index.
+        from index_of_minion import NoteIndex
+        _NOTE_INDEX = NoteIndex(index_file, notes_home,
+                                extract_note_metadata, signature)
+
+    if refresh and is_index_stale(_NOTE_INDEX):
+        files, folders = get_file_stats(notes_home)
+        reread = _NOTE_INDEX.refresh(files, folders, get_workers('read'))
+        stats.count('note index hits', len(files) - reread)
+        stats.count('note index misses', reread)
+
+    return _NOTE_INDEX
+
+
+def is_index_stale(index):
+    ''' Return true if the index is older than [performance] index_max_age
+        seconds, and should not be trusted without looking at the disk.
+    '''
+    age = index.age()
+    return age is None or\
+        age > float(get_setting('performance', 'index_max_age'))
+
+
+def note_changed(*paths):
+    ''' Let the note index know that Minion created, changed or removed files.
+    '''
+    if _NOTE_INDEX is not None:
+        for path in paths:
+            _NOTE_INDEX.update_path(path)
+    if NOTE_NAMES is not None:
+        for path in paths:
+            folder, name = os.path.split(path)
+            file_names = NOTE_FOLDERS.get(folder, (None, set()))[1]
+            if os.path.isfile(path):
+                NOTE_NAMES.setdefault(name, set()).add(path)
+                file_names.add(name)
+            elif name in NOTE_NAMES:
+                NOTE_NAMES[name].discard(path)
+                file_names.discard(name)
+
+
+def watch_notes():
+    ''' Keep the note index up to date as files change, until interrupted.
+        Returns False if the note index is switched off.
+    '''
+    index = get_note_index()
+    if index is None:
+        return False
+    from watch_of_minion import watch
+    interval = float(get_setting('performance', 'watch_interval'))
+    watch(index, get_file_stats, interval)
+    return True
+
+
+def get_indexed_files(index, directory, archives=False):
+    ''' Return ({filename: mtime}, {filename: normalized tag set}) from the
+        index, filtered the same way get_files filters the disk. The tag
+        sets are looked up as the matchers ask for them.
+    '''
+    mtimes = get_indexed_mtimes(index, directory, archives)
+    note_tags = index.get_note_tags(mtimes)
+    if get_workers('read') > 1:
+        # The notes are matched on the thread pool, which cannot use the
+        # index's connection; get all their tags here, in one query.
+        note_tags.load()
+    return mtimes, note_tags
+
+
+def get_indexed_mtimes(index, directory, archives=False):
+    ''' Return {filename: mtime} from the index, filtered the same way
+        get_files filters the disk.
+    '''
+    included_exts, excluded_exts = get_note_extensions()
+    indexed = index.get_files(directory)
+    files = [x for x in indexed
+             if is_note_file(os.path.basename(x), included_exts, excluded_exts)]
+    if not archives:
+        files = remove_archives(files)
+    return dict((x, indexed[x]) for x in files)
+
+
 def log_line_to_file(filename, line):
     '''
     Add a log file line to the file.
@@ -1088,6 +2463,8 @@ def log_line_to_file(filename, line):
     f = open(filename, 'a')
     f.write(new_line)
     f.close()
+    stats.count_write(new_line)
+    note_changed(filename)
     print new_line
     return
 
@@ -1106,12 +2483,22 @@ def choose_file(filter=[], archives=False, full_text=False):
     The second return is always the list of possible matches.
 
     '''
-    match_files = find_files(filter=filter, archives=archives,
-                             full_text=full_text)
+    mtimes, note_tags, index = get_candidate_files(get_notes_home(),
+                                                   archives)
+    found = iter(mtimes)
+    if filter:
+        matches = get_note_matcher(filter, full_text, note_tags=note_tags,
+                                   text_index=index)
+        found = iter_matching_files(list(mtimes), matches,
+                                    get_workers('read'))
+    # Whether there are none, one or more is all that matters at first.
+    match_files = list(islice(found, 2))
 
     # Filter word must always match a single file.
     if len(match_files) > 1:
-        return None, match_files
+        # All of them, to choose from: the rest of the same pass.
+        match_files.extend(found)
+        return None, sort_by_mtime(match_files, mtimes)
     elif len(match_files) == 1:
         filename = match_files[0]
         return filename, [filename]
@@ -1121,48 +2508,214 @@ def choose_file(filter=[], archives=False, full_text=False):
         return filename, []
 
 
+def get_candidate_files(directory, archives=False, days=None):
+    ''' Return ({filename: mtime}, note_tags, index) for the notes that
+        find_files looks through: those modified within the last N days, if
+        days is given. note_tags and index are None without the note index.
+    '''
+    index = get_note_index(directory)
+    if index is not None:
+        mtimes, note_tags = get_indexed_files(index, directory, archives)
+    else:
+        note_tags = None
+        mtimes = dict((filename, get_mtime(filename))
+                      for filename in get_files(directory, archives))
+
+    # only files modified within last N days
+    if type(days) is int:
+        threshold_dt = datetime.today() - timedelta(days=days)
+        threshold = mktime(threshold_dt.timetuple()) +\
+            threshold_dt.microsecond / 1000000.0
+        mtimes = dict((filename, modified)
+                      for filename, modified in mtimes.items()
+                      if modified > threshold)
+    return mtimes, note_tags, index
+
+
+def iter_matching_files(files, matches, workers=1):
+    ''' Yield the files for which matches(filename) is true, in order.
+
+        The files are checked on one thread pool, no more at a time than
+        there are workers, so little more is read than needed when the
+        caller stops early. The pool is closed with the generator.
+    '''
+    def check(filename):
+        return filename, matches(filename)
+
+    pool = get_thread_pool(min(workers, len(files)))
+    try:
+        for filename, found in parallel_imap(check, files, workers, pool):
+            if found:
+                yield filename
+    finally:
+        close_thread_pool(pool)
+
+
 def find_files(directory=None, archives=False, filter=[], full_text=False,
-               find_any=False, days=None):
-    ''' Find matching files... '''
+               find_any=False, days=None, sort=True, stop_after=None):
+    ''' Find matching files, most recently modified first.
+
+        With sort=False they come in no particular order. With stop_after,
+        no more notes are read once that many matched, and only those are
+        returned (in no particular order).
+    '''
     if directory is None:
         directory = get_notes_home()
 
-    files = get_files(directory, archives)
+    mtimes, note_tags, index = get_candidate_files(directory, archives, days)
+    files = list(mtimes)
 
-    if not find_any:
-        for tag in filter:
-            files = limit_notes(tag, files, full=full_text)
-    else:
-        raw_files = files
-        files = []
-        for f in raw_files:
-            if has_any_tag(f, filter):
-                files.append(f)
-
-    # sort the files according to modification date, most recent first
-    file_tuples = []
-    for filename in files:
-        mod_datetime = datetime.fromtimestamp(os.path.getmtime(filename))
-        file_tuples.append((mod_datetime, filename))
-    sorted_tuples = sorted(file_tuples, reverse=True)
+    if filter or find_any:
+        if stop_after is None:
+            files = match_notes(filter, files, full=full_text,
+                                find_any=find_any, note_tags=note_tags,
+                                text_index=index)
+        else:
+            matches = get_note_matcher(filter, full_text, find_any, note_tags,
+                                       index)
+            files = list(islice(iter_matching_files(
+                files, matches, get_workers('read')), stop_after))
+    elif stop_after is not None:
+        files = files[:stop_after]
 
-    # return only files modified within last N days
-    if type(days) is int:
-        threshold_dt = datetime.today() - timedelta(days=days)
-        sorted_files = [x[1] for x in sorted_tuples if x[0] > threshold_dt]
-    else:
-        sorted_files = [x[1] for x in sorted_tuples]
+    if not sort:
+        return files
+    return sort_by_mtime(files, mtimes)
 
-    return sorted_files
 
+def sort_by_mtime(files, mtimes):
+    ''' Sort the files by their modification time ({filename: mtime}),
+        most recent first.
+    '''
+    with span('sort by mtime', files=len(files)):
+        return [filename for _, filename in
+                sorted(((mtimes[x], x) for x in files), reverse=True)]
 
-def has_any_tag(filename, tags):
-    for tag in tags:
-        if tag.lower() in filename.lower():
-            return True
-        if has_tag(filename, tag):
-            return True
-    return False
+
+def count_files(directory=None, archives=False, filter=[], full_text=False,
+                find_any=False, days=None, stop_after=None):
+    ''' Return how many files find_files would find, without sorting them.
+        With stop_after, stop counting (and reading notes) at that number.
+    '''
+    return len(find_files(directory, archives, filter, full_text, find_any,
+                          days, sort=False, stop_after=stop_after))
+
+
+class NewestFirst(object):
+    ''' Heap item for a file; the most recently modified file (then the
+        last by name, as find_files sorts them) comes off the heap first.
+    '''
+    __slots__ = ('mtime', 'filename')
+
+    def __init__(self, mtime, filename):
+        self.mtime = mtime
+        self.filename = filename
+
+    def __lt__(self, other):
+        return (self.mtime, self.filename) > (other.mtime, other.filename)
+
+
+def find_newest_files(limit, directory=None, archives=False, filter=[],
+                      full_text=False, find_any=False, days=None,
+                      found=None):
+    ''' Return (newest, total): the first limit files find_files would
+        return, and how many it would return in all.
+
+        Rather than sorting every match, the notes are taken off a heap,
+        newest first, until limit of them match; the rest are only counted.
+        found(filename), if given, is called with each of the newest as
+        soon as it is known, so results can be shown while the rest are
+        still being checked. With find_any, found(filename, terms) is
+        called instead, with the terms the note matched; they come from the
+        same read as the match.
+    '''
+    if directory is None:
+        directory = get_notes_home()
+    limit = int(limit)
+
+    mtimes, note_tags, index = get_candidate_files(directory, archives, days)
+    matches = newest_matches = None
+    if filter or find_any:
+        matches = newest_matches = get_note_matcher(
+            filter, full_text, find_any, note_tags, index)
+    if find_any:
+        newest_matches = get_note_matcher(filter, full_text, find_any,
+                                          note_tags, index, True)
+    workers = get_workers('read')
+
+    with span('sort by mtime', files=len(mtimes)):
+        heap = [NewestFirst(modified, filename)
+                for filename, modified in mtimes.iteritems()]
+        heapq.heapify(heap)
+    newest = []
+    total = 0
+
+    def newest_first():
+        # Taken off the heap as the pool gets to them, until the newest
+        # are all known; the notes still being read then are only counted.
+        while heap and len(newest) < limit:
+            yield heapq.heappop(heap).filename
+
+    def check(filename):
+        if matches is None:
+            return filename, True
+        return filename, newest_matches(filename)
+
+    pool = None
+    if matches is not None:
+        pool = get_thread_pool(workers)
+    try:
+        with span('match newest', terms=filter, limit=limit):
+            for filename, note_matches in parallel_imap(check, newest_first(),
+                                                        workers, pool):
+                if not note_matches:
+                    continue
+                total += 1
+                if len(newest) < limit:
+                    newest.append(filename)
+                    if found is not None and find_any:
+                        found(filename, note_matches)
+                    elif found is not None:
+                        found(filename)
+
+        # Order does not matter for the rest.
+        rest = [item.filename for item in heap]
+        if matches is None:
+            total += len(rest)
+        else:
+            with span('match notes', terms=filter, notes=len(rest)):
+                total += sum(1 for x in parallel_map(matches, rest, workers,
+                                                     pool)
+                             if x)
+    finally:
+        close_thread_pool(pool)
+    return newest, total
+
+
+def has_any_tag(filename, tags, note_tags=None):
+    if note_tags is None:
+        note_tags = {filename: normalize_tags(get_tags(filename))}
+    return len(match_notes(tags, [filename], find_any=True,
+                           note_tags=note_tags)) > 0
+
+
+def get_tagged_files(tags, directory=None, archives=False):
+    ''' Return the notes tagged with every one of the tags, most recently
+        modified first. With the note index no file is opened.
+    '''
+    if directory is None:
+        directory = get_notes_home()
+    tag_set = normalize_tags(tags)
+
+    index = get_note_index(directory)
+    if index is None:
+        return [filename for filename in find_files(directory, archives)
+                if tag_set <= normalize_tags(get_tags(filename))]
+
+    mtimes = get_indexed_mtimes(index, directory, archives)
+    tagged = index.get_tagged_files(tag_set, directory)
+    return sorted((x for x in mtimes if x in tagged),
+                  key=lambda x: mtimes[x], reverse=True)
 
 
 def construct_note_title(topic, template):
@@ -1218,13 +2771,27 @@ def get_unique_name(filename):
     return final_name
 
 
+def move_file(source, destination):
+    ''' Move the file, with a plain rename unless it goes to another file
+        system.
+    '''
+    try:
+        os.rename(source, destination)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        shutil.move(source, destination)
+    stats.count('renames')
+
+
 def rename_file(filename, new_name):
     folder = os.path.dirname(filename)
     new_file = os.path.join(folder, new_name)
 
     if filename != new_file:
         new_file = get_unique_name(new_file)
-        shutil.move(filename, new_file)
+        move_file(filename, new_file)
+        note_changed(filename, new_file)
         print "Renamed " + filename + " to " + new_file
     return new_file
 
@@ -1237,7 +2804,8 @@ def move_to_folder(filename, folder):
         short_name = os.path.basename(filename)
         final_name = os.path.join(destination, short_name)
         final_name = get_unique_name(final_name)
-        shutil.move(filename, final_name)
+        move_file(filename, final_name)
+        note_changed(filename, final_name)
         remove_empty_folder(origin)
         return final_name
     except Exception as ex:
@@ -1251,8 +2819,15 @@ def move_to_folder(filename, folder):
 def remove_empty_folder(folder):
     ''' If the file being moved out was the last file there, remove the folder.
     '''
+    stats.count('folders listed')
     if len(os.listdir(folder)) == 0:
         os.rmdir(folder)
+        if FOLDER_CACHE:
+            # Made again if anything is moved there.
+            for name, directory in FOLDER_CACHE.items():
+                if os.path.abspath(directory) == os.path.abspath(folder):
+                    del FOLDER_CACHE[name]
+        note_changed(folder)
         print "Removed empty folder " + folder + "."
 
 
@@ -1272,13 +2847,189 @@ def get_sort_menu():
     return fixed_actions + configurable_actions
 
 
+# {file name: set of paths} below NOTE_NAMES_HOME, when the note index is not
+# used, and {folder: (modification time, names of the files in it)} for the
+# folders they are in; see get_note_names(). The folders are saved to
+# [performance] names_file between runs.
+NOTE_NAMES = None
+NOTE_FOLDERS = None
+NOTE_NAMES_HOME = None
+
+
+def read_note_names(folder, names, folders, known=None):
+    ''' Add the files in the folder to names ({file name: set of paths}),
+        and the folder to folders ({folder: (modification time, file
+        names)}). Folders below it are read too, unless they are in known
+        (or already in folders). Symbolic links to folders are not entered,
+        as os.walk does not enter them.
+    '''
+    try:
+        # Before listing, so changes made meanwhile are seen next time.
+        mtime = os.stat(folder).st_mtime
+        entries = list_entries(folder)
+    except OSError:
+        return
+    stats.count('files stat-ed')
+    file_names = set()
+    folders[folder] = (mtime, file_names)
+    for entry in entries:
+        path = os.path.join(folder, entry.name)
+        if entry.is_dir():
+            if path in folders or (known is not None and path in known) or\
+                    os.path.islink(path):
+                continue
+            read_note_names(path, names, folders, known)
+        else:
+            file_names.add(entry.name)
+            names.setdefault(entry.name, set()).add(path)
+
+
+def get_changed_folders(folder_mtimes):
+    ''' Return the folders whose modification time is no longer the one
+        given ({folder: mtime}): files or folders were added, removed or
+        renamed in them since. Folders that are gone are left out.
+    '''
+    changed = []
+    for folder, mtime in folder_mtimes.iteritems():
+        try:
+            if os.stat(folder).st_mtime != mtime:
+                changed.append(folder)
+        except OSError:
+            pass
+    stats.count('files stat-ed', len(folder_mtimes))
+    return changed
+
+
+def get_note_names():
+    ''' Return {file name: set of paths} for every file below the notes
+        home.
+
+        The notes home is walked once, and the names saved for the next
+        process (see save_note_names). A process that finds them saved
+        only reads the folders that changed since, as check_note_names()
+        does; a server keeps the names for as long as it runs. Meanwhile,
+        note_changed keeps them up to date.
+    '''
+    global NOTE_NAMES, NOTE_FOLDERS, NOTE_NAMES_HOME
+    notes_home = get_notes_home()
+    if NOTE_NAMES is None or NOTE_NAMES_HOME != notes_home:
+        NOTE_NAMES = {}
+        NOTE_NAMES_HOME = notes_home
+        NOTE_FOLDERS = load_note_names(notes_home)
+        if NOTE_FOLDERS is None:
+            NOTE_FOLDERS = {}
+            read_note_names(notes_home, NOTE_NAMES, NOTE_FOLDERS)
+            save_note_names()
+        else:
+            for folder, (_, file_names) in NOTE_FOLDERS.iteritems():
+                for name in file_names:
+                    NOTE_NAMES.setdefault(name, set()).add(
+                        os.path.join(folder, name))
+            check_note_names()
+    return NOTE_NAMES
+
+
+def get_names_file():
+    return os.path.expanduser(get_setting('performance', 'names_file'))
+
+
+def load_note_names(notes_home):
+    ''' Return the {folder: (modification time, file names)} saved for the
+        notes home, or None if there are none.
+    '''
+    try:
+        with open(get_names_file(), 'rb') as f:
+            stats.count('files opened')
+            saved_home, folders = cPickle.load(f)
+    except (IOError, EOFError, ValueError, TypeError, cPickle.PickleError):
+        return None
+    if saved_home != notes_home:
+        return None
+    return folders
+
+
+def save_note_names():
+    ''' Save the folders get_note_names knows, and the files in them, to
+        [performance] names_file for the next process.
+    '''
+    names_file = get_names_file()
+    folder = os.path.dirname(names_file)
+    # Written aside and renamed, so another process never reads half of it.
+    temp_file = '%s.%d' % (names_file, os.getpid())
+    try:
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        with open(temp_file, 'wb') as f:
+            cPickle.dump((NOTE_NAMES_HOME, NOTE_FOLDERS), f, 2)
+        os.rename(temp_file, names_file)
+    except (IOError, OSError):
+        # The names are only saved to save time; the next process walks.
+        return
+    stats.count('files written')
+    stats.count('renames')
+
+
+def check_note_names():
+    ''' Bring the names get_note_names keeps up to date with the disk,
+        reading again only the folders whose modification time changed.
+    '''
+    if NOTE_NAMES is None:
+        return
+    folder_mtimes = dict((folder, mtime) for folder, (mtime, _)
+                         in NOTE_FOLDERS.iteritems())
+    changed = set(get_changed_folders(folder_mtimes))
+    dropped = [folder for folder in folder_mtimes
+               if folder in changed or not os.path.isdir(folder)]
+    for folder in dropped:
+        _, file_names = NOTE_FOLDERS.pop(folder)
+        for name in file_names:
+            NOTE_NAMES[name].discard(os.path.join(folder, name))
+            if not NOTE_NAMES[name]:
+                del NOTE_NAMES[name]
+    for folder in changed:
+        read_note_names(folder, NOTE_NAMES, NOTE_FOLDERS, folder_mtimes)
+    if dropped:
+        save_note_names()
+
+
+def forget_note_names():
+    ''' Walk the notes home again next time a file is looked up by name.
+    '''
+    global NOTE_NAMES, NOTE_FOLDERS
+    NOTE_NAMES = None
+    NOTE_FOLDERS = None
+    try:
+        os.remove(get_names_file())
+    except OSError:
+        pass
+
+
 def find_file(filename):
-    ''' Find a file by name, checking each directory. '''
-    home = get_notes_home()
-    for root, _, names in os.walk(home):
-        for f in names:
-            if f == filename:
-                return os.path.join(root, f)
+    ''' Find a file by name, anywhere below the notes home.
+
+        With the note index, the name is looked up in the index. If the
+        index is stale, only the folders changed since the index last saw
+        them are read, rather than the whole notes home. Without the index,
+        see get_note_names().
+    '''
+    index = get_note_index(refresh=False)
+    if index is not None:
+        paths = set([index.find_name(filename)])
+        if is_index_stale(index):
+            notes_home = get_notes_home()
+            folder_mtimes = index.get_folder_mtimes()
+            names = {}
+            # The index does not keep the notes home itself; read it always.
+            for folder in [notes_home] + get_changed_folders(folder_mtimes):
+                read_note_names(folder, names, {}, folder_mtimes)
+            paths.update(names.get(filename, ()))
+        paths.discard(None)
+    else:
+        paths = get_note_names().get(filename, ())
+    # Files removed behind Minion's back are left out.
+    paths = [path for path in paths if os.path.exists(path)]
+    if paths:
+        return min(paths)
     return None
 
 
@@ -1316,13 +3067,17 @@ def get_template_content(template):
     template_text = f.readlines()
     f.close()
     template_text = ''.join(template_text)
+    stats.count('files opened')
+    stats.count('bytes read', len(template_text))
     return template_text
 
 
-def write_template_to_file(topic, filename, note_template):
+def write_template_to_file(topic, filename, note_template,
+                           template_text=None):
     ''' Add templated pre-content to the new note.'''
 
-    template_text = get_template_content(note_template)
+    if template_text is None:
+        template_text = get_template_content(note_template)
 
     # We need to construct the note title to be able to construct the
     # right length underline string
@@ -1344,6 +3099,8 @@ def write_template_to_file(topic, filename, note_template):
     f = open(filename, 'a')
     f.write(file_text)
     f.close()
+    stats.count_write(file_text)
+    note_changed(filename)
 
     # calculate the last line of the note to position the cursor later
     last_line = len(file_text.split('\n'))
@@ -1370,7 +3127,7 @@ def new_note_interactive(topic_fragments, note_template, quick=False,
 
 
 def create_new_note(topic, note_template=None, notes_dir=None,
-                    filename_template=None):
+                    filename_template=None, template_text=None):
     ''' Create a new note, non-interactive.'''
 
     # When no template, use the default one
@@ -1383,8 +3140,9 @@ def create_new_note(topic, note_template=None, notes_dir=None,
 
     # get the first line of the template and use it as filename template
     if filename_template is None:
-        template_content = get_template_content(note_template)
-        filename_template = template_content.split('\n')[0]
+        if template_text is None:
+            template_text = get_template_content(note_template)
+        filename_template = template_text.split('\n')[0]
     print "Note template used: " + note_template
 
     filename = get_filename_for_topic(topic, notes_dir, filename_template)
@@ -1393,11 +3151,26 @@ def create_new_note(topic, note_template=None, notes_dir=None,
     # only create new note if it does not exist
     if not os.path.exists(filename):
         # Write the template to the file.
-        last_line = write_template_to_file(topic, filename, note_template)
+        last_line = write_template_to_file(topic, filename, note_template,
+                                           template_text)
 
     return (filename, last_line)
 
 
+def create_new_notes(topics, note_template=None, notes_dir=None):
+    ''' Create a new note for each topic, non-interactive. The template is
+        read, and the note names looked up (see get_note_names), only once.
+
+        Returns a (filename, last line) pair per topic.
+    '''
+    if note_template is None:
+        note_template = get_setting('notes', 'default_template')
+    template_text = get_template_content(note_template)
+    return [create_new_note(topic, note_template, notes_dir,
+                            template_text=template_text)
+            for topic in topics]
+
+
 def to_bar(number, total=10):
     '''Convert a number into a ASCII art progress bar.'''
     pct_complete = number * 1.0 / total
@@ -1489,7 +3262,7 @@ def list_recent(match_files):
     '''
     recent_files = dict()
     for filename in match_files:
-        mod_date = datetime.fromtimestamp(os.path.getmtime(filename)).date()
+        mod_date = datetime.fromtimestamp(get_mtime(filename)).date()
         if mod_date in recent_files:
             # intentionally inserting at the beginning of the array to match
             #   the reversed chronological list when multiple files per day
@@ -1506,13 +3279,22 @@ def get_last_modified(directory=None, archives=False):
     if directory is None:
         directory = get_notes_home()
 
-    files = get_files(directory, archives)
+    index = get_note_index(directory)
+    if index is not None:
+        mtimes = get_indexed_mtimes(index, directory, archives)
+        files = list(mtimes)
+    else:
+        mtimes = None
+        files = get_files(directory, archives)
 
     most_recent = None
     result = None
 
     for filename in files:
-        modified = os.path.getmtime(filename)
+        if mtimes is not None:
+            modified = mtimes[filename]
+        else:
+            modified = get_mtime(filename)
         if most_recent < modified:
             most_recent = modified
             result = filename
@@ -0,0 +1,672 @@
+''' Persistent index of the files under the Minion notes home.
+
+The index lives in a SQLite file (by default ~/.minion.d/index.sqlite) and
+remembers, for every file and folder below the notes home, its size and
+modification time along with the metadata Minion would otherwise have to
+re-read from disk (tags and dates).
+
+The index does not walk the disk itself. The caller hands refresh() the
+(path, stat) pairs it found, and only files whose size or modification time
+changed are handed to the extract callback to be re-read.
+
+A watcher (see watch_of_minion) may keep the index up to date in another
+process. It calls mark_watched() regularly, which age() takes into account.
+
+It also keeps an inverted index of the words in each file (and in each file
+name) with their positions, so full text searches do not need to open files.
+'''
+
+################################################################################
+# IMPORTS
+################################################################################
+
+from array import array
+from datetime import date
+import os
+import re
+import sqlite3
+import time
+
+################################################################################
+# GLOBAL CONSTANTS
+################################################################################
+
+# Bump this whenever the tables change; older index files are rebuilt.
+SCHEMA_VERSION = 6
+
+# Fields a word can be found in.
+BODY = 0
+FILENAME = 1
+
+# Full text search modes.
+SUBSTRING = 'substring'
+PREFIX = 'prefix'
+TOKEN = 'token'
+
+# Words are runs of letters, digits and underscores, compared in lower case.
+WORD_RE = re.compile(r'\w+')
+
+# Stay well below SQLite's limit on the number of query parameters.
+BATCH_SIZE = 500
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS dirs (
+    path TEXT PRIMARY KEY,
+    parent TEXT,
+    mtime REAL
+);
+CREATE TABLE IF NOT EXISTS notes (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE,
+    parent TEXT,
+    name TEXT,
+    size INTEGER,
+    mtime REAL,
+    tags TEXT,
+    first_date TEXT
+);
+CREATE TABLE IF NOT EXISTS note_tags (
+    note_id INTEGER,
+    tag TEXT
+);
+CREATE TABLE IF NOT EXISTS note_dates (
+    note_id INTEGER,
+    date TEXT
+);
+CREATE TABLE IF NOT EXISTS terms (
+    id INTEGER PRIMARY KEY,
+    term TEXT UNIQUE
+);
+CREATE TABLE IF NOT EXISTS postings (
+    term_id INTEGER,
+    note_id INTEGER,
+    field INTEGER,
+    positions BLOB
+);
+CREATE INDEX IF NOT EXISTS notes_parent ON notes (parent);
+CREATE INDEX IF NOT EXISTS notes_name ON notes (name);
+CREATE INDEX IF NOT EXISTS dirs_parent ON dirs (parent);
+CREATE INDEX IF NOT EXISTS postings_term ON postings (term_id);
+CREATE INDEX IF NOT EXISTS postings_note ON postings (note_id);
+CREATE INDEX IF NOT EXISTS note_tags_tag ON note_tags (tag);
+CREATE INDEX IF NOT EXISTS note_tags_note ON note_tags (note_id);
+CREATE INDEX IF NOT EXISTS note_dates_date ON note_dates (date);
+CREATE INDEX IF NOT EXISTS note_dates_note ON note_dates (note_id);
+'''
+
+
+################################################################################
+# CLASSES
+################################################################################
+
+class NoteIndex(object):
+    ''' SQLite backed metadata for every file below the notes home.
+
+        extract(path) must return a dict with 'tags' (list of strings, as
+        written), 'tag_set' (the tags as searches compare them), 'dates'
+        (list of datetime.date) and 'body' (the text to index for full
+        text search). It may also give 'first_date', the date the note is
+        sorted by (the earliest of 'dates' if not given).
+
+        signature is any string describing the settings the extracted
+        metadata depends on. When it changes, the index is rebuilt.
+    '''
+
+    def __init__(self, index_file, notes_home, extract, signature=''):
+        self.index_file = index_file
+        self.notes_home = notes_home
+        self.extract = extract
+        self.signature = signature
+        self.refreshed_at = None
+        self._term_ids = None
+
+        folder = os.path.dirname(index_file)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+
+        self.db = sqlite3.connect(index_file)
+        # Paths and file content are byte strings; keep them that way.
+        self.db.text_factory = str
+        self._check_schema()
+
+    def _check_schema(self):
+        ''' Create the tables, or start over if they are out of date. '''
+        version = self.db.execute('PRAGMA user_version').fetchone()[0]
+        if version != SCHEMA_VERSION:
+            self._drop_tables()
+        self.db.executescript(SCHEMA)
+        self.db.execute('PRAGMA user_version = %d' % SCHEMA_VERSION)
+
+        expected = {'notes_home': self.notes_home,
+                    'signature': self.signature}
+        meta = self._get_meta()
+        if dict((key, meta.get(key)) for key in expected) != expected:
+            self.clear()
+            for key, value in expected.items():
+                self.db.execute(
+                    'INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)',
+                    (key, value))
+        self.db.commit()
+
+    def _drop_tables(self):
+        rows = self.db.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table'").fetchall()
+        for (name, ) in rows:
+            self.db.execute('DROP TABLE IF EXISTS %s' % name)
+
+    def _get_meta(self):
+        rows = self.db.execute('SELECT key, value FROM meta').fetchall()
+        return dict(rows)
+
+    def clear(self):
+        ''' Forget everything, so the next refresh re-reads all files. '''
+        self.db.execute('DELETE FROM notes')
+        self.db.execute('DELETE FROM dirs')
+        self.db.execute('DELETE FROM postings')
+        self.db.execute('DELETE FROM terms')
+        self.db.execute('DELETE FROM note_dates')
+        self.db.execute('DELETE FROM note_tags')
+        self.db.execute("DELETE FROM meta WHERE key = 'watched_at'")
+        self.db.commit()
+        self.refreshed_at = None
+        self._term_ids = None
+
+    def close(self):
+        self.db.close()
+
+    def age(self):
+        ''' Seconds since the index was last known to be up to date: since
+            the last refresh, or the last time a watcher checked in.
+            None if neither ever happened.
+        '''
+        known_at = []
+        if self.refreshed_at is not None:
+            known_at.append(self.refreshed_at)
+        watched_at = self._get_meta().get('watched_at')
+        if watched_at is not None:
+            known_at.append(float(watched_at))
+        if not known_at:
+            return None
+        return time.time() - max(known_at)
+
+    def mark_watched(self):
+        ''' Record that a watcher has applied all changes up to now. '''
+        self.db.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES ('watched_at', ?)",
+            (repr(time.time()), ))
+        self.db.commit()
+
+    ############################################################################
+    # Updating
+    ############################################################################
+
+    def refresh(self, files, dirs, workers=1, directory=None):
+        ''' Bring the index up to date with the given (path, stat) pairs.
+
+            Only files whose size or modification time changed are re-read,
+            by up to the given number of threads at a time.
+            Anything in the index but not in the lists is removed.
+            Returns the number of files that were (re-)read.
+
+            With a directory, the lists only cover what is below it, and
+            only that part of the index is brought up to date.
+        '''
+        if directory is None:
+            condition, args = '1', ()
+        else:
+            condition, args = self._under(directory)
+        known = {}
+        for path, size, mtime in self.db.execute(
+                'SELECT path, size, mtime FROM notes WHERE ' + condition,
+                args):
+            known[path] = (size, mtime)
+
+        changed = []
+        for path, stat in files:
+            previous = known.pop(path, None)
+            if previous != (stat.st_size, stat.st_mtime):
+                changed.append((path, stat))
+
+        for path in known:
+            self._delete_file(path)
+
+        for (path, stat), metadata in zip(
+                changed, self._extract_all(changed, workers)):
+            self._store_file(path, stat, metadata)
+
+        self.db.execute('DELETE FROM dirs WHERE ' + condition, args)
+        self.db.executemany(
+            'INSERT OR REPLACE INTO dirs (path, parent, mtime) '
+            'VALUES (?, ?, ?)',
+            [(path, os.path.dirname(path), stat.st_mtime)
+             for path, stat in dirs])
+
+        self.db.commit()
+        if directory is None:
+            self.refreshed_at = time.time()
+        return len(changed)
+
+    def update_path(self, path):
+        ''' Re-read a single file or folder, e.g. after Minion changed it.
+
+            Paths that no longer exist are removed from the index, along
+            with anything that was below them.
+        '''
+        try:
+            stat = os.stat(path)
+        except OSError:
+            self._delete_file(path)
+            self.db.execute('DELETE FROM dirs WHERE path = ?', (path, ))
+            condition, args = self._under(path)
+            for (below, ) in self.db.execute(
+                    'SELECT path FROM notes WHERE ' + condition,
+                    args).fetchall():
+                self._delete_file(below)
+            self.db.execute('DELETE FROM dirs WHERE ' + condition, args)
+        else:
+            if os.path.isdir(path):
+                self.db.execute(
+                    'INSERT OR REPLACE INTO dirs (path, parent, mtime) '
+                    'VALUES (?, ?, ?)',
+                    (path, os.path.dirname(path), stat.st_mtime))
+            else:
+                self._store_file(path, stat)
+        self.db.commit()
+
+    def _extract_all(self, changed, workers):
+        paths = [path for path, _ in changed]
+        if workers <= 1 or len(paths) <= 1:
+            return map(self.extract, paths)
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(min(workers, len(paths)))
+        try:
+            return pool.map(self.extract, paths)
+        finally:
+            pool.close()
+            pool.join()
+
+    def _store_file(self, path, stat, metadata=None):
+        if metadata is None:
+            metadata = self.extract(path)
+        row = {
+            'path': path,
+            'parent': os.path.dirname(path),
+            'name': os.path.basename(path),
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'tags': ' '.join(metadata['tags']),
+            'first_date': None,
+        }
+        first_date = metadata.get('first_date')
+        if first_date is None and metadata['dates']:
+            first_date = min(metadata['dates'])
+        if first_date is not None:
+            row['first_date'] = first_date.isoformat()
+        self.db.execute(
+            'INSERT OR REPLACE INTO notes '
+            '(id, path, parent, name, size, mtime, tags, first_date) '
+            'VALUES ((SELECT id FROM notes WHERE path = :path), '
+            ':path, :parent, :name, :size, :mtime, :tags, :first_date)',
+            row)
+        note_id = self._get_note_id(path)
+        self.db.execute('DELETE FROM postings WHERE note_id = ?', (note_id, ))
+        self.db.execute('DELETE FROM note_tags WHERE note_id = ?',
+                        (note_id, ))
+        self.db.executemany(
+            'INSERT INTO note_tags (note_id, tag) VALUES (?, ?)',
+            [(note_id, tag) for tag in set(metadata['tag_set'])])
+        self.db.execute('DELETE FROM note_dates WHERE note_id = ?',
+                        (note_id, ))
+        self.db.executemany(
+            'INSERT INTO note_dates (note_id, date) VALUES (?, ?)',
+            [(note_id, note_date.isoformat())
+             for note_date in metadata['dates']])
+        self._store_words(note_id, BODY, metadata['body'])
+        self._store_words(note_id, FILENAME, row['name'])
+
+    def _delete_file(self, path):
+        note_id = self._get_note_id(path)
+        if note_id is not None:
+            self.db.execute('DELETE FROM postings WHERE note_id = ?',
+                            (note_id, ))
+            self.db.execute('DELETE FROM note_dates WHERE note_id = ?',
+                            (note_id, ))
+            self.db.execute('DELETE FROM note_tags WHERE note_id = ?',
+                            (note_id, ))
+            self.db.execute('DELETE FROM notes WHERE id = ?', (note_id, ))
+
+    def _get_note_id(self, path):
+        row = self.db.execute('SELECT id FROM notes WHERE path = ?',
+                              (path, )).fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    def _get_term_id(self, term):
+        if self._term_ids is None:
+            self._term_ids = dict(
+                self.db.execute('SELECT term, id FROM terms'))
+        term_id = self._term_ids.get(term)
+        if term_id is None:
+            # A watcher in another process may have added it meanwhile.
+            row = self.db.execute('SELECT id FROM terms WHERE term = ?',
+                                  (term, )).fetchone()
+            if row is not None:
+                term_id = row[0]
+            else:
+                term_id = self.db.execute(
+                    'INSERT INTO terms (term) VALUES (?)', (term, )).lastrowid
+            self._term_ids[term] = term_id
+        return term_id
+
+    def _store_words(self, note_id, field, text):
+        ''' Add the postings (word positions) of the text to the index. '''
+        positions = {}
+        for position, word in enumerate(WORD_RE.findall(text.lower())):
+            positions.setdefault(word, array('I')).append(position)
+        self.db.executemany(
+            'INSERT INTO postings (term_id, note_id, field, positions) '
+            'VALUES (?, ?, ?, ?)',
+            [(self._get_term_id(word), note_id, field,
+              buffer(word_positions.tostring()))
+             for word, word_positions in positions.iteritems()])
+
+    ############################################################################
+    # Queries
+    ############################################################################
+
+    def _under(self, directory):
+        ''' SQL condition and arguments for paths below directory. '''
+        prefix = directory.rstrip('/') + '/'
+        return 'substr(path, 1, ?) = ?', (len(prefix), prefix)
+
+    def get_files(self, directory=None):
+        ''' Return {path: mtime} for all files below directory. '''
+        if directory is None:
+            directory = self.notes_home
+        condition, args = self._under(directory)
+        return dict(self.db.execute(
+            'SELECT path, mtime FROM notes WHERE ' + condition, args))
+
+    def get_note_tags(self, paths):
+        ''' Return a {path: frozenset of tags} mapping for the given paths,
+            with the tags as in the 'tag_set' extracted for each file.
+
+            Each file's tags are read from note_tags when first asked for,
+            so a search only pays for the notes it looks at. Call load()
+            on it before handing it to other threads.
+        '''
+        return NoteTags(self, paths)
+
+    def get_tag_sets(self, paths):
+        ''' Return {path: frozenset of tags} for the given paths, as in
+            'tag_set', from a single query.
+        '''
+        results = dict((path, set()) for path in paths)
+        rows = self.db.execute(
+            'SELECT path, tag FROM note_tags '
+            'JOIN notes ON notes.id = note_tags.note_id')
+        for path, tag in rows:
+            if path in results:
+                results[path].add(tag)
+        return dict((path, frozenset(tags)) for path, tags in results.items())
+
+    def get_tag_set(self, path):
+        ''' Return the frozenset of tags of the file, as in 'tag_set'. '''
+        rows = self.db.execute(
+            'SELECT tag FROM note_tags '
+            'JOIN notes ON notes.id = note_tags.note_id WHERE path = ?',
+            (path, ))
+        return frozenset(tag for (tag, ) in rows)
+
+    def get_tags(self, path):
+        ''' Return the tags of the file as written, or None if the file is
+            not in the index.
+        '''
+        row = self.db.execute('SELECT tags FROM notes WHERE path = ?',
+                              (path, )).fetchone()
+        if row is None:
+            return None
+        return [tag for tag in row[0].split(' ') if tag]
+
+    def find_name(self, name):
+        ''' Return the path of a file with the given name (the first one,
+            if there are several), or None if there is none.
+        '''
+        row = self.db.execute(
+            'SELECT min(path) FROM notes WHERE name = ?', (name, )).fetchone()
+        return row[0]
+
+    def get_folder_mtimes(self):
+        ''' Return {path: modification time} for every folder, as of the
+            last time it was refreshed.
+        '''
+        return dict(self.db.execute('SELECT path, mtime FROM dirs'))
+
+    def get_tagged_files(self, tags, directory=None):
+        ''' Return the set of paths below directory tagged with every one of
+            the tags (compared as in 'tag_set').
+        '''
+        tags = set(tags)
+        if directory is None:
+            directory = self.notes_home
+        condition, args = self._under(directory)
+        if not tags:
+            return set(self.get_files(directory))
+        rows = self.db.execute(
+            'SELECT path FROM note_tags '
+            'JOIN notes ON notes.id = note_tags.note_id '
+            'WHERE tag IN (%s) AND %s '
+            'GROUP BY note_id HAVING COUNT(*) = ?' % (
+                ', '.join('?' * len(tags)), condition),
+            list(tags) + list(args) + [len(tags)])
+        return set(path for (path, ) in rows)
+
+    def get_children(self, parent):
+        ''' Return the paths of all files and folders directly in parent. '''
+        parent = _parent_key(parent)
+        rows = self.db.execute(
+            'SELECT path FROM dirs WHERE parent = ? '
+            'UNION ALL SELECT path FROM notes WHERE parent = ? '
+            'ORDER BY path', (parent, parent))
+        return [path for (path, ) in rows]
+
+    def get_folders(self, parent=None):
+        ''' Return the paths of the folders directly in parent. '''
+        if parent is None:
+            parent = self.notes_home
+        parent = _parent_key(parent)
+        rows = self.db.execute(
+            'SELECT path FROM dirs WHERE parent = ? ORDER BY path', (parent, ))
+        return [path for (path, ) in rows]
+
+    def get_dates(self, start=None, end=None):
+        ''' Return {path: [dates]} of the dates found in each file.
+
+            With start and/or end (datetime.date), only the dates from
+            start to end (inclusive) are returned. Dates are in order.
+        '''
+        conditions = []
+        args = []
+        if start is not None:
+            conditions.append('date >= ?')
+            args.append(start.isoformat())
+        if end is not None:
+            conditions.append('date <= ?')
+            args.append(end.isoformat())
+        where = ''
+        if conditions:
+            where = 'WHERE ' + ' AND '.join(conditions)
+        rows = self.db.execute(
+            'SELECT path, date FROM note_dates '
+            'JOIN notes ON notes.id = note_dates.note_id '
+            '%s ORDER BY date' % where, args)
+        results = {}
+        for path, note_date in rows:
+            results.setdefault(path, []).append(_parse_date(note_date))
+        return results
+
+    def get_first_dates(self):
+        ''' Return {path: first date} for every file with a date in it. '''
+        rows = self.db.execute(
+            'SELECT path, first_date FROM notes '
+            'WHERE first_date IS NOT NULL')
+        return dict((path, _parse_date(first_date))
+                    for path, first_date in rows)
+
+    ############################################################################
+    # Full text search
+    ############################################################################
+
+    def search_text(self, text, mode=SUBSTRING, fields=(BODY, )):
+        ''' Find the files whose text contains the given text.
+
+            Returns a (paths, exact) tuple, or None when the text has no
+            words the index could look up.
+
+            In SUBSTRING mode the answer is the same as a case insensitive
+            'text in content' check. When exact is False, paths is a superset
+            of the answer and the caller must check each of them.
+
+            In PREFIX mode each word of the text must start a word in the
+            file, in TOKEN mode each word must match a whole word in the file.
+            These answers are always exact.
+        '''
+        text = text.lower()
+        words = WORD_RE.findall(text)
+        if not words:
+            return None
+
+        exact = True
+        roles = []
+        for number, word in enumerate(words):
+            if mode == TOKEN:
+                roles.append('equal')
+            elif mode == PREFIX:
+                roles.append('prefix')
+            else:
+                # Inside the text, a word is bounded by its neighbours.
+                # At the edges, it is only bounded if the text continues
+                # with a non-word character.
+                left = number > 0 or not WORD_RE.match(text)
+                right = number < len(words) - 1 or\
+                    not WORD_RE.match(text[-1])
+                roles.append({(True, True): 'equal',
+                              (True, False): 'prefix',
+                              (False, True): 'suffix',
+                              (False, False): 'contains'}[(left, right)])
+                exact = exact and (left, right) == (False, False)
+
+        # {(note_id, field): [positions of word 0, positions of word 1, ...]}
+        matches = None
+        for word, role in zip(words, roles):
+            postings = self._get_postings(word, role, fields)
+            if matches is None:
+                matches = dict((key, [positions])
+                               for key, positions in postings.iteritems())
+            else:
+                for key in matches.keys():
+                    if key in postings:
+                        matches[key].append(postings[key])
+                    else:
+                        del matches[key]
+
+        note_ids = set()
+        for (note_id, _), word_positions in matches.iteritems():
+            for start in word_positions[0]:
+                if all(start + offset in positions for offset, positions
+                       in enumerate(word_positions)):
+                    note_ids.add(note_id)
+                    break
+
+        return self._get_paths(note_ids), exact
+
+    def _get_postings(self, word, role, fields):
+        ''' Return {(note_id, field): set of positions} of the index terms
+            that are equal to, start with, end with or contain the word.
+        '''
+        if role == 'equal':
+            condition, args = 'term = ?', (word, )
+        elif role == 'prefix':
+            upper = word[:-1] + chr(ord(word[-1]) + 1)
+            condition, args = 'term >= ? AND term < ?', (word, upper)
+        elif role == 'suffix':
+            condition, args = 'substr(term, ?) = ?', (-len(word), word)
+        else:
+            condition, args = 'instr(term, ?) > 0', (word, )
+
+        field_list = ', '.join(str(int(field)) for field in fields)
+        rows = self.db.execute(
+            'SELECT note_id, field, positions FROM postings '
+            'WHERE field IN (%s) AND term_id IN (SELECT id FROM terms WHERE %s)'
+            % (field_list, condition), args)
+
+        postings = {}
+        for note_id, field, positions in rows:
+            word_positions = array('I')
+            word_positions.fromstring(str(positions))
+            postings.setdefault((note_id, field), set()).update(word_positions)
+        return postings
+
+    def _get_paths(self, note_ids):
+        note_ids = list(note_ids)
+        paths = set()
+        for start in range(0, len(note_ids), BATCH_SIZE):
+            batch = note_ids[start:start + BATCH_SIZE]
+            rows = self.db.execute(
+                'SELECT path FROM notes WHERE id IN (%s)'
+                % ', '.join('?' * len(batch)), batch)
+            paths.update(path for (path, ) in rows)
+        return paths
+
+
+class NoteTags(object):
+    ''' The read only {path: frozenset of tags} mapping of get_note_tags. '''
+
+    def __init__(self, index, paths):
+        self.index = index
+        self.paths = set(paths)
+        self._tags = {}
+
+    def __contains__(self, path):
+        return path in self.paths
+
+    def __getitem__(self, path):
+        if path not in self.paths:
+            raise KeyError(path)
+        if path not in self._tags:
+            self._tags[path] = self.index.get_tag_set(path)
+        return self._tags[path]
+
+    def get(self, path, default=None):
+        if path not in self.paths:
+            return default
+        return self[path]
+
+    def load(self):
+        ''' Read the tags of all the paths now. SQLite connections only
+            work on the thread that opened them; once loaded, the mapping
+            can be read from any thread.
+        '''
+        self._tags = self.index.get_tag_sets(self.paths)
+
+
+################################################################################
+# FUNCTIONS
+################################################################################
+
+def _parent_key(directory):
+    ''' The parent column holds os.path.dirname() of each path, which never
+        ends with a slash, even if the notes home was configured with one.
+    '''
+    return directory.rstrip('/') or '/'
+
+
+def _parse_date(text):
+    ''' Turn a stored YYYY-MM-DD string back into a date. '''
+    year, month, day = text.split('-')
+    return date(int(year), int(month), int(day))
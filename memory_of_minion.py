@@ -0,0 +1,182 @@
+''' Tell how much memory a command used, for --memory-report.
+
+Python 2 has no tracemalloc, so instead of allocation sites the report has:
+
+    - the memory in use (resident) when the command started and ended, and
+      at its peak;
+    - the parts of the command (the spans of trace_of_minion) that the
+      memory in use grew the most in;
+    - the kinds of objects taking the most memory once the command is done,
+      which is what the caches (and a server) keep.
+
+Memory is read from /proc on Linux. Elsewhere only the peak is known, from
+getrusage, and it is the peak since the process started.
+'''
+
+################################################################################
+# IMPORTS
+################################################################################
+
+from collections import defaultdict
+import gc
+import sys
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    # Windows.
+    resource = None
+
+################################################################################
+# GLOBAL CONSTANTS
+################################################################################
+
+STATUS_FILE = '/proc/self/status'
+
+# Writing '5' here starts the peak (VmHWM) over, on Linux 4.0 and later.
+CLEAR_REFS_FILE = '/proc/self/clear_refs'
+
+# How many parts and kinds of objects the report lists.
+REPORT_TOP = 10
+
+################################################################################
+# FUNCTIONS
+################################################################################
+
+
+def _read_status(field):
+    ''' Return the field of /proc/self/status, in KiB, or None. '''
+    try:
+        f = open(STATUS_FILE)
+    except IOError:
+        return None
+    try:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1])
+    finally:
+        f.close()
+    return None
+
+
+def get_memory():
+    ''' Return the memory in use (resident), in KiB, or None on systems
+        without /proc.
+    '''
+    return _read_status('VmRSS')
+
+
+def get_peak_memory():
+    ''' Return the most memory in use at once (resident), in KiB, since the
+        process started or reset_peak_memory(); None if it cannot be told.
+    '''
+    peak = _read_status('VmHWM')
+    if peak is None and resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform == 'darwin':
+            # Bytes, rather than KiB.
+            peak /= 1024
+    return peak
+
+
+def reset_peak_memory():
+    ''' Start the peak over from the memory in use now. Returns false if
+        the system cannot do that.
+    '''
+    try:
+        f = open(CLEAR_REFS_FILE, 'w')
+        try:
+            f.write('5')
+        finally:
+            f.close()
+    except (IOError, OSError):
+        return False
+    return True
+
+
+def get_growth_by_span(events):
+    ''' Return (name, total KiB, largest KiB, count) for each name of span
+        among the trace events, most growth first. Only spans that noted
+        memory_kb count.
+    '''
+    growth = defaultdict(lambda: [0, 0, 0])
+    for event in events:
+        grew = event.get('args', {}).get('memory_kb')
+        if event.get('ph') != 'X' or grew is None:
+            continue
+        totals = growth[event['name']]
+        totals[0] += max(grew, 0)
+        totals[1] = max(totals[1], grew)
+        totals[2] += 1
+    return sorted(((name, total, largest, count)
+                   for name, (total, largest, count) in growth.items()),
+                  key=lambda row: (-row[1], row[0]))
+
+
+def get_largest_types():
+    ''' Return (type name, bytes, count) for the kinds of objects in
+        memory, largest first.
+
+        Strings and numbers are not tracked by the garbage collector, so
+        they are found through the objects that hold them.
+    '''
+    sizes = defaultdict(lambda: [0, 0])
+    seen = set()
+
+    def add(obj):
+        totals = sizes[type(obj).__name__]
+        totals[0] += sys.getsizeof(obj, 0)
+        totals[1] += 1
+
+    tracked = gc.get_objects()
+    for obj in tracked:
+        seen.add(id(obj))
+    for obj in tracked:
+        add(obj)
+        for held in gc.get_referents(obj):
+            if not gc.is_tracked(held) and id(held) not in seen:
+                seen.add(id(held))
+                add(held)
+    del tracked
+    return sorted(((name, size, count)
+                   for name, (size, count) in sizes.items()),
+                  key=lambda row: (-row[1], row[0]))
+
+
+def format_memory_report(started, ended, peak, peak_reset, events,
+                         largest_types, limit_mb=0):
+    ''' Return the report as lines of text. started, ended and peak are in
+        KiB (None if not known); peak_reset tells if the peak is that of
+        the command, rather than of the whole process.
+    '''
+    def kib(value):
+        return '%12s' % ('?' if value is None else value)
+
+    lines = ['Memory (KiB):',
+             '%s  when the command started' % kib(started),
+             '%s  when it was done' % kib(ended)]
+    if peak_reset:
+        peak_line = '%s  at its peak' % kib(peak)
+    else:
+        peak_line = '%s  at the peak since the process started' % kib(peak)
+    if limit_mb and peak is not None:
+        if peak <= limit_mb * 1024:
+            peak_line += ', within max_memory_mb = %d' % limit_mb
+        else:
+            peak_line += ', OVER max_memory_mb = %d' % limit_mb
+    lines.append(peak_line)
+
+    growth = get_growth_by_span(events)[:REPORT_TOP]
+    if growth:
+        lines.append('Memory growth by part (KiB):')
+        lines.append('%12s %12s %8s  %s' % ('total', 'largest', 'times',
+                                            'part'))
+        for name, total, largest, count in growth:
+            lines.append('%12d %12d %8d  %s' % (total, largest, count, name))
+
+    if largest_types:
+        lines.append('Objects in memory when done:')
+        lines.append('%12s %12s  %s' % ('KiB', 'objects', 'kind'))
+        for name, size, count in largest_types[:REPORT_TOP]:
+            lines.append('%12d %12d  %s' % (size / 1024, count, name))
+    return '\n'.join(lines)
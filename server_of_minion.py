@@ -0,0 +1,284 @@
+''' Run Minion commands in a long lived process.
+
+`minion serve` keeps settings, the note index and other caches in memory,
+and runs the commands that `minion` clients send it over a Unix domain
+socket (by default ~/.minion.d/minion.sock). When no server is running,
+clients simply run the command themselves.
+
+Messages in both directions are JSON objects, each preceded by its length
+as a 4 byte unsigned big-endian integer:
+
+    client -> server: {'type': 'run', 'args': docopt arguments,
+                       'cwd': working directory, 'env': environment}
+    server -> client: {'type': 'out' or 'err', 'text': text to print}
+                      {'type': 'input'}           (read a line from stdin)
+                      {'type': 'spawn', 'program': shell command to run}
+                      {'type': 'exit', 'code': exit code}
+    client -> server: {'type': 'input', 'text': the line, '' at the end}
+                      {'type': 'spawn', 'code': the program's exit code}
+
+This module does not import the brain, so clients start quickly.
+'''
+
+################################################################################
+# IMPORTS
+################################################################################
+
+import errno
+import json
+import os
+import socket
+import struct
+import subprocess
+import sys
+import traceback
+
+################################################################################
+# GLOBAL CONSTANTS
+################################################################################
+
+SOCKET_FILE = '~/.minion.d/minion.sock'
+
+# Message length prefix.
+HEADER = struct.Struct('!I')
+
+################################################################################
+# CLASSES
+################################################################################
+
+
+class ConnectionClosed(Exception):
+    ''' The other side went away (after Ctrl-C, most likely). '''
+
+
+class ClientStream(object):
+    ''' Stands in for sys.stdout, sys.stderr and sys.stdin while a command
+        runs for a client, so print and raw_input talk to the client.
+    '''
+
+    def __init__(self, sock, kind='out'):
+        self.sock = sock
+        self.kind = kind
+
+    def write(self, text):
+        send_message(self.sock, {'type': self.kind, 'text': text})
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        pass
+
+    def readline(self):
+        send_message(self.sock, {'type': 'input'})
+        return _to_str(receive_message(self.sock, 'input')['text'])
+
+    def run_program(self, program):
+        ''' Run the shell command on the client's terminal. '''
+        send_message(self.sock, {'type': 'spawn', 'program': program})
+        return receive_message(self.sock, 'spawn')['code']
+
+
+################################################################################
+# FUNCTIONS
+################################################################################
+
+def get_socket_file():
+    return os.path.expanduser(SOCKET_FILE)
+
+
+def send_message(sock, message):
+    data = json.dumps(message)
+    sock.sendall(HEADER.pack(len(data)) + data)
+
+
+def _receive(sock, size):
+    data = ''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionClosed()
+        data += chunk
+    return data
+
+
+def receive_message(sock, expected=None):
+    ''' Return the next message, checking its type if expected is given. '''
+    size, = HEADER.unpack(_receive(sock, HEADER.size))
+    message = json.loads(_receive(sock, size))
+    if expected is not None and message.get('type') != expected:
+        raise ValueError('Expected a %s message, got %r.' % (expected,
+                                                            message))
+    return message
+
+
+def _to_str(value):
+    ''' JSON gives unicode; Minion works with (UTF-8) byte strings. '''
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    if isinstance(value, list):
+        return [_to_str(item) for item in value]
+    if isinstance(value, dict):
+        return dict((_to_str(key), _to_str(item))
+                    for key, item in value.items())
+    return value
+
+
+def connect(socket_file=None):
+    ''' Return a socket connected to the server, or None if none runs. '''
+    if socket_file is None:
+        socket_file = get_socket_file()
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_file)
+    except socket.error:
+        sock.close()
+        return None
+    return sock
+
+
+def call(args, socket_file=None):
+    ''' Have the server run the command with the given docopt arguments.
+
+        Output, prompts and programs (editors, pagers) are handled on this
+        side. Returns the command's exit code, or None if no server is
+        running.
+    '''
+    sock = connect(socket_file)
+    if sock is None:
+        return None
+    try:
+        try:
+            send_message(sock, {'type': 'run', 'args': args,
+                                'cwd': os.getcwd(), 'env': dict(os.environ)})
+        except UnicodeDecodeError:
+            # Not UTF-8, so it cannot be sent as JSON; run it here instead.
+            return None
+        while True:
+            message = _to_str(receive_message(sock))
+            kind = message['type']
+            if kind == 'out':
+                sys.stdout.write(message['text'])
+                sys.stdout.flush()
+            elif kind == 'err':
+                sys.stderr.write(message['text'])
+                sys.stderr.flush()
+            elif kind == 'input':
+                sys.stdout.flush()
+                send_message(sock, {'type': 'input',
+                                    'text': sys.stdin.readline()})
+            elif kind == 'spawn':
+                code = subprocess.call(message['program'], shell=True)
+                send_message(sock, {'type': 'spawn', 'code': code})
+            elif kind == 'exit':
+                return message['code']
+    finally:
+        sock.close()
+
+
+def listen(socket_file=None):
+    ''' Return a socket listening for clients.
+
+        Raises socket.error if another server is already running.
+    '''
+    if socket_file is None:
+        socket_file = get_socket_file()
+    folder = os.path.dirname(socket_file)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder, 0700)
+
+    running = connect(socket_file)
+    if running is not None:
+        running.close()
+        raise socket.error(errno.EADDRINUSE,
+                           'A Minion server is already running.')
+    if os.path.exists(socket_file):
+        # Left behind by a server that did not shut down.
+        os.remove(socket_file)
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    old_umask = os.umask(0077)
+    try:
+        sock.bind(socket_file)
+    finally:
+        os.umask(old_umask)
+    sock.listen(5)
+    return sock
+
+
+def serve(handler, socket_file=None, set_program_runner=None,
+          requests=None):
+    ''' Run commands for clients, one at a time, until interrupted (or for
+        the given number of requests).
+
+        handler(args) runs the command with the given docopt arguments.
+        set_program_runner, if given, is called with the function that runs
+        a program on the client's terminal before each command, and with
+        None after it.
+    '''
+    if socket_file is None:
+        socket_file = get_socket_file()
+    server = listen(socket_file)
+    try:
+        while requests is None or requests > 0:
+            sock, _ = server.accept()
+            try:
+                handle(sock, handler, set_program_runner)
+            except (ConnectionClosed, socket.error, ValueError):
+                # The client went away, or sent something unexpected.
+                pass
+            finally:
+                sock.close()
+            if requests is not None:
+                requests -= 1
+    finally:
+        server.close()
+        if os.path.exists(socket_file):
+            os.remove(socket_file)
+
+
+def handle(sock, handler, set_program_runner=None):
+    ''' Run a single client's command in this process, as if it was run in
+        the client's working directory with the client's environment.
+    '''
+    request = _to_str(receive_message(sock, 'run'))
+    saved = (os.getcwd(), dict(os.environ),
+             sys.stdin, sys.stdout, sys.stderr)
+    stream = ClientStream(sock)
+    code = 0
+    try:
+        os.chdir(request['cwd'])
+        os.environ.clear()
+        os.environ.update(request['env'])
+        sys.stdin = sys.stdout = stream
+        sys.stderr = ClientStream(sock, 'err')
+        if set_program_runner is not None:
+            set_program_runner(stream.run_program)
+        try:
+            handler(request['args'])
+        except SystemExit as e:
+            code = _exit_code(e.code)
+        except (ConnectionClosed, socket.error, KeyboardInterrupt):
+            raise
+        except Exception:
+            sys.stderr.write(traceback.format_exc())
+            code = 1
+    finally:
+        if set_program_runner is not None:
+            set_program_runner(None)
+        cwd, environ, sys.stdin, sys.stdout, sys.stderr = saved
+        os.environ.clear()
+        os.environ.update(environ)
+        os.chdir(cwd)
+    send_message(sock, {'type': 'exit', 'code': code})
+
+
+def _exit_code(code):
+    ''' The exit status for sys.exit(code), as the interpreter sees it. '''
+    if code is None:
+        return 0
+    if isinstance(code, int):
+        return code
+    sys.stderr.write('%s\n' % code)
+    return 1
@@ -0,0 +1,118 @@
+''' Count the file system work a command does, for --stats.
+
+The brain's I/O helpers call count() as they list folders, stat, open, read,
+write and rename files, and as its caches are hit or missed:
+
+    count('files opened')
+    count('bytes read', len(content))
+
+Counting is always on. Each thread counts into a Counter of its own, so a
+count takes no lock; get_counts() adds up those of all threads.
+'''
+
+################################################################################
+# IMPORTS
+################################################################################
+
+from collections import Counter
+import threading
+
+################################################################################
+# GLOBAL CONSTANTS
+################################################################################
+
+# The I/O counters, in the order they are shown. Always shown, even at 0.
+IO_COUNTERS = ['folders listed', 'files stat-ed', 'files opened', 'bytes read',
+               'bytes mapped', 'files written', 'bytes written', 'renames']
+
+# Caches whose '<cache> hits' and '<cache> misses' are counted.
+CACHES = ['binary files', 'dates', 'file stats', 'note index']
+
+# (thread, Counter) for every thread that counted something.
+THREAD_COUNTS = []
+
+THREAD_COUNTS_LOCK = threading.Lock()
+
+# The calling thread's Counter, as its 'counts'.
+LOCAL = threading.local()
+
+################################################################################
+# FUNCTIONS
+################################################################################
+
+
+def get_thread_counts():
+    ''' Return the Counter of the calling thread. '''
+    try:
+        return LOCAL.counts
+    except AttributeError:
+        counts = LOCAL.counts = Counter()
+        with THREAD_COUNTS_LOCK:
+            THREAD_COUNTS.append((threading.current_thread(), counts))
+        return counts
+
+
+def count(name, amount=1):
+    ''' Add amount to the named counter. '''
+    try:
+        LOCAL.counts[name] += amount
+    except AttributeError:
+        get_thread_counts()[name] += amount
+
+
+def count_cache(cache, hit):
+    ''' Count a hit (or with hit false, a miss) of the named cache. '''
+    count(cache + (' hits' if hit else ' misses'))
+
+
+def count_write(text):
+    ''' Count a file written with the given text. '''
+    counts = get_thread_counts()
+    counts['files written'] += 1
+    counts['bytes written'] += len(text)
+
+
+def reset():
+    ''' Start counting from 0, e.g. for the next command. '''
+    with THREAD_COUNTS_LOCK:
+        for _, counts in THREAD_COUNTS:
+            counts.clear()
+        # Threads that are gone have nothing left to count.
+        THREAD_COUNTS[:] = [(thread, counts)
+                            for thread, counts in THREAD_COUNTS
+                            if thread.is_alive()]
+
+
+def get_counts():
+    ''' Return {counter name: count} for every counter counted so far. '''
+    total = Counter()
+    with THREAD_COUNTS_LOCK:
+        for _, counts in THREAD_COUNTS:
+            # Copied in one go, as the thread may still be counting.
+            total.update(dict(counts))
+    return dict(total)
+
+
+def format_stats(counts):
+    ''' Return the counts as lines of text, for --stats. '''
+    lines = ['I/O:']
+    for name in IO_COUNTERS:
+        lines.append('%12d  %s' % (counts.get(name, 0), name))
+    caches = []
+    for cache in CACHES:
+        hits = counts.get(cache + ' hits', 0)
+        misses = counts.get(cache + ' misses', 0)
+        if hits or misses:
+            caches.append('%12s  %s' % ('%d / %d' % (hits, misses), cache))
+    if caches:
+        lines.append('Cache hits / misses:')
+        lines.extend(caches)
+    known = set(IO_COUNTERS)
+    known.update(cache + kind for cache in CACHES
+                 for kind in (' hits', ' misses'))
+    others = sorted(name for name in counts if name not in known)
+    if others:
+        lines.append('Other:')
+        for name in others:
+            lines.append('%12d  %s' % (counts[name], name))
+    return '\n'.join(lines)
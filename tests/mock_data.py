@@ -12,9 +12,19 @@ TEST_LOG_FILTER = ['testing_log']
 TEST_LOG_LINE = 'This is a line to add to a log file.'
 
 
+TEST_NAMES_FILE = '/tmp/test_minion_index/names.pickle'
+
+
+def get_test_settings():
+    ''' The default settings, with everything kept below /tmp. '''
+    settings = brain._settings_parser(TEST_DATA_DIRECTORY)
+    settings.set('performance', 'names_file', TEST_NAMES_FILE)
+    return settings
+
+
 def mock_get_setting(section, key):
     ''' Always return the default settings. '''
-    settings = brain._settings_parser(TEST_DATA_DIRECTORY)
+    settings = get_test_settings()
     return settings.get(section, key)
 
 
@@ -81,3 +91,38 @@ TEST_FILENAME_WITH_DATE = \
 TEST_REMOVE_TAGS = ['foo', 'BAR']
 
 TEST_TOPIC = 'This is a test topic.'
+
+
+TEST_INDEX_FILE = '/tmp/test_minion_index/index.sqlite'
+
+
+def mock_get_setting_with_header(section, key):
+    ''' The default settings, only reading the start of files if we can. '''
+    settings = get_test_settings()
+    settings.set('performance', 'header_bytes', '128')
+    return settings.get(section, key)
+
+
+def mock_get_setting_with_index(section, key):
+    ''' The default settings, with the note index switched on. '''
+    settings = get_test_settings()
+    settings.set('performance', 'use_index', 'true')
+    settings.set('performance', 'index_file', TEST_INDEX_FILE)
+    settings.set('performance', 'index_max_age', '0')
+    return settings.get(section, key)
+
+
+def mock_get_setting_with_index_and_header(section, key):
+    ''' The note index switched on, and only the start of files read. '''
+    settings = get_test_settings()
+    settings.set('performance', 'use_index', 'true')
+    settings.set('performance', 'index_file', TEST_INDEX_FILE)
+    settings.set('performance', 'header_bytes', '128')
+    return settings.get(section, key)
+
+
+def mock_get_setting_with_memory_limit(section, key):
+    ''' The default settings, keeping large notes out of memory. '''
+    settings = get_test_settings()
+    settings.set('performance', 'max_memory_mb', '1')
+    return settings.get(section, key)
@@ -4,3 +4,10 @@ cd ..
 export PYTHONPATH=`pwd`
 cd tests
 python test_brain_of_minion.py
+python test_index_of_minion.py
+python test_watch_of_minion.py
+python test_server_of_minion.py
+python test_benchmarks.py
+python test_trace_of_minion.py
+python test_stats_of_minion.py
+python test_memory_of_minion.py
@@ -0,0 +1,77 @@
+'''Unit tests for the benchmark tree generator and report '''
+import os
+import sys
+import unittest
+
+# Ensure we can load the benchmarks.
+sys.path.insert(0, os.path.abspath('.'))
+from benchmarks.generate import generate_tree
+from benchmarks.micro import measure_memory, time_function
+from benchmarks.run import compare_results, format_report
+
+TEST_TREE = '/tmp/test_minion_benchmarks'
+
+
+def read_tree(directory):
+    ''' Return {path below the directory: content}. '''
+    contents = {}
+    for folder, _, files in os.walk(directory):
+        for filename in files:
+            path = os.path.join(folder, filename)
+            f = open(path)
+            contents[os.path.relpath(path, directory)] = f.read()
+            f.close()
+    return contents
+
+
+class TestGenerate(unittest.TestCase):
+
+    def setUp(self):
+        os.system('rm -rf ' + TEST_TREE)
+
+    def test_same_tree_every_time(self):
+        settings = {'files': 50, 'fanout': 3, 'archive_months': 2,
+                    'huge': 1, 'huge_size': 100000}
+        made = generate_tree(TEST_TREE + '/one', **settings)
+        generate_tree(TEST_TREE + '/two', **settings)
+        one = read_tree(TEST_TREE + '/one')
+        self.assertEqual(one, read_tree(TEST_TREE + '/two'))
+
+        self.assertEqual(len(one), 51)
+        self.assertTrue(any(x.startswith('archive.') for x in one))
+        self.assertEqual(
+            len([x for x in one if made['open_term'] in x]), 1)
+        mail = [x for x in one if x.startswith('mail/')]
+        self.assertEqual(len(mail), 1)
+        self.assertTrue(len(one[mail[0]]) >= 100000)
+
+        generate_tree(TEST_TREE + '/three', seed=1, **settings)
+        self.assertNotEqual(one, read_tree(TEST_TREE + '/three'))
+
+    def tearDown(self):
+        os.system('rm -rf ' + TEST_TREE)
+
+
+class TestReport(unittest.TestCase):
+
+    def test_regressions(self):
+        before = {'results': {'list': {'median': 1.0},
+                              'find': {'median': 2.0},
+                              'gone': {'median': 1.0}}}
+        after = {'results': {'list': {'median': 1.05},
+                             'find': {'median': 2.5}}}
+        rows = compare_results(before, after, 10)
+        self.assertEqual([(x[0], x[-1]) for x in rows],
+                         [('find', True), ('list', False)])
+        self.assertTrue('1 of 2 benchmarks' in format_report(rows, 10))
+
+class TestMicro(unittest.TestCase):
+
+    def test_measure(self):
+        self.assertTrue(0 < time_function(lambda: None, 0.001) < 1e6)
+        memory = measure_memory(lambda: 'x' * (8 << 20))
+        if memory is not None:
+            self.assertTrue(memory >= 7 << 10)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,13 @@
 '''Unit tests for Brain of Minion '''
+import mmap
 import os
+import random
+import re
+import subprocess
 import sys
 import unittest
 from datetime import date
+from StringIO import StringIO
 from mock import MagicMock, mock_open, patch, call
 
 # Our stuff
@@ -68,6 +73,56 @@ class TestFileStuff(unittest.TestCase):
                          'note_template created ' + str(len(results)) +
                          ' files instead of exactly 1.')
 
+    def test_new_notes_walk_once(self):
+        ''' Checking for existing notes should not walk the notes every time.
+        '''
+        TestFileStuff.clean_directory()
+        brain.forget_note_names()
+        def walks():
+            return [x for x in listed.call_args_list
+                    if x[0][0] == TEST_DATA_DIRECTORY]
+        with patch('brain_of_minion.list_entries',
+                   side_effect=brain.list_entries) as listed:
+            results = brain.create_new_notes(['one', 'two', 'one'], 'note')
+            self.assertEqual(len(walks()), 1)
+            self.assertEqual(results[2], (results[0][0], 0))
+
+            # Renamed notes are found by their new name only.
+            old_name = os.path.basename(results[1][0])
+            new_file = brain.rename_file(results[1][0], 'three.txt')
+            self.assertEqual(brain.find_file('three.txt'), new_file)
+            self.assertEqual(brain.find_file(old_name), None)
+            self.assertEqual(len(walks()), 1)
+
+            # Another program adds a folder and moves a note; only what
+            # changed is read again.
+            os.system('mkdir -p %s/later' % TEST_DATA_DIRECTORY)
+            moved = TEST_DATA_DIRECTORY + '/later/three.txt'
+            os.rename(new_file, moved)
+            listed.reset_mock()
+            brain.check_note_names()
+            self.assertEqual(sorted(x[0][0] for x in listed.call_args_list),
+                             [TEST_DATA_DIRECTORY,
+                              TEST_DATA_INBOX,
+                              TEST_DATA_DIRECTORY + '/later'])
+            self.assertEqual(brain.find_file('three.txt'), moved)
+            self.assertEqual(brain.get_note_names()['three.txt'],
+                             set([moved]))
+            listed.reset_mock()
+            brain.check_note_names()
+            self.assertEqual(listed.call_count, 0)
+
+            # The next process starts from the names saved by this one.
+            brain.NOTE_NAMES = None
+            self.assertEqual(brain.find_file('three.txt'), moved)
+            self.assertEqual(listed.call_count, 0)
+            os.remove(moved)
+            self.assertEqual(brain.find_file('three.txt'), None)
+            brain.NOTE_NAMES = None
+            self.assertEqual(brain.find_file('three.txt'), None)
+            self.assertEqual([x[0][0] for x in listed.call_args_list],
+                             [TEST_DATA_DIRECTORY + '/later'])
+
     def test_strays(self):
         ''' Run the strays method. '''
 
@@ -300,6 +355,430 @@ class TestFileStuff(unittest.TestCase):
         os.system('rm -rf ' + TEST_DATA_DIRECTORY)
 
 
+@patch('brain_of_minion.get_setting', new=mock_get_setting)
+class TestMatchNotes(unittest.TestCase):
+    ''' The query evaluator should read each file at most once. '''
+
+    def setUp(self):
+        os.system('mkdir -p ' + TEST_DATA_INBOX)
+        self.notes = []
+        for name, content in [('plan', TEST_FILE_CONTENT_WITH_TAGS),
+                              ('weekend', TEST_FILE_CONTENT),
+                              ('ninja', TEST_FILE_CONTENT_WITH_ONE_TAG)]:
+            filename = '%s/%s.txt' % (TEST_DATA_INBOX, name)
+            f = open(filename, 'w')
+            f.write(content)
+            f.close()
+            self.notes.append(filename)
+        self.opened = []
+
+    def counting_open(self, filename, *args):
+        self.opened.append(filename)
+        return open(filename, *args)
+
+    def match(self, *args, **kwargs):
+        with patch('brain_of_minion.open', create=True,
+                   side_effect=self.counting_open):
+            return brain.match_notes(*args, **kwargs)
+
+    def test_each_file_read_once(self):
+        results = self.match(['goals', 'great', 'accomplish'], self.notes,
+                             full=True)
+        self.assertEqual(results, self.notes)
+        self.assertEqual(sorted(self.opened), sorted(self.notes))
+
+    def test_filename_matches_need_no_reads(self):
+        results = self.match(['plan', 'inbox'], self.notes)
+        self.assertEqual(results, self.notes[:1])
+        self.assertEqual(self.opened, self.notes[1:])
+
+    def test_find_any(self):
+        results = self.match(['weekend', 'foo', 'Slartibarfast'], self.notes,
+                             find_any=True)
+        self.assertEqual(results, self.notes[:2])
+        self.assertEqual(self.opened, [self.notes[0], self.notes[2]])
+
+    def test_binary_files(self):
+        # Only the filename of an unknown binary file matches.
+        binary = TEST_DATA_INBOX + '/gordon-backup.txt'
+        f = open(binary, 'wb')
+        f.write('PK\x03\x04 :tags: ninja\ngordon')
+        f.close()
+        utf8 = TEST_DATA_INBOX + '/utf8.txt'
+        f = open(utf8, 'wb')
+        f.write('\xef\xbb\xbfGordon \x00\n:tags: ninja')
+        f.close()
+        notes = [binary, utf8]
+        with patch('brain_of_minion.is_binary_block',
+                   wraps=brain.is_binary_block) as sniff:
+            self.assertEqual(brain.match_notes(['gordon'], notes, full=True),
+                             notes)
+            self.assertEqual(brain.match_notes(['ninja'], notes), [utf8])
+            self.assertEqual(
+                brain.match_notes(['backup', 'pk'], notes, full=True), [])
+            self.assertEqual(brain.get_file_content(binary), binary + ' ')
+            self.assertEqual(sniff.call_count, 2)
+
+        # A changed file is looked at again.
+        f = open(binary, 'w')
+        f.write('Not so binary any more.\n')
+        f.close()
+        os.utime(binary, (0, 0))
+        self.assertFalse(brain.is_binary_file(binary))
+
+    def test_matched_terms(self):
+        self.assertEqual(
+            brain.get_matched_terms(['Ninja', 'PLAN', 'fo', 'goals'],
+                                    self.notes[0]),
+            ['Ninja', 'PLAN', 'fo'])
+        self.assertEqual(
+            brain.annotate_matched('weekend', ['Weekend', 'end']),
+            'weekend  (matched: Weekend, end)')
+        self.assertEqual(brain.annotate_matched('weekend', []), 'weekend')
+
+    def test_keyword_matcher(self):
+        matcher = brain.KeywordMatcher(['he', 'she', 'his', 'hers', 'is'])
+        self.assertEqual(matcher.search('ushers'), set(['he', 'she', 'hers']))
+        self.assertEqual(matcher.search('this'), set(['his', 'is']))
+        self.assertEqual(matcher.search('xyz'), set())
+        # Both end at the first match.
+        self.assertEqual(matcher.search('ushers', first=True),
+                         set(['she', 'he']))
+
+    def test_large_notes(self):
+        # A saved mail thread, with its tags line after a lot of text.
+        filename = TEST_DATA_INBOX + '/thread.txt'
+        f = open(filename, 'w')
+        f.write('Subject: Cave security\n')
+        f.write('quoted text\n' * (brain.MAP_NOTES_FROM / 10))
+        f.write(':tags: Ninja\nSigned, GORDON\n')
+        f.close()
+        empty = TEST_DATA_INBOX + '/empty.txt'
+        open(empty, 'w').close()
+        notes = [filename, empty]
+
+        for mapped in [True, False]:
+            if mapped:
+                mmap_error = None
+            else:
+                mmap_error = mmap.error('Cannot map.')
+            with patch('mmap.mmap', wraps=mmap.mmap,
+                       side_effect=mmap_error) as map_file:
+                self.assertEqual(
+                    brain.match_notes(['gordon', 'ninja'], notes, full=True),
+                    [filename])
+                self.assertEqual(
+                    brain.match_notes(['security'], notes, full=True),
+                    [filename])
+                self.assertEqual(
+                    brain.match_notes(['ninja', 'thread'], notes), [filename])
+                self.assertEqual(
+                    brain.match_notes(['text\n quoted'], notes, full=True),
+                    [filename])
+                self.assertEqual(
+                    brain.match_notes(['Slartibarfast'], notes, full=True), [])
+                self.assertTrue(map_file.called)
+
+    def test_memory_bounded(self):
+        filename = TEST_DATA_INBOX + '/thread.txt'
+        lines = ['line %05d\n' % number for number in range(10000)]
+        content = 'Subject: Cave security\n' + ''.join(lines)
+        f = open(filename, 'w')
+        f.write(content)
+        f.close()
+
+        with patch('brain_of_minion.get_setting',
+                   new=mock_get_setting_with_memory_limit):
+            # Within the limit, it is mapped as before.
+            note = brain.NoteText(filename)
+            self.assertFalse(note.text() is None)
+            note.close()
+
+        # Over the limit of 1 MB.
+        content += 'x' * (1024 * 1024) + '\n'
+        f = open(filename, 'w')
+        f.write(content)
+        f.close()
+
+        with patch('brain_of_minion.get_setting',
+                   new=mock_get_setting_with_memory_limit):
+            note = brain.NoteText(filename)
+            # Read a line at a time, rather than memory mapped.
+            self.assertEqual(note.text(), None)
+            # Some of these are split between parts.
+            for number in range(5400, 5520):
+                self.assertTrue(note.has_text(
+                    'line %05d\n line %05d' % (number, number + 1)))
+            self.assertFalse(note.has_text('line 00002\n line 00001'))
+            self.assertEqual(
+                brain.match_notes(['security\n line'], [filename],
+                                  full=True), [filename])
+
+            out = StringIO()
+            brain.copy_file(filename, out)
+            self.assertEqual(out.getvalue(), content)
+
+    def test_mapped_parts(self):
+        filename = TEST_DATA_INBOX + '/thread.txt'
+        f = open(filename, 'w')
+        f.write('Subject: Cave security\n')
+        for number in range(10000):
+            f.write('LINE %05d\n' % number)
+        f.close()
+
+        note = brain.NoteText(filename)
+        self.assertFalse(isinstance(note.text(), str))
+        with patch('brain_of_minion.get_spaced_text',
+                   wraps=brain.get_spaced_text) as spaced:
+            # Some of these are split between parts.
+            for number in range(6500, 6600):
+                self.assertTrue(note.has_text(
+                    'line %05d\n line %05d' % (number, number + 1)))
+            self.assertFalse(note.has_text('line 00002\n line 00001'))
+            self.assertTrue(note.has_text('line 09999\n'))
+            self.assertFalse(note.has_text('line 09999\n '))
+        # Spaced a part at a time, never whole.
+        self.assertTrue(max(len(args[0]) for args, _ in spaced.call_args_list)
+                        < brain.MAP_NOTES_FROM + 100)
+        self.assertEqual(note.tag_lines(), 'Subject: Cave security\n')
+        note.close()
+
+        # A single line has no tags line to give.
+        f = open(filename, 'w')
+        f.write('word ' * brain.MAP_NOTES_FROM)
+        f.close()
+        note = brain.NoteText(filename)
+        self.assertEqual(note.tag_lines(), '')
+        note.close()
+
+    def test_limit_notes_agrees(self):
+        for term in ['foo', 'topic', 'ninja', TEST_GIBBERISH]:
+            for full in (False, True):
+                self.assertEqual(
+                    brain.limit_notes(term, self.notes, full),
+                    brain.match_notes([term], self.notes, full=full))
+
+    @patch('brain_of_minion.get_setting', new=mock_get_setting)
+    def test_newest_files(self):
+        # Same modification time for two of them, so names decide.
+        for seconds, filename in zip((3, 2, 2), self.notes):
+            os.utime(filename, (1400000000 + seconds, 1400000000 + seconds))
+        for params in [{}, {'filter': ['ninja']}, {'filter': ['topic']},
+                       {'filter': ['foo', 'ninja'], 'find_any': True}]:
+            matches = brain.find_files(**params)
+            for limit in (0, 1, 2, '10'):
+                found = []
+                self.assertEqual(
+                    brain.find_newest_files(
+                        limit, found=lambda *args: found.append(args),
+                        **params),
+                    (matches[:int(limit)], len(matches)), msg=str(params))
+                if params.get('find_any'):
+                    # With the terms each matched, as get_matched_terms
+                    # finds them.
+                    self.assertEqual(found, [
+                        (x, brain.get_matched_terms(params['filter'], x))
+                        for x in matches[:int(limit)]])
+                else:
+                    self.assertEqual(found,
+                                     [(x, ) for x in matches[:int(limit)]])
+
+        # Each note is opened once, however many terms it matched.
+        with patch('brain_of_minion.open', create=True,
+                   side_effect=self.counting_open):
+            brain.find_newest_files(10, filter=['foo', 'ninja', 'plan'],
+                                    find_any=True, found=lambda *args: None)
+        self.assertEqual(sorted(self.opened), sorted(set(self.opened)))
+
+    @patch('brain_of_minion.get_setting', new=mock_get_setting)
+    def test_newest_files_on_one_pool(self):
+        for params in [{'filter': ['ninja']}, {'filter': [TEST_GIBBERISH]},
+                       {'filter': ['foo', 'ninja'], 'find_any': True}]:
+            for limit in (1, 10):
+                expected = brain.find_newest_files(limit, **params)
+                with patch('brain_of_minion.get_workers', return_value=2):
+                    with patch('brain_of_minion.get_thread_pool',
+                               wraps=brain.get_thread_pool) as get_pool:
+                        self.assertEqual(
+                            brain.find_newest_files(limit, **params),
+                            expected, msg=str(params))
+                self.assertEqual(get_pool.call_count, 1)
+
+    @patch('brain_of_minion.get_setting', new=mock_get_setting)
+    def test_count_and_stop_after(self):
+        for params in [{}, {'filter': ['ninja']}, {'filter': [TEST_GIBBERISH]},
+                       {'filter': ['foo', 'ninja'], 'find_any': True}]:
+            matches = brain.find_files(**params)
+            self.assertEqual(brain.count_files(**params), len(matches))
+            self.assertEqual(sorted(brain.find_files(sort=False, **params)),
+                             sorted(matches))
+            first = brain.find_files(stop_after=1, **params)
+            self.assertEqual(len(first), min(1, len(matches)))
+            self.assertTrue(set(first) <= set(matches))
+
+        # No more notes are read once the answer is known.
+        with patch('brain_of_minion.open', create=True,
+                   side_effect=self.counting_open):
+            self.assertEqual(brain.count_files(filter=['topic'],
+                                               full_text=True, stop_after=2),
+                             2)
+        self.assertEqual(len(self.opened), 2)
+
+    @patch('brain_of_minion.get_setting', new=mock_get_setting)
+    def test_choose_file(self):
+        filename, match_files = brain.choose_file(['weekend'])
+        self.assertEqual(match_files, [self.notes[1]])
+        self.assertEqual(filename, self.notes[1])
+        filename, match_files = brain.choose_file(['plan', 'weekend'],
+                                                  full_text=True)
+        self.assertEqual(filename, None)
+        self.assertEqual(match_files,
+                         brain.find_files(filter=['plan', 'weekend'],
+                                          full_text=True))
+
+        # With more than one match, the notes are still read only once.
+        with patch('brain_of_minion.open', create=True,
+                   side_effect=self.counting_open):
+            filename, match_files = brain.choose_file(['topic'],
+                                                      full_text=True)
+        self.assertEqual(filename, None)
+        self.assertEqual(match_files, brain.find_files(filter=['topic'],
+                                                       full_text=True))
+        self.assertEqual(len(match_files), 3)
+        self.assertEqual(sorted(self.opened), sorted(self.notes))
+
+    @patch('brain_of_minion.get_setting', new=mock_get_setting)
+    def test_choose_file_on_one_pool(self):
+        for terms in (['weekend'], ['topic'], [TEST_GIBBERISH]):
+            expected = brain.choose_file(terms, full_text=True)
+            first = brain.find_files(filter=terms, full_text=True,
+                                     stop_after=1)
+            with patch('brain_of_minion.get_workers', return_value=2):
+                with patch('brain_of_minion.get_thread_pool',
+                           wraps=brain.get_thread_pool) as get_pool:
+                    self.assertEqual(brain.choose_file(terms, full_text=True),
+                                     expected)
+                    self.assertEqual(
+                        brain.find_files(filter=terms, full_text=True,
+                                         stop_after=1), first)
+            self.assertEqual(get_pool.call_count, 2)
+
+    @patch('brain_of_minion.get_setting', new=mock_get_setting)
+    def test_newest_files_checked_once(self):
+        for seconds, filename in zip((1, 2, 3), self.notes):
+            os.utime(filename, (1400000000 + seconds, 1400000000 + seconds))
+        with patch('brain_of_minion.get_note_matcher') as get_matcher:
+            get_matcher.return_value.side_effect = self.opened.append
+            brain.find_newest_files(1, filter=['x'])
+        # The newest first, as it may be the one to show.
+        self.assertEqual(self.opened[0], self.notes[2])
+        self.assertEqual(sorted(self.opened), sorted(self.notes))
+
+    def test_header_mode(self):
+        top = TEST_DATA_INBOX + '/top.txt'
+        f = open(top, 'w')
+        f.write('Weekend Plan\n:date: 2014-04-14\n:tags: Ninja\n')
+        f.write('Some text.\n' * 10)
+        f.write('The rest of it, 2012-01-01.\n' * 100)
+        f.close()
+        with patch('brain_of_minion.get_setting',
+                   new=mock_get_setting_with_header):
+            with patch('brain_of_minion.get_file_content') as whole_file:
+                self.assertEqual(brain.get_tags(top), ['Ninja'])
+                self.assertEqual(brain.match_notes(['ninja'], [top]), [top])
+                self.assertEqual(brain.get_first_dates([top]),
+                                 {top: date(2014, 4, 14)})
+                self.assertFalse(whole_file.called)
+
+            # Without a tags line in the head, the whole file is looked at.
+            self.assertEqual(brain.get_tags(self.notes[0]),
+                             ['BAR', 'Ninja', 'foo'])
+            self.assertEqual(brain.match_notes(['foo'], self.notes),
+                             self.notes[:1])
+
+        # Without header_bytes, every date counts.
+        self.assertEqual(brain.get_first_dates([top]),
+                         {top: date(2012, 1, 1)})
+
+    def tearDown(self):
+        os.system('rm -rf ' + TEST_DATA_DIRECTORY)
+
+
+class TestScanTree(unittest.TestCase):
+    ''' The directory walker behind get_files. '''
+
+    def setUp(self):
+        os.system('rm -rf ' + TEST_DATA_DIRECTORY)
+        os.system('mkdir -p %s %s/archive.14.04' % (TEST_DATA_INBOX,
+                                                   TEST_DATA_DIRECTORY))
+        for filename in [TEST_FILE_PATH,
+                         TEST_DATA_DIRECTORY + '/archive.14.04/old.txt']:
+            f = open(filename, 'w')
+            f.write(TEST_FILE_CONTENT)
+            f.close()
+        self.listed = []
+
+    def counting_list_entries(self, directory):
+        self.listed.append(directory)
+        return self.real_list_entries(directory)
+
+    def scan(self, *args):
+        self.real_list_entries = brain.list_entries
+        with patch('brain_of_minion.list_entries',
+                   side_effect=self.counting_list_entries):
+            return brain.scan_tree(*args)
+
+    def test_archives_are_not_entered(self):
+        files, folders = self.scan(TEST_DATA_DIRECTORY, False)
+        self.assertEqual([x[0] for x in files], [TEST_FILE_PATH])
+        self.assertEqual(sorted(self.listed),
+                         [TEST_DATA_DIRECTORY, TEST_DATA_INBOX])
+
+    def test_archives_on_request(self):
+        files, folders = self.scan(TEST_DATA_DIRECTORY, True)
+        self.assertEqual(len(files), 2)
+        self.assertEqual(len(folders), 2)
+
+    def test_symlink_loop(self):
+        os.symlink(TEST_DATA_DIRECTORY, TEST_DATA_INBOX + '/loop')
+        files, folders = self.scan(TEST_DATA_DIRECTORY, True)
+        self.assertEqual(len(files), 2)
+        self.assertEqual(len(self.listed), 3)
+
+    def test_parallel_walk_gives_the_same_result(self):
+        os.system('mkdir -p %s/a/b %s/c' % (TEST_DATA_INBOX, TEST_DATA_INBOX))
+        os.system('touch %s/a/b/1.txt %s/c/2.txt' % (TEST_DATA_INBOX,
+                                                    TEST_DATA_INBOX))
+        os.symlink(TEST_DATA_INBOX + '/a', TEST_DATA_INBOX + '/c/a')
+        # Walking changes folder access times, so leave those out.
+        def walk(archives, workers):
+            return [[(path, item_stat.st_mtime, item_stat.st_size)
+                     for path, item_stat in items]
+                    for items in brain.scan_tree(TEST_DATA_DIRECTORY,
+                                                 archives, workers)]
+        for archives in (False, True):
+            self.assertEqual(walk(archives, 4), walk(archives, 1))
+
+    def test_parallel_reads_give_the_same_result(self):
+        notes = brain.get_files(TEST_DATA_DIRECTORY, True)
+        for full in (False, True):
+            expected = brain.match_notes(['topic'], notes, full=full)
+            with patch('brain_of_minion.get_workers', return_value=4):
+                self.assertEqual(
+                    brain.match_notes(['topic'], notes, full=full), expected)
+
+    def test_get_files_keeps_stats(self):
+        os.utime(TEST_FILE_PATH, (1400000000, 1400000000))
+        self.assertEqual(brain.get_files(TEST_DATA_DIRECTORY),
+                         [TEST_FILE_PATH])
+        with patch('os.path.getmtime') as getmtime:
+            self.assertEqual(brain.get_mtime(TEST_FILE_PATH), 1400000000)
+            self.assertFalse(getmtime.called)
+
+    def tearDown(self):
+        os.system('rm -rf ' + TEST_DATA_DIRECTORY)
+
+
 class TestParsers(unittest.TestCase):
     ''' Test methods that parse through file contents looking for things.'''
 
@@ -356,6 +835,47 @@ class TestParsers(unittest.TestCase):
         self.assertEqual(TEST_TAGS_OUT, result)
 
 
+def reference_unique_dates(content):
+    ''' The original five pass get_unique_dates, to compare against. '''
+    recognizers = {
+        '\d{1,2}\.\d{1,2}\.\d{4}\D': '%m.%d.%Y',
+        '\d{1,2}\.\d{1,2}\.\d{2}\D': '%m.%d.%y',
+        '\d{1,2}/\d{1,2}/\d{4}\D': '%m/%d/%Y',
+        '\d{1,2}/\d{1,2}/\d{2}\D': '%m/%d/%y',
+        '\d{4}-\d{2}-\d{2}\D': '%Y-%m-%d'}
+    dates = []
+    for key in recognizers:
+        for match in re.findall(key, content):
+            try:
+                new_date = datetime.strptime(match[:-1],
+                                             recognizers[key]).date()
+                if date(2010, 1, 1) < new_date < date(2049, 12, 31):
+                    dates.append(new_date)
+            except ValueError:
+                pass
+    if len(dates) == 0:
+        return None
+    return sorted(set(dates))
+
+
+class TestDateCorpus(unittest.TestCase):
+    ''' The single pass date parser against the original one. '''
+
+    def test_date_corpus(self):
+        rand = random.Random(42)
+        pieces = ['2014-08-12', '2014-13-01', '2014-02-30', '1999-01-01',
+                  '12/15/2014', '12/26/14', '1/2/14', '31/12/14', '2/29/16',
+                  '2/29/15', '1.2.2015', '10.11.12', '3.4.69', '0/0/00',
+                  '12.25.2049', '1/1/2010', '1/2/2010', '7/4/2048', '123/4/5',
+                  'v1.2.3', 'Weekend', ':date:', 'call at 9:15', '\n', ' ']
+        for _ in range(2000):
+            content = ' '.join(rand.choice(pieces)
+                               for _ in range(rand.randint(1, 12)))
+            content += rand.choice(['', '\n', '.'])
+            self.assertEqual(brain.get_unique_dates(content),
+                             reference_unique_dates(content), msg=content)
+
+
 class TestGetSetting(unittest.TestCase):
 
     def test_get_setting(self):
@@ -389,6 +909,90 @@ class TestGetSetting(unittest.TestCase):
         self.assertEqual(expected_actions, actual_actions)
 
 
+class TestLazyGlobals(unittest.TestCase):
+
+    def test_import_has_no_side_effects(self):
+        ''' Importing the brain should not touch the settings file. '''
+        home = '/tmp/test_minion_home'
+        os.system('rm -rf %s' % home)
+        os.mkdir(home)
+        environment = dict(os.environ, HOME=home)
+        script = ('import sys; import brain_of_minion; '
+                  'print [x for x in ("platform", "sqlite3", "mmap") '
+                  'if x in sys.modules]')
+        output = subprocess.check_output([sys.executable, '-c', script],
+                                         env=environment)
+        self.assertEqual(output, '[]\n')
+        self.assertEqual(os.listdir(home), [])
+        os.system('rm -rf %s' % home)
+
+    def test_loaded_once(self):
+        loads = []
+
+        def load():
+            loads.append(1)
+            return {'default': 'less'}
+        viewers = brain.LazyGlobal('viewers', load)
+        self.assertFalse(viewers.is_loaded())
+        self.assertTrue('default' in viewers)
+        self.assertEqual(viewers['default'], 'less')
+        self.assertEqual(viewers.get('.pdf', 'less'), 'less')
+        self.assertEqual(loads, [1])
+        self.assertTrue(viewers.load_time >= 0)
+
+        viewers.reset()
+        self.assertFalse(viewers.is_loaded())
+        self.assertEqual(dict(viewers), {'default': 'less'})
+        self.assertEqual(loads, [1, 1])
+
+    def test_refresh_settings(self):
+        brain.get_setting('notes', 'home')
+        brain.refresh_settings()
+        # Unchanged settings are kept, but the date may have moved on.
+        self.assertTrue(brain.GLOBAL_SETTINGS.is_loaded())
+        self.assertFalse(brain.GLOBAL_DATA.is_loaded())
+        with patch('brain_of_minion.get_settings_mtime', return_value=-1):
+            brain.refresh_settings()
+            self.assertFalse(brain.GLOBAL_SETTINGS.is_loaded())
+            self.assertNotEqual(brain.get_setting('notes', 'home'), None)
+            self.assertEqual(brain.SETTINGS_MTIME, -1)
+
+
+class TestResolvedSettings(unittest.TestCase):
+
+    @patch('brain_of_minion.get_setting', new=mock_get_setting)
+    def test_worked_out_once(self):
+        settings = brain.get_resolved_settings()
+        self.assertEqual(settings.notes_home, TEST_DATA_DIRECTORY)
+        self.assertEqual(settings.tagline, ':tags:')
+        self.assertFalse(settings.tags_case_sensitive)
+        self.assertEqual(settings.included_exts, ('*', ))
+        with patch('brain_of_minion.resolve_settings') as resolve:
+            self.assertTrue(brain.get_resolved_settings() is settings)
+            self.assertEqual(
+                brain.clean_string(TEST_DATA_INBOX + '/a-plan.txt'),
+                ' : inbox : a plan')
+        self.assertFalse(resolve.called)
+
+    def test_follows_the_settings(self):
+        with patch('brain_of_minion.get_setting', new=mock_get_setting):
+            settings = brain.get_resolved_settings()
+        with patch('brain_of_minion.get_setting',
+                   side_effect=self.case_sensitive):
+            self.assertTrue(brain.get_resolved_settings().tags_case_sensitive)
+            self.assertEqual(brain.normalize_tags(['Ninja']),
+                             frozenset(['Ninja']))
+        with patch('brain_of_minion.get_setting', new=mock_get_setting):
+            brain.GLOBAL_SETTINGS.reset()
+            self.assertFalse(brain.get_resolved_settings() is settings)
+            self.assertEqual(brain.get_resolved_settings(), settings)
+
+    def case_sensitive(self, section, key):
+        if (section, key) == ('compose', 'tags_case_sensitive'):
+            return 'true'
+        return mock_get_setting(section, key)
+
+
 @patch('__builtin__.open', new_callable=mock_open)
 @patch('brain_of_minion.get_setting', new=mock_get_setting)
 # @patch('os.mkdir')
@@ -422,6 +1026,85 @@ class TestRemind(unittest.TestCase):
         self.assertEqual(len(match_files), 0)
 
 
+@patch('brain_of_minion.get_setting', new=mock_get_setting)
+class TestBatch(unittest.TestCase):
+    ''' Sort commands applied to many files in one go. '''
+
+    def setUp(self):
+        os.system('rm -rf ' + TEST_DATA_DIRECTORY)
+        os.system('mkdir -p %s %s' % (TEST_DATA_INBOX, TEST_DATA_NOT_INBOX))
+        self.files = []
+        for name in ['one', 'two', 'three']:
+            filename = os.path.join(TEST_DATA_INBOX, name + '.txt')
+            f = open(filename, 'w')
+            f.write(TEST_FILE_CONTENT)
+            f.close()
+            self.files.append(filename)
+
+    def tearDown(self):
+        os.system('rm -rf ' + TEST_DATA_DIRECTORY)
+
+    def apply_batch(self, lines):
+        out = StringIO()
+        errors = brain.apply_batch(lines, out, messages=StringIO())
+        return errors, [line.split('\t') for line in
+                        out.getvalue().splitlines()]
+
+    def test_apply_batch(self):
+        one, two, three = self.files
+        elsewhere = os.path.join(TEST_DATA_DIRECTORY, 'elsewhere')
+        with patch('os.mkdir', wraps=os.mkdir) as mkdir:
+            errors, results = self.apply_batch([
+                '%s\t+ninja >elsewhere\n' % one,
+                '\n',
+                '%s\t>elsewhere\n' % two,
+                '%s\t!rename new name\n' % three])
+        self.assertEqual(errors, 0)
+        self.assertEqual(results, [
+            ['ok', one, os.path.join(elsewhere, 'one.txt')],
+            ['ok', two, os.path.join(elsewhere, 'two.txt')],
+            ['ok', three, os.path.join(TEST_DATA_INBOX, 'new-name.txt')]])
+        # The folder is made once, for the first file moved there.
+        mkdir.assert_called_once_with(elsewhere)
+        self.assertEqual(sorted(os.listdir(elsewhere)),
+                         ['one.txt', 'two.txt'])
+        self.assertTrue(brain.content_has_tag(
+            brain.get_file_content(results[0][2]), 'ninja'))
+        self.assertEqual(brain.FOLDER_CACHE, None)
+
+    def test_errors(self):
+        one, two, three = self.files
+        missing = os.path.join(TEST_DATA_INBOX, 'missing.txt')
+        errors, results = self.apply_batch([
+            '%s\t+ninja\n' % missing,
+            '%s\t!edit\n' % one,
+            '%s\td\n' % two,
+            '%s\t!rename\n' % three,
+            'no tab here\n'])
+        self.assertEqual(errors, 5)
+        self.assertEqual([result[:2] for result in results], [
+            ['error', missing], ['error', one], ['error', two],
+            ['error', three], ['error', 'no tab here']])
+        # Nothing was asked, and nothing changed.
+        self.assertEqual(sorted(os.listdir(TEST_DATA_INBOX)),
+                         ['one.txt', 'three.txt', 'two.txt'])
+
+    def test_move_file(self):
+        one = self.files[0]
+        moved = os.path.join(TEST_DATA_NOT_INBOX, 'one.txt')
+        with patch('shutil.move') as move:
+            brain.move_file(one, moved)
+        self.assertFalse(move.called)
+        self.assertTrue(os.path.exists(moved))
+
+        # Another file system.
+        def rename(source, destination):
+            raise OSError(brain.errno.EXDEV, 'Invalid cross-device link')
+        with patch('os.rename', new=rename):
+            brain.move_file(moved, one)
+        self.assertTrue(os.path.exists(one))
+
+
 class TestTags(unittest.TestCase):
     ''' Test suite for tag handling. '''
 
@@ -0,0 +1,348 @@
+'''Unit tests for the Minion note index '''
+import os
+import sys
+import unittest
+from datetime import date, timedelta
+from mock import patch
+
+# Our stuff
+# Ensure we can load the brain library.
+sys.path.insert(0, os.path.abspath('.'))
+import brain_of_minion as brain
+from index_of_minion import NoteIndex, SUBSTRING, PREFIX, TOKEN, FILENAME
+from tests.mock_data import *
+
+
+def write_file(filename, content):
+    folder = os.path.dirname(filename)
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    f = open(filename, 'w')
+    f.write(content)
+    f.close()
+
+
+class TestNoteIndex(unittest.TestCase):
+    ''' Exercise the index directly, counting what it re-reads. '''
+
+    def setUp(self):
+        os.system('rm -rf %s %s' % (TEST_DATA_DIRECTORY,
+                                    os.path.dirname(TEST_INDEX_FILE)))
+        write_file(TEST_DATA_INBOX + '/one.txt', TEST_FILE_CONTENT_WITH_TAGS)
+        write_file(TEST_DATA_NOT_INBOX + '/two.txt', TEST_FILE_CONTENT)
+        self.extracted = []
+        self.index = NoteIndex(TEST_INDEX_FILE, TEST_DATA_DIRECTORY,
+                               self.extract)
+
+    def extract(self, filename):
+        self.extracted.append(filename)
+        return {'tags': ['Foo', os.path.basename(filename)],
+                'tag_set': ['foo', os.path.basename(filename)],
+                'dates': [EXPECTED_DATE.date()],
+                'body': open(filename).read()}
+
+    def refresh(self):
+        files, folders = brain.get_file_stats(TEST_DATA_DIRECTORY)
+        return self.index.refresh(files, folders)
+
+    def test_refresh_reads_only_changed_files(self):
+        self.assertEqual(self.refresh(), 2)
+        self.assertEqual(self.refresh(), 0)
+
+        write_file(TEST_DATA_INBOX + '/one.txt', 'Changed, and longer.')
+        self.extracted = []
+        self.assertEqual(self.refresh(), 1)
+        self.assertEqual(self.extracted, [TEST_DATA_INBOX + '/one.txt'])
+
+    def test_refresh_forgets_removed_files(self):
+        self.refresh()
+        os.remove(TEST_DATA_NOT_INBOX + '/two.txt')
+        self.refresh()
+        self.assertEqual(list(self.index.get_files()),
+                         [TEST_DATA_INBOX + '/one.txt'])
+
+    def test_index_survives_reopening(self):
+        self.refresh()
+        self.index.close()
+        index = NoteIndex(TEST_INDEX_FILE, TEST_DATA_DIRECTORY, self.extract)
+        self.extracted = []
+        files, folders = brain.get_file_stats(TEST_DATA_DIRECTORY)
+        self.assertEqual(index.refresh(files, folders), 0)
+
+    def test_new_notes_home_starts_over(self):
+        self.refresh()
+        self.index.close()
+        index = NoteIndex(TEST_INDEX_FILE, TEST_DATA_INBOX, self.extract)
+        self.assertEqual(index.get_files(), {})
+
+    def test_folders_and_children(self):
+        self.refresh()
+        self.assertEqual(self.index.get_folders(),
+                         [TEST_DATA_INBOX, TEST_DATA_NOT_INBOX])
+        self.assertEqual(self.index.get_children(TEST_DATA_INBOX),
+                         [TEST_DATA_INBOX + '/one.txt'])
+
+    def test_search_single_word_is_exact(self):
+        self.refresh()
+        self.assertEqual(self.index.search_text('ACCOMPLISH'),
+                         (set([TEST_DATA_INBOX + '/one.txt',
+                               TEST_DATA_NOT_INBOX + '/two.txt']), True))
+        # Part of a word still counts, as with 'in' on the content.
+        self.assertEqual(self.index.search_text('injA'),
+                         (set([TEST_DATA_INBOX + '/one.txt']), True))
+
+    def test_search_phrase_gives_candidates(self):
+        self.refresh()
+        paths, exact = self.index.search_text('great topic')
+        self.assertFalse(exact)
+        self.assertEqual(len(paths), 2)
+        paths, exact = self.index.search_text('topic great')
+        self.assertEqual(paths, set())
+
+    def test_search_modes(self):
+        self.refresh()
+        self.assertEqual(self.index.search_text('accomp', PREFIX)[0],
+                         set([TEST_DATA_INBOX + '/one.txt',
+                              TEST_DATA_NOT_INBOX + '/two.txt']))
+        self.assertEqual(self.index.search_text('accomp', TOKEN)[0], set())
+        self.assertEqual(self.index.search_text('omplish', PREFIX)[0], set())
+        self.assertEqual(self.index.search_text('such goals', TOKEN)[0],
+                         set([TEST_DATA_INBOX + '/one.txt',
+                              TEST_DATA_NOT_INBOX + '/two.txt']))
+
+    def test_search_file_names(self):
+        self.refresh()
+        self.assertEqual(self.index.search_text('two', fields=[FILENAME]),
+                         (set([TEST_DATA_NOT_INBOX + '/two.txt']), True))
+
+    def test_search_follows_changes(self):
+        self.refresh()
+        write_file(TEST_DATA_INBOX + '/one.txt', 'Nothing to see here.')
+        self.refresh()
+        self.assertEqual(self.index.search_text('accomplish')[0],
+                         set([TEST_DATA_NOT_INBOX + '/two.txt']))
+        self.assertEqual(self.index.search_text('see')[0],
+                         set([TEST_DATA_INBOX + '/one.txt']))
+
+    def test_search_without_words(self):
+        self.refresh()
+        self.assertEqual(self.index.search_text('?!'), None)
+
+    def test_tags(self):
+        self.refresh()
+        one = TEST_DATA_INBOX + '/one.txt'
+        two = TEST_DATA_NOT_INBOX + '/two.txt'
+        self.assertEqual(self.index.get_tags(one), ['Foo', 'one.txt'])
+        self.assertEqual(self.index.get_tags('/nowhere.txt'), None)
+        note_tags = self.index.get_note_tags([one, two])
+        self.assertEqual(note_tags[one], frozenset(['foo', 'one.txt']))
+        self.assertEqual(note_tags.get(two), frozenset(['foo', 'two.txt']))
+        self.assertFalse('/nowhere.txt' in note_tags)
+        self.assertEqual(note_tags.get('/nowhere.txt'), None)
+        self.assertEqual(self.index.get_note_tags([one]).get(two), None)
+        note_tags = self.index.get_note_tags([one])
+        note_tags.load()
+        self.assertEqual(note_tags._tags, {one: frozenset(['foo', 'one.txt'])})
+        self.assertEqual(self.index.get_tagged_files(['foo']),
+                         set([one, two]))
+        self.assertEqual(self.index.get_tagged_files(['foo', 'two.txt']),
+                         set([two]))
+        self.assertEqual(self.index.get_tagged_files(['Foo']), set())
+        self.assertEqual(
+            self.index.get_tagged_files(['foo'], TEST_DATA_INBOX), set([one]))
+
+    def test_find_name(self):
+        self.refresh()
+        self.assertEqual(self.index.find_name('two.txt'),
+                         TEST_DATA_NOT_INBOX + '/two.txt')
+        self.assertEqual(self.index.find_name('three.txt'), None)
+        os.rename(TEST_DATA_NOT_INBOX + '/two.txt',
+                  TEST_DATA_INBOX + '/three.txt')
+        self.index.update_path(TEST_DATA_NOT_INBOX + '/two.txt')
+        self.index.update_path(TEST_DATA_INBOX + '/three.txt')
+        self.assertEqual(self.index.find_name('two.txt'), None)
+        self.assertEqual(self.index.find_name('three.txt'),
+                         TEST_DATA_INBOX + '/three.txt')
+
+    def test_dates(self):
+        self.refresh()
+        day = EXPECTED_DATE.date()
+        expected = {TEST_DATA_INBOX + '/one.txt': [day],
+                    TEST_DATA_NOT_INBOX + '/two.txt': [day]}
+        self.assertEqual(self.index.get_dates(), expected)
+        self.assertEqual(self.index.get_dates(start=day, end=day), expected)
+        self.assertEqual(self.index.get_dates(start=day + timedelta(1)), {})
+        self.assertEqual(self.index.get_dates(end=day - timedelta(1)), {})
+        self.assertEqual(self.index.get_first_dates(),
+                         dict((path, day) for path in expected))
+
+    def test_dates_follow_removed_files(self):
+        self.refresh()
+        os.remove(TEST_DATA_NOT_INBOX + '/two.txt')
+        self.refresh()
+        self.assertEqual(list(self.index.get_dates()),
+                         [TEST_DATA_INBOX + '/one.txt'])
+
+    def tearDown(self):
+        self.index.close()
+        os.system('rm -rf %s %s' % (TEST_DATA_DIRECTORY,
+                                    os.path.dirname(TEST_INDEX_FILE)))
+
+
+@patch('brain_of_minion.get_setting', new=mock_get_setting_with_index)
+class TestIndexedBrain(unittest.TestCase):
+    ''' The brain should give the same answers with the index switched on. '''
+
+    def setUp(self):
+        os.system('rm -rf %s %s' % (TEST_DATA_DIRECTORY,
+                                    os.path.dirname(TEST_INDEX_FILE)))
+        write_file(TEST_DATA_INBOX + '/ninja-plan.txt',
+                   TEST_FILE_CONTENT_WITH_ONE_TAG)
+        write_file(TEST_DATA_INBOX + '/weekend.txt', TEST_FILE_CONTENT)
+        write_file(TEST_DATA_NOT_INBOX + '/tagged.txt',
+                   TEST_FILE_CONTENT_WITH_TAGS)
+        write_file(TEST_DATA_DIRECTORY + '/archive.14.04/old-ninja.txt',
+                   TEST_FILE_CONTENT)
+        write_file(TEST_DATA_NOT_INBOX + '/dated.txt',
+                   'Started 1/5/13, done 2013-02-01 and again 3.4.2015.\n')
+        os.utime(TEST_DATA_INBOX + '/weekend.txt', (1400000000, 1400000000))
+
+    def without_index(self, function, *args, **kwargs):
+        with patch('brain_of_minion.get_setting', new=mock_get_setting):
+            return function(*args, **kwargs)
+
+    def test_find_files_matches_disk(self):
+        for params in [{}, {'filter': ['ninja']}, {'filter': ['foo']},
+                       {'filter': ['ninja'], 'archives': True},
+                       {'filter': ['topic'], 'full_text': True},
+                       {'filter': ['is: this', 'such'], 'full_text': True},
+                       {'filter': ['so accomp'], 'full_text': True},
+                       {'filter': ['goals.'], 'full_text': True},
+                       {'filter': ['plan', 'foo'], 'find_any': True}]:
+            self.assertEqual(brain.find_files(**params),
+                             self.without_index(brain.find_files, **params),
+                             msg=str(params))
+
+    def test_newest_files_match_disk(self):
+        for params in [{}, {'filter': ['ninja']}, {'archives': True},
+                       {'filter': ['topic'], 'full_text': True},
+                       {'filter': ['plan', 'foo'], 'find_any': True}]:
+            for limit in (1, 3, 10):
+                self.assertEqual(
+                    brain.find_newest_files(limit, **params),
+                    self.without_index(brain.find_newest_files, limit,
+                                       **params),
+                    msg=str(params))
+
+    def test_read_workers(self):
+        # The notes are matched on threads that cannot use the index.
+        params = {'filter': ['ninja']}
+        with patch('brain_of_minion.get_workers', return_value=4):
+            self.assertEqual(brain.find_files(**params),
+                             self.without_index(brain.find_files, **params))
+            self.assertEqual(brain.find_newest_files(1, **params),
+                             self.without_index(brain.find_newest_files, 1,
+                                                **params))
+
+    def test_tags_added_by_minion_are_found(self):
+        brain.find_files()
+        brain.add_tags_to_file(['shuriken'], TEST_DATA_INBOX + '/weekend.txt')
+        self.assertEqual(brain.find_files(filter=['shuriken']),
+                         [TEST_DATA_INBOX + '/weekend.txt'])
+
+    def test_find_file(self):
+        brain.find_files()
+        weekend = TEST_DATA_INBOX + '/weekend.txt'
+        self.assertEqual(brain.find_file('weekend.txt'), weekend)
+        # Another program moves a note after the index was refreshed.
+        moved = TEST_DATA_DIRECTORY + '/later/weekend.txt'
+        write_file(moved, TEST_FILE_CONTENT)
+        os.remove(weekend)
+        with patch('brain_of_minion.list_entries',
+                   side_effect=brain.list_entries) as listed:
+            # Trusted while it is fresh.
+            with patch('brain_of_minion.is_index_stale', return_value=False):
+                self.assertEqual(brain.find_file('weekend.txt'), None)
+            self.assertEqual(listed.call_count, 0)
+            with patch('brain_of_minion.is_index_stale', return_value=True):
+                self.assertEqual(brain.find_file('weekend.txt'), moved)
+        # Only the notes home, and the folders changed in it, were read.
+        self.assertEqual(sorted(x[0][0] for x in listed.call_args_list),
+                         [TEST_DATA_DIRECTORY,
+                          TEST_DATA_INBOX,
+                          TEST_DATA_DIRECTORY + '/later'])
+
+    def test_last_modified(self):
+        self.assertEqual(brain.get_last_modified(),
+                         self.without_index(brain.get_last_modified))
+
+    def test_tags_match_disk(self):
+        files = brain.find_files(archives=True)
+        for tags in [['ninja'], ['ninja', 'bar'], ['NINJA'], ['nin'], []]:
+            self.assertEqual(
+                brain.get_tagged_files(tags),
+                self.without_index(brain.get_tagged_files, tags),
+                msg=str(tags))
+            for filename in files:
+                self.assertEqual(
+                    brain.has_any_tag(filename, tags),
+                    self.without_index(brain.has_any_tag, filename, tags))
+        for filename in files:
+            self.assertEqual(brain.get_tags(filename),
+                             self.without_index(brain.get_tags, filename))
+
+    def test_tagged_files_follow_tag_changes(self):
+        brain.find_files()
+        weekend = TEST_DATA_INBOX + '/weekend.txt'
+        brain.add_tags_to_file(['Ninja', 'shuriken'], weekend)
+        self.assertEqual(brain.get_tagged_files(['ninja', 'shuriken']),
+                         [weekend])
+        brain.remove_tags_from_file(['shuriken'], weekend)
+        self.assertEqual(brain.get_tagged_files(['shuriken']), [])
+        self.assertTrue(weekend in brain.get_tagged_files(['ninja']))
+
+    def test_dates_match_disk(self):
+        files = brain.find_files()
+        for start, end in [(None, None), (date(2013, 2, 1), None),
+                           (None, date(2014, 1, 1)),
+                           (date(2013, 1, 6), date(2015, 3, 3))]:
+            self.assertEqual(
+                brain.get_dated_files(files, start, end),
+                self.without_index(brain.get_dated_files, files, start, end))
+        for year in ['2013', '2014', '2015']:
+            self.assertEqual(
+                brain.limit_to_year(year, files),
+                self.without_index(brain.limit_to_year, year, files))
+        self.assertEqual(brain.sort_by_first_date(files),
+                         self.without_index(brain.sort_by_first_date, files))
+        self.assertEqual(brain.sort_by_first_date(files)[0],
+                         TEST_DATA_NOT_INBOX + '/dated.txt')
+
+    def test_first_dates_in_header_mode(self):
+        # A date in the head, and earlier ones further down.
+        write_file(TEST_DATA_INBOX + '/top.txt',
+                   'Weekend Plan\n:date: 2014-04-14\n' + 'Some text.\n' * 10 +
+                   'The rest of it, 2012-01-01.\n' * 100)
+        files = brain.find_files()
+        with patch('brain_of_minion.get_setting',
+                   new=mock_get_setting_with_index_and_header):
+            indexed = brain.get_first_dates(files)
+            self.assertEqual(brain.limit_to_year('2012', files), [])
+        with patch('brain_of_minion.get_setting',
+                   new=mock_get_setting_with_header):
+            self.assertEqual(indexed, brain.get_first_dates(files))
+        self.assertEqual(indexed[TEST_DATA_INBOX + '/top.txt'],
+                         date(2014, 4, 14))
+
+    def test_summary_and_strays(self):
+        self.assertEqual(brain.get_folder_summary(),
+                         self.without_index(brain.get_folder_summary))
+        self.assertEqual(sorted(brain.list_stray_files()),
+                         sorted(self.without_index(brain.list_stray_files)))
+
+    def tearDown(self):
+        os.system('rm -rf %s %s' % (TEST_DATA_DIRECTORY,
+                                    os.path.dirname(TEST_INDEX_FILE)))
+
+if __name__ == '__main__':
+    unittest.main()
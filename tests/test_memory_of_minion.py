@@ -0,0 +1,88 @@
+'''Unit tests for --memory-report '''
+import os
+import sys
+import unittest
+
+# Our stuff
+# Ensure we can load the brain library.
+sys.path.insert(0, os.path.abspath('.'))
+import memory_of_minion
+import trace_of_minion
+
+
+class TestMemoryReport(unittest.TestCase):
+
+    def tearDown(self):
+        trace_of_minion.stop()
+
+    @unittest.skipUnless(os.path.exists(memory_of_minion.STATUS_FILE),
+                         'Needs /proc')
+    def test_memory(self):
+        memory = memory_of_minion.get_memory()
+        self.assertTrue(memory > 0)
+        self.assertTrue(memory_of_minion.get_peak_memory() >= memory)
+
+    def test_spans_note_memory(self):
+        memory = iter([1000, 1500, 1600, 1600])
+        trace_of_minion.start(lambda: next(memory))
+        with trace_of_minion.span('outer'):
+            with trace_of_minion.span('inner'):
+                pass
+        events = trace_of_minion.stop()
+        self.assertEqual(
+            [(x['name'], x['args']) for x in events if x['ph'] == 'X'],
+            [('outer', {'memory_kb': 600}), ('inner', {'memory_kb': 100})])
+
+        # Not noted unless asked for.
+        trace_of_minion.start()
+        with trace_of_minion.span('outer'):
+            pass
+        self.assertEqual(trace_of_minion.stop()[-1]['args'], {})
+
+    def test_growth_by_span(self):
+        events = [
+            {'name': 'read', 'ph': 'X', 'args': {'memory_kb': 40}},
+            {'name': 'read', 'ph': 'X', 'args': {'memory_kb': -8}},
+            {'name': 'read', 'ph': 'X', 'args': {'memory_kb': 100}},
+            {'name': 'sort by mtime', 'ph': 'X', 'args': {'memory_kb': 12}},
+            {'name': 'display_output', 'ph': 'X', 'args': {}},
+            {'name': 'thread_name', 'ph': 'M', 'args': {'name': 'Main'}},
+        ]
+        self.assertEqual(memory_of_minion.get_growth_by_span(events),
+                         [('read', 140, 100, 3), ('sort by mtime', 12, 12, 1)])
+
+    def test_largest_types(self):
+        held = ['x' * 100000 + str(number) for number in range(10)]
+        types = dict((name, (size, count)) for name, size, count in
+                     memory_of_minion.get_largest_types())
+        size, count = types['str']
+        self.assertTrue(size >= 1000000)
+        self.assertTrue(count >= len(held))
+
+    def test_format_memory_report(self):
+        events = [{'name': 'read', 'ph': 'X', 'args': {'memory_kb': 40}}]
+        text = memory_of_minion.format_memory_report(
+            1000, 1100, 2048, True, events, [('str', 2048000, 12)],
+            limit_mb=1)
+        self.assertEqual(text.split('\n'), [
+            'Memory (KiB):',
+            '        1000  when the command started',
+            '        1100  when it was done',
+            '        2048  at its peak, OVER max_memory_mb = 1',
+            'Memory growth by part (KiB):',
+            '       total      largest    times  part',
+            '          40           40        1  read',
+            'Objects in memory when done:',
+            '         KiB      objects  kind',
+            '        2000           12  str'])
+
+        text = memory_of_minion.format_memory_report(
+            None, None, 1000, False, [], [])
+        self.assertEqual(text.split('\n'), [
+            'Memory (KiB):',
+            '           ?  when the command started',
+            '           ?  when it was done',
+            '        1000  at the peak since the process started'])
+
+if __name__ == '__main__':
+    unittest.main()
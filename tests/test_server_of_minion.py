@@ -0,0 +1,108 @@
+'''Unit tests for the Minion server and its client '''
+import os
+import socket
+import sys
+import time
+import unittest
+from StringIO import StringIO
+from mock import patch
+
+# Our stuff
+# Ensure we can load the brain library.
+sys.path.insert(0, os.path.abspath('.'))
+import brain_of_minion as brain
+import server_of_minion
+from tests.mock_data import *
+
+TEST_SOCKET_FILE = '/tmp/test_minion_server/minion.sock'
+
+
+def handler(args):
+    ''' A command that uses everything a client has to offer. '''
+    print 'Hello', ' '.join(args['<text>'])
+    answer = raw_input('Name? ')
+    print 'Hi', answer
+    code = brain.run_program('vi notes.txt')
+    print 'Editor said', code
+    print os.getcwd(), os.environ.get('MINION_TEST')
+    sys.exit(3)
+
+
+def failing_handler(args):
+    raise ValueError('Oops')
+
+
+class TestServer(unittest.TestCase):
+
+    def setUp(self):
+        os.system('rm -rf %s' % os.path.dirname(TEST_SOCKET_FILE))
+        self.server_pid = None
+
+    def start_server(self, command_handler, requests=1):
+        ''' Serve commands in a child process. '''
+        self.server_pid = os.fork()
+        if self.server_pid == 0:
+            try:
+                server_of_minion.serve(
+                    command_handler, TEST_SOCKET_FILE,
+                    set_program_runner=brain.set_program_runner,
+                    requests=requests)
+            finally:
+                os._exit(0)
+        for _ in range(100):
+            if os.path.exists(TEST_SOCKET_FILE):
+                break
+            time.sleep(0.01)
+        time.sleep(0.05)
+
+    def call(self, args, stdin=''):
+        ''' Run the command through the server; return (code, out, err). '''
+        out, err = StringIO(), StringIO()
+        with patch('sys.stdout', new=out), patch('sys.stderr', new=err),\
+                patch('sys.stdin', new=StringIO(stdin)):
+            code = server_of_minion.call(args, TEST_SOCKET_FILE)
+        return code, out.getvalue(), err.getvalue()
+
+    def test_no_server(self):
+        self.assertEqual(server_of_minion.call({}, TEST_SOCKET_FILE), None)
+
+    @patch('server_of_minion.subprocess.call', return_value=7)
+    def test_command_runs_for_client(self, call_program):
+        self.start_server(handler)
+        os.environ['MINION_TEST'] = 'forwarded'
+        try:
+            code, out, err = self.call({'<text>': ['over', 'there']},
+                                       stdin='Gordon\n')
+        finally:
+            del os.environ['MINION_TEST']
+        self.assertEqual(code, 3)
+        self.assertEqual(out, 'Hello over there\nName? Hi Gordon\n'
+                         'Editor said 7\n%s forwarded\n' % os.getcwd())
+        call_program.assert_called_once_with('vi notes.txt', shell=True)
+
+    def test_errors_go_to_client(self):
+        self.start_server(failing_handler)
+        code, out, err = self.call({})
+        self.assertEqual(code, 1)
+        self.assertTrue('ValueError: Oops' in err)
+
+    def test_single_server(self):
+        # Checking for a running server takes a request.
+        self.start_server(failing_handler, requests=2)
+        self.assertRaises(socket.error, server_of_minion.listen,
+                          TEST_SOCKET_FILE)
+        self.assertEqual(self.call({})[0], 1)
+
+    def test_left_over_socket_file(self):
+        server = server_of_minion.listen(TEST_SOCKET_FILE)
+        server.close()
+        self.assertEqual(server_of_minion.call({}, TEST_SOCKET_FILE), None)
+        server_of_minion.listen(TEST_SOCKET_FILE).close()
+
+    def tearDown(self):
+        if self.server_pid:
+            os.waitpid(self.server_pid, 0)
+        os.system('rm -rf %s' % os.path.dirname(TEST_SOCKET_FILE))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+'''Unit tests for --stats '''
+import os
+import sys
+import threading
+import unittest
+from mock import patch
+
+# Our stuff
+# Ensure we can load the brain library.
+sys.path.insert(0, os.path.abspath('.'))
+import brain_of_minion as brain
+import stats_of_minion
+from tests.mock_data import *
+
+
+class TestCounters(unittest.TestCase):
+
+    def setUp(self):
+        stats_of_minion.reset()
+
+    def test_count(self):
+        stats_of_minion.count('files opened')
+        stats_of_minion.count('bytes read', 100)
+        stats_of_minion.count_cache('dates', True)
+        stats_of_minion.count_cache('dates', False)
+        stats_of_minion.count_cache('dates', False)
+        stats_of_minion.count_write('Hello')
+        self.assertEqual(stats_of_minion.get_counts(), {
+            'files opened': 1, 'bytes read': 100, 'dates hits': 1,
+            'dates misses': 2, 'files written': 1, 'bytes written': 5})
+        stats_of_minion.reset()
+        self.assertEqual(stats_of_minion.get_counts(), {})
+
+    def test_threads(self):
+        def count():
+            for _ in range(10000):
+                stats_of_minion.count('files stat-ed')
+        threads = [threading.Thread(target=count) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(stats_of_minion.get_counts(),
+                         {'files stat-ed': 40000})
+        # The threads are gone, and so are their counters once reset.
+        stats_of_minion.reset()
+        self.assertEqual(stats_of_minion.get_counts(), {})
+        self.assertFalse([x for x, _ in stats_of_minion.THREAD_COUNTS
+                          if x in threads])
+
+    def test_format_stats(self):
+        text = stats_of_minion.format_stats({
+            'files opened': 3, 'binary files hits': 2,
+            'binary files misses': 1, 'widgets': 7})
+        self.assertEqual(text.split('\n'), [
+            'I/O:',
+            '           0  folders listed',
+            '           0  files stat-ed',
+            '           3  files opened',
+            '           0  bytes read',
+            '           0  bytes mapped',
+            '           0  files written',
+            '           0  bytes written',
+            '           0  renames',
+            'Cache hits / misses:',
+            '       2 / 1  binary files',
+            'Other:',
+            '           7  widgets'])
+
+
+@patch('brain_of_minion.get_setting', new=mock_get_setting)
+class TestBrainCounts(unittest.TestCase):
+
+    def setUp(self):
+        os.system('rm -rf ' + TEST_DATA_DIRECTORY)
+        os.system('mkdir -p %s %s' % (TEST_DATA_INBOX, TEST_DATA_NOT_INBOX))
+        f = open(TEST_FILE_PATH, 'w')
+        f.write(TEST_FILE_CONTENT)
+        f.close()
+        brain.BINARY_FILES.clear()
+        # Only count the notes, not reading the settings.
+        brain.get_resolved_settings()
+        stats_of_minion.reset()
+
+    def tearDown(self):
+        os.system('rm -rf ' + TEST_DATA_DIRECTORY)
+
+    def test_get_files(self):
+        files = brain.get_files(TEST_DATA_DIRECTORY)
+        self.assertEqual(files, [TEST_FILE_PATH])
+        counts = stats_of_minion.get_counts()
+        # The notes folder, inbox and not_inbox.
+        self.assertEqual(counts['folders listed'], 3)
+        # The notes folder, and the two folders and the file in it.
+        self.assertEqual(counts['files stat-ed'], 4)
+
+    def test_get_file_content(self):
+        content = brain.get_file_content(TEST_FILE_PATH,
+                                         include_filename=False)
+        self.assertEqual(content, TEST_FILE_CONTENT)
+        brain.get_file_content(TEST_FILE_PATH)
+        counts = stats_of_minion.get_counts()
+        self.assertEqual(counts['files opened'], 2)
+        # The first block, to tell if it is binary, then the content.
+        self.assertEqual(counts['bytes read'],
+                         len(TEST_FILE_CONTENT) * 3)
+        self.assertEqual(counts['binary files misses'], 1)
+        self.assertEqual(counts['binary files hits'], 1)
+
+    def test_add_tags_to_file(self):
+        brain.add_tags_to_file(['ninja'], TEST_FILE_PATH)
+        f = open(TEST_FILE_PATH)
+        written = f.read()
+        f.close()
+        counts = stats_of_minion.get_counts()
+        self.assertEqual(counts['files opened'], 1)
+        self.assertEqual(counts['files written'], 1)
+        self.assertEqual(counts['bytes written'], len(written))
+
+    def test_move_to_folder(self):
+        moved = brain.move_to_folder(TEST_FILE_PATH, 'not_inbox')
+        self.assertTrue(os.path.exists(moved))
+        self.assertEqual(stats_of_minion.get_counts()['renames'], 1)
+
+if __name__ == '__main__':
+    unittest.main()
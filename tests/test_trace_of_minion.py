@@ -0,0 +1,106 @@
+'''Unit tests for --trace '''
+import json
+import os
+import sys
+import threading
+import unittest
+from mock import patch
+
+# Our stuff
+# Ensure we can load the brain library.
+sys.path.insert(0, os.path.abspath('.'))
+import brain_of_minion as brain
+import trace_of_minion
+from tests.mock_data import *
+
+TEST_TRACE_FILE = '/tmp/test_minion_trace.json'
+
+
+class TestTrace(unittest.TestCase):
+
+    def tearDown(self):
+        trace_of_minion.stop()
+        if os.path.exists(TEST_TRACE_FILE):
+            os.remove(TEST_TRACE_FILE)
+
+    def spans(self, events):
+        return [event for event in events if event['ph'] == 'X']
+
+    def test_nothing_recorded_when_off(self):
+        self.assertFalse(trace_of_minion.is_recording())
+        span = trace_of_minion.span('read', file='x')
+        self.assertTrue(span is trace_of_minion.NO_SPAN)
+        with span:
+            pass
+        self.assertEqual(trace_of_minion.stop(), [])
+
+    def test_spans(self):
+        trace_of_minion.start()
+        with trace_of_minion.span('outer', terms=['a', 'b']):
+            with trace_of_minion.span('inner', file='caf\xe9.txt'):
+                pass
+        events = trace_of_minion.stop()
+        self.assertFalse(trace_of_minion.is_recording())
+
+        outer, inner = self.spans(events)
+        self.assertEqual(outer['name'], 'outer')
+        self.assertEqual(outer['args'], {'terms': ['a', 'b']})
+        self.assertEqual(inner['args'], {'file': u'caf\ufffd.txt'})
+        self.assertTrue(outer['ts'] <= inner['ts'])
+        self.assertTrue(inner['ts'] + inner['dur'] <=
+                        outer['ts'] + outer['dur'])
+        self.assertEqual(outer['pid'], os.getpid())
+        self.assertEqual(outer['tid'], threading.current_thread().ident)
+
+    def test_threads_are_named(self):
+        trace_of_minion.start()
+        thread = threading.Thread(target=lambda: trace_of_minion.span(
+            'read', file='x').__enter__().__exit__(None, None, None),
+            name='reader')
+        thread.start()
+        thread.join()
+        events = trace_of_minion.stop()
+        names = [event for event in events if event['ph'] == 'M']
+        self.assertEqual(names, [{'name': 'thread_name', 'ph': 'M',
+                                  'pid': os.getpid(), 'tid': thread.ident,
+                                  'args': {'name': 'reader'}}])
+        self.assertEqual(self.spans(events)[0]['tid'], thread.ident)
+
+    def test_write_trace(self):
+        trace_of_minion.start()
+        with trace_of_minion.span('display_output', title=None):
+            pass
+        trace_of_minion.write_trace(TEST_TRACE_FILE, trace_of_minion.stop())
+        f = open(TEST_TRACE_FILE)
+        trace = json.load(f)
+        f.close()
+        self.assertEqual(trace['displayTimeUnit'], 'ms')
+        span, = self.spans(trace['traceEvents'])
+        self.assertEqual(span['name'], 'display_output')
+        self.assertEqual(span['args'], {'title': None})
+
+    @patch('brain_of_minion.get_setting', new=mock_get_setting)
+    def test_brain_spans(self):
+        os.system('rm -rf ' + TEST_DATA_DIRECTORY)
+        os.system('mkdir -p ' + TEST_DATA_INBOX)
+        f = open(TEST_FILE_PATH, 'w')
+        f.write(TEST_FILE_CONTENT_WITH_TAGS)
+        f.close()
+
+        trace_of_minion.start()
+        found = brain.find_files(TEST_DATA_DIRECTORY, filter=['slarti'],
+                                 full_text=True)
+        events = self.spans(trace_of_minion.stop())
+        self.assertEqual(found, [])
+        spans = [(event['name'], event['args']) for event in events]
+        self.assertTrue(('get_files', {'directory': TEST_DATA_DIRECTORY})
+                        in spans)
+        self.assertTrue(('read folder', {'folder': TEST_DATA_INBOX})
+                        in spans)
+        self.assertTrue(('match notes', {'terms': ['slarti'], 'notes': 1})
+                        in spans)
+        self.assertTrue(('read', {'file': TEST_FILE_PATH}) in spans)
+        self.assertTrue(('sort by mtime', {'files': 0}) in spans)
+
+if __name__ == '__main__':
+    unittest.main()
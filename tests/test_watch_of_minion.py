@@ -0,0 +1,164 @@
+'''Unit tests for the Minion file watcher '''
+import os
+import sys
+import time
+import unittest
+from mock import patch
+
+# Our stuff
+# Ensure we can load the brain library.
+sys.path.insert(0, os.path.abspath('.'))
+import brain_of_minion as brain
+import watch_of_minion
+from index_of_minion import NoteIndex
+from tests.mock_data import *
+
+
+def write_file(filename, content):
+    folder = os.path.dirname(filename)
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    f = open(filename, 'w')
+    f.write(content)
+    f.close()
+
+
+class WatcherTests(object):
+    ''' Changes made behind Minion's back should reach the index.
+        Mixed into a test case per kind of watcher.
+    '''
+
+    def setUp(self):
+        os.system('rm -rf %s %s' % (TEST_DATA_DIRECTORY,
+                                    os.path.dirname(TEST_INDEX_FILE)))
+        write_file(TEST_DATA_INBOX + '/one.txt', TEST_FILE_CONTENT)
+        write_file(TEST_DATA_NOT_INBOX + '/two.txt', TEST_FILE_CONTENT)
+        self.index = NoteIndex(TEST_INDEX_FILE, TEST_DATA_DIRECTORY,
+                               self.extract)
+        files, folders = self.scan(TEST_DATA_DIRECTORY)
+        self.index.refresh(files, folders)
+        self.watcher = self.make_watcher(TEST_DATA_DIRECTORY)
+
+    def extract(self, filename):
+        with patch('brain_of_minion.get_setting',
+                   new=mock_get_setting_with_index):
+            return brain.extract_note_metadata(filename)
+
+    def scan(self, directory):
+        with patch('brain_of_minion.get_setting',
+                   new=mock_get_setting_with_index):
+            return brain.get_file_stats(directory)
+
+    def watch(self):
+        # Make sure modification times move on.
+        time.sleep(0.01)
+        watch_of_minion.watch(self.index, self.scan, 0.05, self.watcher,
+                              loops=1)
+
+    def assertIndexMatchesDisk(self):
+        files, folders = self.scan(TEST_DATA_DIRECTORY)
+        self.assertEqual(
+            self.index.get_files(),
+            dict((path, file_stat.st_mtime) for path, file_stat in files))
+        self.assertEqual(
+            self.index.get_folders(TEST_DATA_DIRECTORY),
+            sorted(path for path, _ in folders
+                   if os.path.dirname(path) == TEST_DATA_DIRECTORY))
+
+    def test_new_and_removed_files(self):
+        write_file(TEST_DATA_INBOX + '/three.txt', 'New ninja note')
+        os.remove(TEST_DATA_NOT_INBOX + '/two.txt')
+        self.watch()
+        self.assertIndexMatchesDisk()
+        self.assertEqual(self.index.search_text('ninja')[0],
+                         set([TEST_DATA_INBOX + '/three.txt']))
+
+    def test_renamed_and_replaced_files(self):
+        os.rename(TEST_DATA_INBOX + '/one.txt', TEST_DATA_INBOX + '/1.txt')
+        write_file(TEST_DATA_NOT_INBOX + '/two.tmp', 'Shuriken')
+        os.rename(TEST_DATA_NOT_INBOX + '/two.tmp',
+                  TEST_DATA_NOT_INBOX + '/two.txt')
+        self.watch()
+        self.assertIndexMatchesDisk()
+        self.assertEqual(self.index.search_text('shuriken')[0],
+                         set([TEST_DATA_NOT_INBOX + '/two.txt']))
+
+    def test_edited_in_place(self):
+        f = open(TEST_DATA_INBOX + '/one.txt', 'a')
+        f.write('\n:tags: shuriken\n')
+        f.close()
+        # Polling only checks files now and then.
+        self.watcher.polls = watch_of_minion.FULL_CHECK_POLLS - 1
+        self.watch()
+        self.assertIndexMatchesDisk()
+        self.assertEqual(self.index.get_tagged_files(['shuriken']),
+                         set([TEST_DATA_INBOX + '/one.txt']))
+
+    def test_folders(self):
+        write_file(TEST_DATA_DIRECTORY + '/new/deep/three.txt', 'Three')
+        os.rename(TEST_DATA_NOT_INBOX, TEST_DATA_DIRECTORY + '/moved')
+        self.watch()
+        self.assertIndexMatchesDisk()
+
+        os.system('rm -rf %s' % (TEST_DATA_DIRECTORY + '/new'))
+        write_file(TEST_DATA_DIRECTORY + '/moved/four.txt', 'Four')
+        self.watch()
+        self.assertIndexMatchesDisk()
+
+    def test_watch_checks_in(self):
+        self.index.refreshed_at = None
+        self.assertEqual(self.index.age(), None)
+        self.watch()
+        self.assertTrue(self.index.age() < 1)
+
+    def tearDown(self):
+        self.watcher.close()
+        self.index.close()
+        os.system('rm -rf %s %s' % (TEST_DATA_DIRECTORY,
+                                    os.path.dirname(TEST_INDEX_FILE)))
+
+
+class TestPollingWatcher(WatcherTests, unittest.TestCase):
+
+    def make_watcher(self, directory):
+        return watch_of_minion.PollingWatcher(directory)
+
+
+class TestInotifyWatcher(WatcherTests, unittest.TestCase):
+
+    def make_watcher(self, directory):
+        return watch_of_minion.InotifyWatcher(directory)
+
+
+@patch('brain_of_minion.get_setting', new=mock_get_setting_with_index)
+class TestWatchedIndex(unittest.TestCase):
+    ''' Other commands trust an index that a watcher keeps up to date. '''
+
+    def setUp(self):
+        os.system('rm -rf %s %s' % (TEST_DATA_DIRECTORY,
+                                    os.path.dirname(TEST_INDEX_FILE)))
+        write_file(TEST_DATA_INBOX + '/one.txt', TEST_FILE_CONTENT)
+
+    def test_no_rescan_while_watched(self):
+        index = brain.get_note_index()
+        # As if another process had refreshed the index.
+        index.refreshed_at = None
+        index.mark_watched()
+        with patch('brain_of_minion.get_file_stats') as get_file_stats:
+            with patch('brain_of_minion.get_setting') as get_setting:
+                get_setting.side_effect = self.max_age_one_minute
+                self.assertEqual(brain.find_files(),
+                                 [TEST_DATA_INBOX + '/one.txt'])
+        self.assertFalse(get_file_stats.called)
+
+    def max_age_one_minute(self, section, key):
+        if (section, key) == ('performance', 'index_max_age'):
+            return '60'
+        return mock_get_setting_with_index(section, key)
+
+    def tearDown(self):
+        os.system('rm -rf %s %s' % (TEST_DATA_DIRECTORY,
+                                    os.path.dirname(TEST_INDEX_FILE)))
+
+if __name__ == '__main__':
+    unittest.main()
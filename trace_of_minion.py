@@ -0,0 +1,174 @@
+''' Record where the time goes while a command runs, for --trace.
+
+Parts of the work (loading settings, reading a folder or a note, matching
+notes, sorting, output and editors) are wrapped in spans:
+
+    with span('read folder', folder=directory):
+        ...
+
+Nothing is recorded until start() is called; until then span() hands out
+the same do-nothing span, so the cost is a function call.
+
+The spans are written in the Chrome trace event format (JSON), which
+chrome://tracing, https://ui.perfetto.dev and speedscope can show. Spans
+from worker threads get a row of their own.
+
+Given a function that tells the memory in use, start() also has each span
+note how much more memory was in use after it than before (memory_kb).
+'''
+
+################################################################################
+# IMPORTS
+################################################################################
+
+import json
+import os
+import threading
+from timeit import default_timer as timer
+
+################################################################################
+# GLOBAL CONSTANTS
+################################################################################
+
+# (name, started, ended, thread id, args) for each span, while recording.
+EVENTS = None
+
+# {thread id: thread name} for the threads that recorded spans.
+THREADS = {}
+
+# When recording started; times in the trace are counted from here.
+STARTED = 0.0
+
+# Returns the memory in use, in KiB, while spans note it.
+MEASURE_MEMORY = None
+
+################################################################################
+# CLASSES
+################################################################################
+
+
+class Span(object):
+    ''' Times the with block it is used in. '''
+
+    __slots__ = ('name', 'args', 'started', 'memory')
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+        self.started = None
+        self.memory = None
+
+    def __enter__(self):
+        if MEASURE_MEMORY is not None:
+            self.memory = MEASURE_MEMORY()
+        self.started = timer()
+        return self
+
+    def __exit__(self, *exc_info):
+        ended = timer()
+        if self.memory is not None and MEASURE_MEMORY is not None:
+            self.args['memory_kb'] = MEASURE_MEMORY() - self.memory
+        events = EVENTS
+        if events is not None:
+            thread = threading.current_thread()
+            THREADS[thread.ident] = thread.name
+            events.append((self.name, self.started, ended, thread.ident,
+                           self.args))
+        return False
+
+
+class NoSpan(object):
+    ''' Stands in for a span when nothing is recorded. '''
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NO_SPAN = NoSpan()
+
+################################################################################
+# FUNCTIONS
+################################################################################
+
+
+def span(name, **args):
+    ''' Return a context manager that records the time its block takes as
+        a span with the given name. args are shown with the span.
+    '''
+    if EVENTS is None:
+        return NO_SPAN
+    return Span(name, args)
+
+
+def is_recording():
+    return EVENTS is not None
+
+
+def start(measure_memory=None):
+    ''' Start recording spans, forgetting any recorded before. With
+        measure_memory (returning KiB in use, or None), spans note how much
+        the memory in use grew.
+    '''
+    global EVENTS, STARTED, MEASURE_MEMORY
+    THREADS.clear()
+    MEASURE_MEMORY = measure_memory
+    STARTED = timer()
+    EVENTS = []
+
+
+def stop():
+    ''' Stop recording. Returns the trace events recorded since start(). '''
+    global EVENTS, MEASURE_MEMORY
+    events, EVENTS = EVENTS, None
+    MEASURE_MEMORY = None
+    if events is None:
+        return []
+    return get_trace_events(events, THREADS, STARTED)
+
+
+def _to_json(value):
+    ''' Filenames may not be UTF-8, which json cannot write. '''
+    if isinstance(value, str):
+        return value.decode('utf-8', 'replace')
+    if isinstance(value, (list, tuple, set)):
+        return [_to_json(item) for item in value]
+    return value
+
+
+def get_trace_events(events, threads, started):
+    ''' Return the spans as Chrome trace events: complete ('X') events, with
+        times in microseconds, and a name ('M') event for each thread.
+    '''
+    pid = os.getpid()
+    trace_events = [{'name': 'thread_name', 'ph': 'M', 'pid': pid,
+                     'tid': tid, 'args': {'name': name}}
+                    for tid, name in sorted(threads.items())]
+    for name, begun, ended, tid, args in events:
+        trace_events.append({
+            'name': name,
+            'ph': 'X',
+            'ts': (begun - started) * 1e6,
+            'dur': (ended - begun) * 1e6,
+            'pid': pid,
+            'tid': tid,
+            'args': dict((key, _to_json(value))
+                         for key, value in args.items()),
+        })
+    # Viewers want parents before the spans inside them.
+    trace_events.sort(key=lambda event: (event.get('ts', -1),
+                                         -event.get('dur', 0)))
+    return trace_events
+
+
+def write_trace(filename, trace_events):
+    ''' Write the events as a Chrome trace file. '''
+    f = open(filename, 'w')
+    try:
+        json.dump({'traceEvents': trace_events, 'displayTimeUnit': 'ms'}, f)
+    finally:
+        f.close()
@@ -0,0 +1,280 @@
+''' Keep the note index up to date as files change.
+
+Other programs (sync clients, editors, mail clients saving messages) change
+files under Minion's nose. `minion watch` runs watch(), which applies those
+changes to the note index as they happen, and checks in with the index
+regularly, so other Minion commands can trust it without walking the notes
+folder again.
+
+On Linux, changes are reported by inotify. Elsewhere (or when inotify is not
+available) folders are polled: a folder whose modification time changed is
+listed again, which notices files being created, removed, renamed or
+replaced. Edits made in place do not change the folder, so every now and
+then all files are checked as well.
+'''
+
+################################################################################
+# IMPORTS
+################################################################################
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import stat
+import struct
+import time
+
+################################################################################
+# GLOBAL CONSTANTS
+################################################################################
+
+# From <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |
+              IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF |
+              IN_ONLYDIR)
+
+# struct inotify_event {int wd; uint32_t mask, cookie, len; char name[];}
+EVENT_HEADER = struct.Struct('iIII')
+
+# How many polls pass between checks of every file, when polling.
+FULL_CHECK_POLLS = 60
+
+################################################################################
+# CLASSES
+################################################################################
+
+
+class InotifyWatcher(object):
+    ''' Changes below a folder, as reported by Linux inotify. '''
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self.libc.inotify_init()
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        self.folders = {}
+        self.add_tree(directory)
+
+    def add_tree(self, directory):
+        ''' Watch the directory and every folder below it. '''
+        for folder, _, _ in os.walk(directory):
+            wd = self.libc.inotify_add_watch(self.fd, folder, WATCH_MASK)
+            if wd >= 0:
+                self.folders[wd] = folder
+
+    def remove_tree(self, directory):
+        ''' Stop watching the directory and every folder below it. '''
+        prefix = directory.rstrip('/') + '/'
+        for wd, folder in self.folders.items():
+            if folder == directory or folder.startswith(prefix):
+                self.libc.inotify_rm_watch(self.fd, wd)
+                del self.folders[wd]
+
+    def changes(self, timeout):
+        ''' Wait up to timeout seconds, and return the set of paths that
+            changed. Folders in the set had their whole content changed
+            (created, or moved in).
+        '''
+        changed = set()
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        while ready:
+            try:
+                data = os.read(self.fd, 65536)
+            except OSError as e:
+                if e.errno != errno.EINTR:
+                    raise
+                continue
+            changed.update(self._parse(data))
+            ready, _, _ = select.select([self.fd], [], [], 0)
+        return changed
+
+    def _parse(self, data):
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip('\0')
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                # Events were lost; everything may have changed.
+                yield self.directory
+                continue
+            if mask & IN_IGNORED:
+                self.folders.pop(wd, None)
+                continue
+            folder = self.folders.get(wd)
+            if folder is None:
+                continue
+            if mask & IN_DELETE_SELF:
+                yield folder
+                continue
+
+            path = os.path.join(folder, name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    self.add_tree(path)
+                    yield path
+                elif mask & (IN_DELETE | IN_MOVED_FROM):
+                    self.remove_tree(path)
+                    yield path
+            else:
+                yield path
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher(object):
+    ''' Changes below a folder, found by polling folder modification times.
+    '''
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.folders = {}
+        self.polls = 0
+        self._read_tree(directory)
+
+    def _read_tree(self, directory):
+        for folder, _, _ in os.walk(directory):
+            self._read_folder(folder)
+
+    def _read_folder(self, folder):
+        ''' Remember the folder's modification time and content. '''
+        try:
+            mtime = os.stat(folder).st_mtime
+            names = os.listdir(folder)
+        except OSError:
+            return
+        items = {}
+        for name in names:
+            items[name] = _item_key(os.path.join(folder, name))
+        self.folders[folder] = (mtime, items)
+
+    def _forget_tree(self, directory):
+        prefix = directory.rstrip('/') + '/'
+        for folder in self.folders.keys():
+            if folder == directory or folder.startswith(prefix):
+                del self.folders[folder]
+
+    def changes(self, timeout):
+        ''' Wait timeout seconds, and return the set of paths that changed.
+            Folders in the set had their whole content changed.
+        '''
+        time.sleep(timeout)
+        self.polls += 1
+        check_files = self.polls % FULL_CHECK_POLLS == 0
+
+        changed = set()
+        for folder, (mtime, items) in self.folders.items():
+            if folder not in self.folders:
+                # Forgotten while going through the list.
+                continue
+            try:
+                folder_changed = os.stat(folder).st_mtime != mtime
+            except OSError:
+                self._forget_tree(folder)
+                changed.add(folder)
+                continue
+            if not folder_changed and not check_files:
+                continue
+
+            self._read_folder(folder)
+            new_items = self.folders[folder][1]
+            for name in set(items) | set(new_items):
+                old_key, new_key = items.get(name), new_items.get(name)
+                if old_key == new_key:
+                    continue
+                path = os.path.join(folder, name)
+                if old_key is not None and old_key[0]:
+                    self._forget_tree(path)
+                if new_key is not None and new_key[0]:
+                    self._read_tree(path)
+                changed.add(path)
+        return changed
+
+    def close(self):
+        pass
+
+
+################################################################################
+# FUNCTIONS
+################################################################################
+
+def _item_key(path):
+    ''' What the poller compares: (is folder, size, mtime), or None. '''
+    try:
+        item_stat = os.stat(path)
+    except OSError:
+        return None
+    if stat.S_ISDIR(item_stat.st_mode):
+        return (True, None, None)
+    return (False, item_stat.st_size, item_stat.st_mtime)
+
+
+def get_watcher(directory):
+    ''' Return an inotify watcher for the directory if possible, otherwise
+        a polling one.
+    '''
+    try:
+        return InotifyWatcher(directory)
+    except (OSError, AttributeError, TypeError):
+        return PollingWatcher(directory)
+
+
+def apply_change(index, scan, path):
+    ''' Bring the index up to date with a changed path.
+
+        scan(directory) returns the (files, folders) below a folder, as
+        (path, stat) pairs, for folders that changed as a whole.
+    '''
+    if os.path.isdir(path):
+        index.update_path(path)
+        files, folders = scan(path)
+        index.refresh(files, folders, directory=path)
+    else:
+        index.update_path(path)
+
+
+def watch(index, scan, interval=1.0, watcher=None, loops=None):
+    ''' Apply the changes below the notes home to the index as they happen,
+        checking in with the index at least every interval seconds.
+
+        Runs until interrupted, or for the given number of loops. A watcher
+        passed in is left open.
+    '''
+    own_watcher = watcher is None
+    if own_watcher:
+        watcher = get_watcher(index.notes_home)
+    index_files = index.index_file + '-'
+    try:
+        index.mark_watched()
+        while loops is None or loops > 0:
+            for path in sorted(watcher.changes(interval)):
+                # The index may live inside the notes home.
+                if path == index.index_file or path.startswith(index_files):
+                    continue
+                apply_change(index, scan, path)
+            index.mark_watched()
+            if loops is not None:
+                loops -= 1
+    finally:
+        if own_watcher:
+            watcher.close()